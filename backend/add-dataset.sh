@@ -54,6 +54,12 @@ if ! python3 -m src.db_utilities.create_and_populate_embeddings_collection -c "$
   exit
 fi
 
+# Create neighbor graph
+echo "Creating neighbor graph..."
+if ! python3 -m src.db_utilities.create_neighbor_graph -c "$dataset_name"; then
+  exit
+fi
+
 # Create tiles and image-to-tile collections
 echo "Creating tiles and image-to-tile collections..."
 if ! python3 -m src.db_utilities.create_and_populate_clusters_collection -c "$dataset_name" -r y; then
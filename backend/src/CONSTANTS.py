@@ -7,11 +7,38 @@ UMAP_PROJ = "umap"
 RANDOM_STATE = 42
 BATCH_SIZE = 32
 DEVICE = "cpu"
+# Precisions of the text encoder of CLIP. The int8 text encoder has its linear layers quantized dynamically, and it is
+# only available on the CPU.
+TEXT_ENCODER_PRECISIONS = ["fp32", "int8"]
+DEFAULT_TEXT_ENCODER_PRECISION = "fp32"
+# Minimum agreements between the int8 and the fp32 text encoders required by verify_text_encoder_quantization
+MIN_QUANTIZED_COSINE_AGREEMENT = 0.99
+MIN_QUANTIZED_TOP1_AGREEMENT = 0.95
+# Backends running CLIP. The onnx backend runs the graphs exported by src.embeddings_model.export_onnx under ONNX
+# Runtime.
+EMBEDDINGS_BACKENDS = ["torch", "onnx"]
+DEFAULT_EMBEDDINGS_BACKEND = "torch"
+ONNX_MODEL_DIR_NAME = "clip-vit-base-patch16-onnx"
+ONNX_TEXT_MODEL_FILE_NAME = "text.onnx"
+ONNX_IMAGE_MODEL_FILE_NAME = "image.onnx"
+ONNX_OPSET = 17
+ONNX_EXPORT_TOLERANCE = 1e-3
+# Number of threads used within an operator by each ONNX Runtime session. 0 lets ONNX Runtime use one thread per
+# physical core.
+DEFAULT_ONNX_INTRA_OP_THREADS = 0
+# Embeddings service owning the model shared by the workers of the backend
+DEFAULT_EMBEDDINGS_SERVICE_ADDRESS = "/tmp/embeddings.sock"
+EMBEDDINGS_SERVICE_CONNECT_TIMEOUT = 600
+EMBEDDINGS_SERVICE_MAX_CONNECTIONS = 64
+INFERENCE_BATCHING_WINDOW = 0.005
+INFERENCE_MAX_BATCH_SIZE = 32
 NUM_WORKERS = 0
 MAX_IMAGE_PIXELS = 110000000
+CLIP_IMAGE_SIZE = 224
 DATASETS_JSON_NAME = "image-viz/backend/datasets.json"
 NGINX_CONF_JSON_NAME = "image-viz/nginx/nginx.conf.json"
 DOCKER_COMPOSE_YML_NAME = "image-viz/docker-compose.yaml"
+DATA_DIR_NAME = "image-viz/backend/data"
 
 # Database constants
 INSERT_SIZE = 500
@@ -22,12 +49,28 @@ DEFAULT_DATABASE_NAME = "aiplusart"
 COSINE_METRIC = "COSINE"
 L2_METRIC = "L2"
 INDEX_TYPE = "FLAT"
+# Index types of the embeddings collections, with their default build and search parameters. Each dataset can choose
+# its index in the "embeddings_index" field of its entry in datasets.json.
+DEFAULT_EMBEDDINGS_INDEX_PARAMS = {
+    "FLAT": {"params": {}, "search_params": {}},
+    "HNSW": {"params": {"M": 16, "efConstruction": 200}, "search_params": {"ef": 64}},
+    "IVF_FLAT": {"params": {"nlist": 1024}, "search_params": {"nprobe": 16}},
+    "IVF_PQ": {"params": {"nlist": 1024, "m": 64, "nbits": 8}, "search_params": {"nprobe": 16}}
+}
 
 # Environment variables names
 MILVUS_IP = "MILVUS_IP"
 MILVUS_PORT = "MILVUS_PORT"
 ROOT = "ROOT"
 ENV_FILE_LOCATION = "ENV_FILE_LOCATION"
+UPLOAD_MAX_PIXELS = "UPLOAD_MAX_PIXELS"
+TEXT_ENCODER_PRECISION = "TEXT_ENCODER_PRECISION"
+EMBEDDINGS_BACKEND = "EMBEDDINGS_BACKEND"
+ONNX_INTRA_OP_THREADS = "ONNX_INTRA_OP_THREADS"
+EMBEDDINGS_SERVICE = "EMBEDDINGS_SERVICE"
+EMBEDDINGS_SERVICE_AUTHKEY = "EMBEDDINGS_SERVICE_AUTHKEY"
+BACKEND_WORKERS = "BACKEND_WORKERS"
+PROMETHEUS_MULTIPROC_DIR = "PROMETHEUS_MULTIPROC_DIR"
 HOME = "HOME"
 
 # UMAP data variables
@@ -39,6 +82,20 @@ MIN_DISTS = [0.0, 0.1, 0.25, 0.5, 0.8, 0.99]
 WINDOW_SIZE_IN_CELLS_PER_DIM = 10
 IMAGE_WIDTH = 1280
 IMAGE_HEIGHT = 920
+FIRST_TILES_MAX_ZOOM_LEVEL = 5
+
+# Variables for files generated for each dataset
+FIRST_TILES_FILE_NAME = "first_tiles.json.gz"
+EMBEDDINGS_FILE_NAME = "embeddings.npy"
+EMBEDDING_IDS_FILE_NAME = "embedding_ids.npy"
+NEIGHBOR_INDEXES_FILE_NAME = "neighbor_indexes.npy"
+NEIGHBOR_SCORES_FILE_NAME = "neighbor_scores.npy"
+METADATA_FILE_NAME = "metadata.npz"
+
+# Variables for the neighbor graph
+NEIGHBOR_GRAPH_K = 100
+NEIGHBOR_GRAPH_QUERY_BLOCK_SIZE = 1024
+NEIGHBOR_GRAPH_BLOCK_SIZE = 8192
 
 # Variables for resizing images
 RESIZING_WIDTH = 384
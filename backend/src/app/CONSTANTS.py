@@ -1,2 +1,42 @@
-COUNTER_MAX_VALUE = 1000
 DATASETS_JSON_PATH = "/datasets.json"
+DATA_DIR_PATH = "/data"
+TILE_CACHE_MAX_BYTES = 268435456
+TILE_CACHE_VALIDATION_INTERVAL = 30
+TILE_OUTPUT_FIELDS = ["index", "data", "range"]
+FIRST_TILES_LIMIT = 1365
+STREAM_PAGE_SIZE = 64
+TEXT_EMBEDDING_CACHE_SIZE = 10000
+TEXT_EMBEDDING_CACHE_PATH = "/data/text_embeddings_cache.sqlite3"
+IMAGE_EMBEDDING_CACHE_SIZE = 256
+DEFAULT_UPLOAD_MAX_PIXELS = 25000000
+UPLOAD_DECODE_WORKERS = 4
+SEARCH_OUTPUT_FIELDS = ["index", "author", "path", "width", "height", "genre", "date", "title", "caption", "x", "y"]
+MAX_TEXT_QUERIES_PER_BATCH = 1024
+MAX_TOP_K = 1024
+MAX_NEIGHBOR_QUERIES_PER_BATCH = 1024
+MAX_METADATA_INDEXES_PER_BATCH = 16384
+MAX_VIEWPORT_CACHED_INDEXES = 65536
+MILVUS_IO_WORKERS = 32
+MILVUS_CALL_TIMEOUT = 10
+DEFAULT_SEARCH_ENGINE = "milvus"
+SEARCH_ENGINES = ["milvus", "local"]
+LOCAL_SEARCH_BLOCK_SIZE = 65536
+UMAP_FORMATS = ["json", "float32", "float16"]
+UMAP_VALIDATION_INTERVAL = 300
+UMAP_CACHE_MAX_AGE = 3600
+DATASET_CACHE_MAX_AGE = 3600
+VERSIONED_CACHE_MAX_AGE = 31536000
+CATALOG_REFRESH_INTERVAL = 30
+CATALOG_STAT_INTERVAL = 1
+RESIDENCY_MEMORY_BUDGET = 8589934592
+RESIDENCY_POLICY = "lru"
+RESIDENCY_POLICIES = ["lru", "lfu"]
+RESIDENCY_EVICTION_GRACE = 30
+RESIDENCY_LOAD_TIMEOUT = 120
+RESIDENCY_LOAD_WORKERS = 2
+RESIDENCY_VARIABLE_FIELD_BYTES = 256
+RESIDENCY_STATE_CHECK_INTERVAL = 5
+READINESS_COMPONENTS = ["milvus", "catalog", "clusters", "collections"]
+STARTUP_RETRIES = 8
+STARTUP_RETRY_BACKOFF = 1
+STARTUP_MAX_BACKOFF = 60
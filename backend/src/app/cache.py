@@ -0,0 +1,353 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+from pymilvus import Collection
+
+from .CONSTANTS import *
+
+
+def get_collection_generation(collection: Collection) -> Tuple[int, int]:
+    """
+    Get a value identifying the current build of a collection. The id of a collection changes every time the
+    collection is dropped and created again, while the number of entities changes whenever data is inserted or deleted.
+    @param collection:
+    @return: tuple (collection id, number of entities).
+    """
+    return collection.describe()["collection_id"], collection.num_entities
+
+
+class TileCache:
+    """
+    LRU cache for tiles, keyed by (collection name, tile index). The size of the cache is bounded by the approximate
+    size in bytes of the cached tiles, measured as the length of their JSON serialization. The tiles of a collection
+    are dropped as soon as the collection is rebuilt or its number of entities changes.
+    """
+
+    def __init__(self, max_bytes: int = TILE_CACHE_MAX_BYTES,
+                 validation_interval: float = TILE_CACHE_VALIDATION_INTERVAL):
+        """
+        @param max_bytes: maximum size of the cached tiles in bytes.
+        @param validation_interval: number of seconds after which the generation of a collection is checked again.
+        """
+        self.max_bytes = max_bytes
+        self.validation_interval = validation_interval
+        # Map (collection name, tile index) to (tile, size of tile). The order of the keys is the order of use.
+        self._tiles = OrderedDict()
+        # Map collection name to (generation, time of last check)
+        self._generations = {}
+        self._size = 0
+        # Define counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Create lock to ensure that the cache is not modified by multiple threads at the same time
+        self.lock = threading.Lock()
+
+    def validate(self, collection: Collection) -> Tuple[int, int]:
+        """
+        Check whether the collection has been rebuilt since its tiles were cached, and drop the tiles if it has. The
+        check queries Milvus at most once every validation_interval seconds.
+        @param collection:
+        @return: the generation of the collection.
+        """
+        generation = self.get_generation(collection.name)
+        if generation is None:
+            generation = get_collection_generation(collection)
+            self.set_generation(collection.name, generation)
+        return generation
+
+    def get_generation(self, collection_name: str) -> Tuple[int, int] | None:
+        """
+        Get the last known generation of a collection.
+        @param collection_name:
+        @return: the generation, or None if it has never been checked or it must be checked again.
+        """
+        with self.lock:
+            entry = self._generations.get(collection_name)
+        if entry is not None and time.monotonic() - entry[1] < self.validation_interval:
+            return entry[0]
+        return None
+
+    def set_generation(self, collection_name: str, generation: Tuple[int, int]):
+        """
+        Record the current generation of a collection, dropping its tiles if the generation has changed.
+        @param collection_name:
+        @param generation:
+        @return:
+        """
+        with self.lock:
+            entry = self._generations.get(collection_name)
+            if entry is not None and generation != entry[0]:
+                # The collection has been rebuilt, so drop its tiles
+                self._drop(collection_name)
+                self.invalidations += 1
+            self._generations[collection_name] = (generation, time.monotonic())
+
+    def get_many(self, collection_name: str, indexes: List[int]) -> Tuple[dict, List[int]]:
+        """
+        Get the cached tiles with the given indexes.
+        @param collection_name:
+        @param indexes:
+        @return: dictionary mapping indexes to cached tiles, and list of indexes that are not in the cache.
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            for index in indexes:
+                key = (collection_name, index)
+                if key in self._tiles:
+                    self._tiles.move_to_end(key)
+                    found[index] = self._tiles[key][0]
+                    self.hits += 1
+                else:
+                    missing.append(index)
+                    self.misses += 1
+        return found, missing
+
+    def put_many(self, collection_name: str, tiles: List[dict]):
+        """
+        Add tiles to the cache, evicting the least recently used tiles if the cache becomes too large.
+        @param collection_name:
+        @param tiles: list of tiles. Each tile must have the field "index".
+        @return:
+        """
+        # Compute sizes outside the lock
+        sized_tiles = [(tile, len(json.dumps(tile))) for tile in tiles]
+        with self.lock:
+            for tile, size in sized_tiles:
+                if size > self.max_bytes:
+                    continue
+                key = (collection_name, tile["index"])
+                if key in self._tiles:
+                    self._size -= self._tiles.pop(key)[1]
+                self._tiles[key] = (tile, size)
+                self._size += size
+            # Evict least recently used tiles
+            while self._size > self.max_bytes:
+                _, (_, size) = self._tiles.popitem(last=False)
+                self._size -= size
+                self.evictions += 1
+
+    def invalidate(self, collection_name: str | None = None):
+        """
+        Drop the cached tiles of a collection, or of all collections if collection_name is None.
+        @param collection_name:
+        @return:
+        """
+        with self.lock:
+            if collection_name is None:
+                self._tiles.clear()
+                self._generations.clear()
+                self._size = 0
+            else:
+                self._drop(collection_name)
+                self._generations.pop(collection_name, None)
+            self.invalidations += 1
+
+    def _drop(self, collection_name: str):
+        # Must be called while holding the lock
+        for key in [key for key in self._tiles.keys() if key[0] == collection_name]:
+            self._size -= self._tiles.pop(key)[1]
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._tiles),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests > 0 else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text query. The CLIP tokenizer lower-cases texts and collapses whitespaces, so normalized texts have
+    the same embeddings as the original ones.
+    @param text:
+    @return:
+    """
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingCache:
+    """
+    LRU cache mapping keys to embeddings, kept in memory. Embeddings are keyed by the name of the model, so that
+    embeddings computed by a different model are never returned. Subclasses can add a second tier, which is read on
+    memory misses and written with every new embedding. The second tier is accessed without holding the lock of the
+    memory tier, so that slow reads and writes never delay memory hits.
+    """
+
+    def __init__(self, model_name: str, max_entries: int):
+        """
+        @param model_name: name of the model generating the embeddings.
+        @param max_entries: maximum number of embeddings kept in memory.
+        """
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._embeddings = OrderedDict()
+        # Define counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # Create lock to ensure that the cache is not modified by multiple threads at the same time
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> np.ndarray | None:
+        """
+        Get an embedding.
+        @param key:
+        @return: embedding as a 1-dimensional float32 array, or None if the key is not in the cache.
+        """
+        with self.lock:
+            if key in self._embeddings:
+                self._embeddings.move_to_end(key)
+                self.memory_hits += 1
+                return self._embeddings[key]
+
+        embedding = self._get_from_disk(key)
+        with self.lock:
+            if embedding is not None:
+                self._put_in_memory(key, embedding)
+                self.disk_hits += 1
+                return embedding
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, embedding: np.ndarray):
+        """
+        Add an embedding to the cache.
+        @param key:
+        @param embedding: 1-dimensional array.
+        @return:
+        """
+        embedding = np.ascontiguousarray(embedding, dtype=np.float32).reshape(-1)
+        with self.lock:
+            self._put_in_memory(key, embedding)
+        self._put_on_disk(key, embedding)
+
+    def _put_in_memory(self, key: str, embedding: np.ndarray):
+        # Must be called while holding the lock
+        self._embeddings[key] = embedding
+        self._embeddings.move_to_end(key)
+        while len(self._embeddings) > self.max_entries:
+            self._embeddings.popitem(last=False)
+
+    def _get_from_disk(self, key: str) -> np.ndarray | None:
+        # Called without holding the lock. There is no second tier by default.
+        return None
+
+    def _put_on_disk(self, key: str, embedding: np.ndarray):
+        # Called without holding the lock. There is no second tier by default.
+        pass
+
+    def has_disk_tier(self) -> bool:
+        return False
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self._embeddings),
+                "max_entries": self.max_entries,
+                "disk_tier": self.has_disk_tier(),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / requests if requests > 0 else 0.0
+            }
+
+
+class TextEmbeddingCache(EmbeddingCache):
+    """
+    LRU cache mapping normalized text queries to their embeddings. The cache has an optional second tier on disk,
+    stored in an SQLite database, which survives restarts. The database is shared by the workers of the backend, so
+    errors of the second tier, such as a locked database or a full disk, are printed and the memory tier is used alone.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = TEXT_EMBEDDING_CACHE_SIZE, path: str | None = None):
+        """
+        @param model_name: name of the model generating the embeddings.
+        @param max_entries: maximum number of embeddings kept in memory.
+        @param path: path of the SQLite database used as second tier. If None, only the memory tier is used.
+        """
+        super().__init__(model_name, max_entries)
+
+        # Open database for second tier
+        self._db = None
+        # Create lock to ensure that the database is not used by multiple threads at the same time
+        self._db_lock = threading.Lock()
+        if path is not None:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute("CREATE TABLE IF NOT EXISTS text_embeddings (model TEXT NOT NULL, text TEXT NOT NULL, "
+                                 "embedding BLOB NOT NULL, PRIMARY KEY (model, text))")
+                self._db.commit()
+            except (OSError, sqlite3.Error) as e:
+                print("Error in opening text embedding cache database, using memory tier only. Error: ", e)
+                self._db = None
+
+    def _get_from_disk(self, text: str) -> np.ndarray | None:
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute("SELECT embedding FROM text_embeddings WHERE model = ? AND text = ?",
+                                       (self.model_name, text)).fetchone()
+        except sqlite3.Error as e:
+            print("Error in reading text embedding cache database, using memory tier only. Error: ", e)
+            return None
+        return np.frombuffer(row[0], dtype=np.float32) if row is not None else None
+
+    def _put_on_disk(self, text: str, embedding: np.ndarray):
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                with self._db:
+                    # Commit the insertion, or roll it back if it fails
+                    self._db.execute("INSERT OR REPLACE INTO text_embeddings (model, text, embedding) VALUES (?, ?, ?)",
+                                     (self.model_name, text, embedding.tobytes()))
+        except sqlite3.Error as e:
+            print("Error in writing text embedding cache database, using memory tier only. Error: ", e)
+
+    def has_disk_tier(self) -> bool:
+        return self._db is not None
+
+
+class ImageEmbeddingCache(EmbeddingCache):
+    """
+    LRU cache mapping the SHA-256 hash of uploaded images to their embeddings. Only the memory tier is used, as the
+    same image is rarely uploaded again after a restart.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = IMAGE_EMBEDDING_CACHE_SIZE):
+        """
+        @param model_name: name of the model generating the embeddings.
+        @param max_entries: maximum number of embeddings kept in memory.
+        """
+        super().__init__(model_name, max_entries)
+
+    @staticmethod
+    def get_key(data: bytes) -> str:
+        """
+        Get the key of an uploaded image.
+        @param data: content of the uploaded file.
+        @return:
+        """
+        return hashlib.sha256(data).hexdigest()
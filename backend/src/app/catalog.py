@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Set
+
+from pymilvus.orm import utility
+
+from .CONSTANTS import *
+
+
+class Catalog:
+    """
+    Shared view of the datasets in datasets.json and of the collections in Milvus. The file is parsed again only when
+    its modification time changes, and its modification time is checked at most once every stat_interval seconds.
+    The list of collections is refreshed by a background thread every refresh_interval seconds, so that requests never
+    wait for Milvus. Listeners are called with the catalog every time the datasets or the collections change. They are
+    only called by the background thread, one at a time and without holding the lock of the catalog, as they query
+    Milvus: requests reading the catalog only swap in the datasets parsed from the file.
+    """
+
+    def __init__(self, datasets_json_path: str = DATASETS_JSON_PATH,
+                 refresh_interval: float = CATALOG_REFRESH_INTERVAL, stat_interval: float = CATALOG_STAT_INTERVAL,
+                 list_collections: Callable[[], List[str]] = utility.list_collections):
+        """
+        @param datasets_json_path: path of datasets.json.
+        @param refresh_interval: number of seconds between two refreshes of the list of collections.
+        @param stat_interval: number of seconds after which the modification time of datasets.json is checked again.
+        @param list_collections: function returning the names of the collections in the database.
+        """
+        self.datasets_json_path = datasets_json_path
+        self.refresh_interval = refresh_interval
+        self.stat_interval = stat_interval
+        self.list_collections = list_collections
+        self._datasets = []
+        self._datasets_by_name = {}
+        self._mtime = None
+        self._checked = None
+        self._collections = set()
+        self._listeners = []
+        # Create lock to ensure that the catalog is not reloaded by multiple threads at the same time
+        self.lock = threading.Lock()
+        # Create lock to ensure that the listeners are not called by multiple threads at the same time
+        self._listeners_lock = threading.Lock()
+        self._stopped = threading.Event()
+        # Event set when the listeners must be called by the background thread
+        self._notification_requested = threading.Event()
+        self._thread = None
+        # Load datasets. The collections are listed by refresh_collections, which queries Milvus.
+        self._reload_datasets()
+
+    @property
+    def datasets(self) -> List[dict]:
+        """
+        Entries of datasets.json.
+        """
+        if self._checked is None or time.monotonic() - self._checked >= self.stat_interval:
+            if self._reload_datasets():
+                # The listeners are called by the background thread, so that requests never wait for them
+                self.request_notification()
+        return self._datasets
+
+    @property
+    def collections(self) -> Set[str]:
+        """
+        Names of the collections in the database, as of the last refresh.
+        """
+        return self._collections
+
+    def get_dataset(self, name: str) -> dict | None:
+        """
+        Get the entry of a dataset in datasets.json.
+        @param name:
+        @return: the entry, or None if there is no dataset with the given name.
+        """
+        # Reload datasets.json if necessary
+        _ = self.datasets
+        return self._datasets_by_name.get(name)
+
+    def has_collection(self, name: str) -> bool:
+        return name in self._collections
+
+    def add_listener(self, listener: Callable[["Catalog"], None]):
+        """
+        Add a function to call with the catalog every time the datasets or the collections change. The function is
+        also called immediately.
+        @param listener:
+        @return:
+        """
+        with self._listeners_lock:
+            listener(self)
+            self._listeners = [*self._listeners, listener]
+
+    def request_notification(self):
+        """
+        Ask the background thread to call the listeners, for instance because the state of a collection has changed
+        outside of the catalog.
+        @return:
+        """
+        self._notification_requested.set()
+
+    def refresh_collections(self):
+        """
+        Refresh the list of collections, and reload datasets.json if it has changed.
+        @return:
+        """
+        collections = set(self.list_collections())
+        changed = self._reload_datasets()
+        if collections != self._collections:
+            self._collections = collections
+            changed = True
+        if changed:
+            self._notify()
+
+    def start(self):
+        """
+        Start the background thread refreshing the list of collections. The collections are listed first, so that they
+        are known when the function returns.
+        @return:
+        """
+        self.refresh_collections()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="catalog-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._notification_requested.set()
+
+    def _run(self):
+        while True:
+            # Wake up at the next refresh, or as soon as a notification is requested
+            requested = self._notification_requested.wait(self.refresh_interval)
+            if self._stopped.is_set():
+                return
+            self._notification_requested.clear()
+            try:
+                if requested:
+                    self._notify()
+                else:
+                    self.refresh_collections()
+            except Exception as e:
+                # Keep the last known collections, and try again at the next refresh
+                print("Error in refreshing the catalog. Error message: ", e)
+
+    def _reload_datasets(self) -> bool:
+        """
+        Parse datasets.json if its modification time has changed.
+        @return: whether the datasets have been reloaded.
+        """
+        with self.lock:
+            self._checked = time.monotonic()
+            try:
+                mtime = os.stat(self.datasets_json_path).st_mtime_ns
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            try:
+                with open(self.datasets_json_path, "r") as f:
+                    datasets = json.load(f)["datasets"]
+            except (OSError, ValueError, KeyError):
+                # The file is being written. Keep the last known datasets, and read the file again at the next check.
+                return False
+            self._datasets_by_name = {dataset["name"]: dataset for dataset in datasets}
+            self._datasets = datasets
+            self._mtime = mtime
+            return True
+
+    def _notify(self):
+        # The lock of the catalog is not held, so that requests can read the catalog while the listeners query Milvus
+        with self._listeners_lock:
+            for listener in self._listeners:
+                listener(self)
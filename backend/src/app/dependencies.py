@@ -1,15 +1,17 @@
 import json
 import threading
-from typing import List
+from typing import Callable, List
 
-import torch
-from fastapi import Query
+import numpy as np
+from fastapi import HTTPException, Query
 from pymilvus import Collection
-from pymilvus.orm import utility
 
 from .CONSTANTS import *
+from .cache import TextEmbeddingCache, normalize_text
+from .catalog import Catalog
+from .residency import ResidencyManager
 from ..CONSTANTS import UMAP_COLLECTION_NAME
-from ..embeddings_model.EmbeddingsModel import EmbeddingsModel
+from ..embeddings_model.EmbeddingsModel import EmbeddingsModel, to_numpy
 
 
 # Define helper class for representing a collection
@@ -19,197 +21,211 @@ class HelperCollection:
         self.collection = Collection(name)
         self.load = self.collection.load
         self.release = self.collection.release
-        # Define counter. The counter is initialized to 0. When the collection is queried for the first time,
-        # it is loaded, and the counter is set to a value greater than 0. Every time the collection is not used by an
-        # app1 method that accesses the database, the counter is decremented by 1. Once the counter becomes 0,
-        # the collection is released. Every time the collection is queried, the counter is set to the value. It the
-        # collection had been released, it is loaded again once queried.
-        self.counter = 0
-        # Create lock to ensure that the counter is not accessed by multiple threads at the same time.
-        self.lock = threading.Lock()
 
 
 class CollectionNameGetter:
-    def __init__(self, datasets: List, suffix: str = ""):
-        # Define lock for the collection name getter
+    """
+    Class for getting the collection of a dataset. Requests read the map of collections without taking any lock: the
+    map is never modified, but replaced by a new map when collections are added. The state of each collection is
+    handled by the residency manager, so a request for a loaded collection never waits for the load of another one.
+    The map is filled by update, which queries Milvus for each new collection. It is added as a listener of the catalog
+    in the background when the app starts.
+    """
+
+    def __init__(self, residency_manager: ResidencyManager, suffix: str = ""):
+        # Define lock for updating the map of collections
         self.lock = threading.Lock()
+        self.suffix = suffix
         self.collections = {}
-        # Get collections from DatasetOptions
-        for dataset in datasets:
-            name = dataset["name"] + suffix
-            if name in utility.list_collections():
-                self.collections[name] = HelperCollection(name)
+        # Define manager deciding which collections are loaded
+        self.residency_manager = residency_manager
+
+    def update(self, catalog: Catalog):
+        """
+        Add the collections of the datasets that have been created since the last update.
+        @param catalog:
+        @return:
+        """
+        with self.lock:
+            collections = dict(self.collections)
+            for dataset in catalog.datasets:
+                name = dataset["name"] + self.suffix
+                if catalog.has_collection(name) and name not in collections.keys():
+                    # The collection is in the database, but not in the list of collections. Add it to the list.
+                    helper_collection = HelperCollection(name)
+                    self.residency_manager.register(helper_collection.collection)
+                    collections[name] = helper_collection
+            # Replace the map, so that readers always see a complete map
+            self.collections = collections
 
     def __call__(self, collection: str = Query(...)) -> Collection | None:
-        self.lock.acquire()
-        try:
-            value = self._call(collection)
-        finally:
-            self.lock.release()
-        return value
-
-    def _call(self, collection: str = Query(...)) -> Collection | None:
-        pass
-
-    def update_counters(self, collection_name: str):
-        # Log all counters before updating them
-        # print(f"Before update. Counters: {[(key, self.collections[key].counter) for key in self.collections.keys()]}")
-        # Loop over collections. If the collection is not the one that was queried, decrement its counter. Else, if
-        # the collection is the one that was queried, set its counter to COUNTER_MAX_VALUE.
-        for key in self.collections.keys():
-            self.collections[key].lock.acquire()
-            if key != collection_name:
-                if self.collections[key].counter == 1:
-                    self.collections[key].release()
-                self.collections[key].counter = max(0, self.collections[key].counter - 1)
-            else:
-                if self.collections[key].counter == 0:
-                    self.collections[key].load()
-                self.collections[key].counter = COUNTER_MAX_VALUE
-            self.collections[key].lock.release()
-
-        # Log all counters after updating them
-        # print(f"After update. Counters: {[(key, self.collections[key].counter) for key in self.collections.keys()]}")
+        helper_collection = self.collections.get(collection)
+        if helper_collection is None:
+            return None
+        # Make sure the collection is loaded
+        self.acquire(collection)
+        # Return the requested collection
+        return helper_collection.collection
+
+    def acquire(self, collection_name: str):
+        """
+        Record a use of the collection, and wait until it is loaded.
+        @param collection_name:
+        @return:
+        """
+        if not self.residency_manager.acquire(collection_name):
+            # The collection could not be loaded in time
+            raise HTTPException(status_code=503, detail="Collection is being loaded")
 
 
 class DatasetCollectionNameGetter(CollectionNameGetter):
-    def __init__(self, datasets: List):
-        super().__init__(datasets)
-
-    def _call(self, collection: str = Query(...)) -> Collection | None:
-        if collection in self.collections.keys():
-            # Update counter for all collections
-            self.update_counters(collection)
-            # Return the requested collection
-            return self.collections[collection].collection
-        else:
-            return None
+    def __init__(self, residency_manager: ResidencyManager):
+        super().__init__(residency_manager)
 
 
 class ClustersCollectionNameGetter(CollectionNameGetter):
-    def __init__(self, datasets: List):
-        super().__init__(datasets, "_zoom_levels_clusters")
-
-    def _call(self, collection: str = Query(...)) -> Collection | None:
-        if collection in self.collections.keys():
-            # Update counter for all collections
-            self.update_counters(collection)
-            # Return the requested collection
-            return self.collections[collection].collection
-        else:
-            return None
+    def __init__(self, residency_manager: ResidencyManager):
+        super().__init__(residency_manager, "_zoom_levels_clusters")
 
 
 class ImageToTileCollectionNameGetter(CollectionNameGetter):
-    def __init__(self, datasets: List):
-        super().__init__(datasets, "_image_to_tile")
-
-    def _call(self, collection: str = Query(...)) -> Collection | None:
-        if collection in self.collections.keys():
-            # Update counter for all collections
-            self.update_counters(collection)
-            # Return the requested collection
-            return self.collections[collection].collection
-        else:
-            return None
+    def __init__(self, residency_manager: ResidencyManager):
+        super().__init__(residency_manager, "_image_to_tile")
 
 
 class UMAPCollectionGetter:
     def __init__(self):
-        self.collection = Collection(UMAP_COLLECTION_NAME)
+        # The collection is set by load, which is called in the background when the app starts
+        self.collection = None
+
+    def load(self):
+        collection = Collection(UMAP_COLLECTION_NAME)
         # Load collection in memory
-        self.collection.load()
+        collection.load()
+        self.collection = collection
 
-    def __call__(self) -> Collection:
+    def __call__(self) -> Collection | None:
         return self.collection
 
 
+def get_num_entities(name: str) -> int:
+    return Collection(name).num_entities
+
+
 class DatasetCollectionInfoGetter:
-    def __init__(self, datasets: List):
+    """
+    Class for getting the information of the collection of a dataset. The number of entities is read again when the
+    collection may have been repopulated: when the versions of the dataset change in the catalog, or when the residency
+    manager loads the collection again. Like the collection name getters, it is filled by update, which is called by
+    the background thread of the catalog.
+    """
+
+    def __init__(self, catalog: Catalog, residency_manager: ResidencyManager | None = None,
+                 num_entities: Callable[[str], int] = get_num_entities):
+        """
+        @param catalog:
+        @param residency_manager: manager of the loaded collections. If None, only the versions are checked.
+        @param num_entities: function returning the number of entities of a collection.
+        """
+        self.catalog = catalog
+        self.residency_manager = residency_manager
+        self.num_entities = num_entities
         self.collections = {}
-        # Get collections from datasets
-        for dataset in datasets:
-            name = dataset["name"]
-            if name in utility.list_collections():
-                self.collections[name] = {"number_of_entities": Collection(name).num_entities,
-                                          "zoom_levels": dataset["zoom_levels"]}
+        # Define lock for updating the map of collections
+        self.lock = threading.Lock()
+
+    def get_state(self, dataset: dict) -> tuple:
+        """
+        Get the state of the collection of a dataset on which its number of entities depends.
+        @param dataset: entry of the dataset in the catalog.
+        @return:
+        """
+        residencies = self.residency_manager.residencies if self.residency_manager is not None else {}
+        residency = residencies.get(dataset["name"])
+        return json.dumps(dataset.get("versions", {}), sort_keys=True), residency.loads if residency is not None else 0
+
+    def update(self, catalog: Catalog):
+        with self.lock:
+            collections = {}
+            for dataset in catalog.datasets:
+                name = dataset["name"]
+                if not catalog.has_collection(name):
+                    continue
+                state = self.get_state(dataset)
+                info = self.collections.get(name)
+                if info is None or info["state"] != state:
+                    info = {"number_of_entities": self.num_entities(name), "state": state}
+                collections[name] = info
+            # Replace the map, so that readers always see a complete map
+            self.collections = collections
 
     def __call__(self, collection: str = Query(...)):
-        if collection in self.collections.keys():
-            # Update info if necessary
-            with open(DATASETS_JSON_PATH, "r") as f:
-                datasets = json.load(f)["datasets"]
-            for dataset in datasets:
-                if dataset["name"] == collection:
-                    self.collections[collection]["zoom_levels"] = dataset["zoom_levels"]
-                    break
-
-            return self.collections[collection]
-        else:
+        dataset = self.catalog.get_dataset(collection)
+        if collection not in self.collections.keys() or dataset is None:
             return None
+        info = self.collections[collection]
+        if info["state"] != self.get_state(dataset):
+            # The collection has been repopulated since its number of entities was read. The number is read again by
+            # the background thread of the catalog, so that the request does not wait for Milvus.
+            self.catalog.request_notification()
+        # The number of zoom levels and the versions are read from the catalog, as they are updated when the clusters
+        # are created. Clients can add the version to their requests to cache the data of a build.
+        return {"number_of_entities": info["number_of_entities"], "zoom_levels": dataset["zoom_levels"],
+                "versions": dataset.get("versions", {})}
 
 
 class Updater:
     """
-    Class for updating the collections. When the client requests the list of collections, it could become necessary to
-    update the list of collections if a new collection has been created.
+    Class for listing the collections. The collections are read from the catalog, which adds the collections that
+    have been created since the start of the app to the collection name getters.
     """
 
-    def __init__(self, dataset_collection_name_getter: DatasetCollectionNameGetter,
-                 clusters_collection_name_getter: ClustersCollectionNameGetter,
-                 image_to_tile_collection_name_getter: ImageToTileCollectionNameGetter):
-        self.dataset_collection_name_getter = dataset_collection_name_getter
-        self.clusters_collection_name_getter = clusters_collection_name_getter
-        self.image_to_tile_collection_name_getter = image_to_tile_collection_name_getter
-        # Define variable to store the list of datasets
-        self.datasets = None
-        # Define lock for the updater
-        self.lock = threading.Lock()
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
 
     def __call__(self):
-        with open(DATASETS_JSON_PATH, "r") as f:
-            self.datasets = json.load(f)["datasets"]
-
-        # Acquire lock
-        self.lock.acquire()
-        try:
-            # First, update the list of collections if necessary
-            for dataset in self.datasets:
-                name = dataset["name"]
-                if (name in utility.list_collections() and
-                        name not in self.dataset_collection_name_getter.collections.keys()):
-                    # The collection is in the database, but not in the list of collections. Add it to the list.
-                    self.dataset_collection_name_getter.collections[name] = HelperCollection(name)
-            # Second, update the list of zoom level collections if necessary
-            for dataset in self.datasets:
-                name = dataset["name"] + "_zoom_levels_clusters"
-                # Check if name is the suffix of one of the elements of the list of collections
-                if (name in utility.list_collections() and
-                        name not in self.clusters_collection_name_getter.collections.keys()):
-                    # The collection is in the database, but not in the list of collections. Add it to the list.
-                    self.clusters_collection_name_getter.collections[name] = HelperCollection(name)
-
-                name = dataset["name"] + "_image_to_tile"
-                # Check if name is the suffix of one of the elements of the list of collections
-                if (name in utility.list_collections() and
-                        name not in self.image_to_tile_collection_name_getter.collections.keys()):
-                    # The collection is in the database, but not in the list of collections. Add it to the list.
-                    self.image_to_tile_collection_name_getter.collections[name] = HelperCollection(name)
-
-            # Now, return the list of collections
-            return [{"name": dataset["name"], "website_name": dataset["website_name"]} for dataset in self.datasets
-                    if dataset["name"] in utility.list_collections()]
-        finally:
-            # Release lock
-            self.lock.release()
+        # Return the list of collections
+        return [{"name": dataset["name"], "website_name": dataset["website_name"]} for dataset in self.catalog.datasets
+                if self.catalog.has_collection(dataset["name"])]
 
 
 class Embedder:
-    def __init__(self, embeddings: EmbeddingsModel):
+    def __init__(self, embeddings: EmbeddingsModel | None, cache: TextEmbeddingCache | None = None):
+        """
+        @param embeddings: model used to embed the texts. It can be set after the creation of the embedder, once the
+        model is loaded.
+        @param cache: cache of the embeddings of the texts. If None, every text is embedded.
+        """
         self.embeddings = embeddings
-
-    def __call__(self, text: str = Query(...)) -> torch.Tensor:
-        return self.embeddings.getTextEmbeddings(text)
+        self.cache = cache
+
+    def __call__(self, text: str = Query(...)) -> np.ndarray:
+        if self.cache is None:
+            return to_numpy(self.embeddings.getTextEmbeddings(text))
+        return self.embed_batch([text])
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        # Embed all texts with a single forward pass
+        if self.cache is None:
+            return to_numpy(self.embeddings.getTextEmbeddings(texts))
+
+        # Get cached embeddings, and embed the remaining texts with a single forward pass
+        texts = [normalize_text(text) for text in texts]
+        embeddings = {}
+        for text in texts:
+            if text not in embeddings:
+                embedding = self.cache.get(text)
+                if embedding is not None:
+                    embeddings[text] = embedding
+        missing = list(dict.fromkeys([text for text in texts if text not in embeddings]))
+        if len(missing) > 0:
+            # A single text is submitted on its own, so that a MicroBatchingEmbeddings model batches it with the texts
+            # of concurrent requests
+            new_embeddings = to_numpy(self.embeddings.getTextEmbeddings(missing[0] if len(missing) == 1 else missing))
+            for text, embedding in zip(missing, new_embeddings):
+                self.cache.put(text, embedding)
+                embeddings[text] = embedding
+        return np.stack([embeddings[text] for text in texts])
 
 
 def parse_comma_separated(indexes: str) -> List[int]:
@@ -1,54 +1,166 @@
-from typing import List
+from typing import AsyncIterator, Dict, List, Tuple
 
-import torch
+import numpy as np
 from pymilvus import Collection
 
+from . import milvus_io
+from .CONSTANTS import *
+from .cache import TileCache, get_collection_generation
+from .search_engines import MilvusSearchEngine, LocalSearchEngine, get_entities
+from .stores import DatasetEmbeddings, DatasetMetadata, NeighborGraph
 from ..CONSTANTS import *
 from ..db_utilities.collections import EMBEDDING_VECTOR_FIELD_NAME, ZOOM_LEVEL_VECTOR_FIELD_NAME
 
+# Define engine used when no search engine is given
+_milvus_search_engine = MilvusSearchEngine()
 
-def get_image_info_from_text_embedding(collection: Collection, text_embeddings: torch.Tensor) -> str:
+
+async def get_image_info_from_text_embedding(collection: Collection, text_embeddings: np.ndarray,
+                                             engine: MilvusSearchEngine | LocalSearchEngine | None = None) -> str:
     """
     Get the image embedding from the collection for a given text.
     @param collection:
     @param text_embeddings:
+    @param engine: search engine of the dataset. Milvus is used if None.
     @return:
     """
-    # Define search parameters
-    search_params = {
-        "metric_type": COSINE_METRIC,
-        "offset": 0
-    }
     # Search image
-    results = collection.search(
-        data=text_embeddings.tolist(),
-        anns_field=EMBEDDING_VECTOR_FIELD_NAME,
-        param=search_params,
-        limit=1,
-        output_fields=["index", "author", "path", "width", "height", "genre", "date", "title", "caption", "x", "y"]
-    )
+    results = await (engine or _milvus_search_engine).search(collection, text_embeddings.tolist(), 1)
     # Return image path
-    return results[0][0].to_dict()["entity"]
+    return results[0][0]
+
+
+async def get_images_info_from_text_embeddings(collection: Collection, text_embeddings: np.ndarray, top_k: int,
+                                               engine: MilvusSearchEngine | LocalSearchEngine | None = None
+                                               ) -> List[List[dict]]:
+    """
+    Get the top_k images from the collection for each of the given text embeddings, using a single search.
+    @param collection:
+    @param text_embeddings: matrix of shape (number of texts, embedding dimension).
+    @param top_k:
+    @param engine: search engine of the dataset. Milvus is used if None.
+    @return: list with the list of images for each text, in the order of the text embeddings.
+    """
+    # Search all the embeddings at once
+    return await (engine or _milvus_search_engine).search(collection, text_embeddings.tolist(), top_k)
 
 
-def get_tiles(indexes: List[int], collection: Collection) -> dict:
+async def get_tiles(indexes: List[int], collection: Collection, cache: TileCache | None = None) -> List[dict]:
     """
-    Get tiles from their indexes.
+    Get tiles from their indexes. If a cache is given, only the tiles that are not in the cache are fetched from the
+    collection.
     @param indexes:
     @param collection:
+    @param cache:
     @return:
     """
-    # Search image
-    result = collection.query(
-        expr=f"index in {indexes}",
-        output_fields=["index", "data"]
-    )
-    # The returned data is a list of entities.
+    if cache is None:
+        # Search image
+        result = await milvus_io.query(
+            collection,
+            expr=f"index in {indexes}",
+            output_fields=["index", "data"]
+        )
+        # The returned data is a list of entities.
+        return result
 
-    return result
+    # Get tiles from the cache, and fetch the missing ones from the collection
+    tiles = await _get_cached_tiles(indexes, collection, cache)
+    # Return only the fields that are returned when the cache is not used
+    return [{"index": tile["index"], "data": tile["data"]} for tile in tiles]
 
 
-def get_tile_from_image(index: int, collection: Collection) -> dict:
+async def iter_tiles(indexes: List[int], collection: Collection, cache: TileCache | None = None,
+                     page_size: int = STREAM_PAGE_SIZE) -> AsyncIterator[List[dict]]:
+    """
+    Get tiles from their indexes page by page, so that each page can be sent as soon as it is available. If a cache is
+    given, the tiles in the cache are returned in the first page, and the missing ones are fetched from the collection.
+    @param indexes:
+    @param collection:
+    @param cache:
+    @param page_size: maximum number of tiles fetched from the collection with one query.
+    @return: pages of tiles. Tiles are in the order of the indexes within a page, but not across pages.
+    """
+    if cache is None:
+        for i in range(0, len(indexes), page_size):
+            yield await milvus_io.query(
+                collection,
+                expr=f"index in {indexes[i:i + page_size]}",
+                output_fields=["index", "data"],
+                limit=len(indexes[i:i + page_size])
+            )
+        return
+
+    async for tiles in _iter_cached_tiles(indexes, collection, cache, page_size):
+        # Return only the fields that are returned when the cache is not used
+        yield [{"index": tile["index"], "data": tile["data"]} for tile in tiles]
+
+
+async def _validate_cache(collection: Collection, cache: TileCache) -> Tuple[int, int]:
+    """
+    Drop the cached tiles of the collection if it has been rebuilt.
+    @param collection:
+    @param cache:
+    @return: the generation of the collection.
+    """
+    generation = cache.get_generation(collection.name)
+    if generation is None:
+        generation = await milvus_io.run(get_collection_generation, collection)
+        cache.set_generation(collection.name, generation)
+    return generation
+
+
+async def _get_cached_tiles(indexes: List[int], collection: Collection, cache: TileCache) -> List[dict]:
+    """
+    Get tiles from the cache. The tiles that are not in the cache are fetched from the collection and added to the
+    cache. Tiles are cached with all the fields in TILE_OUTPUT_FIELDS.
+    @param indexes:
+    @param collection:
+    @param cache:
+    @return: list of tiles, in the order of the indexes. Indexes without a tile are skipped.
+    """
+    # Remove duplicates while keeping the order
+    indexes = list(dict.fromkeys(indexes))
+    found = {}
+    async for tiles in _iter_cached_tiles(indexes, collection, cache, SEARCH_LIMIT):
+        for tile in tiles:
+            found[tile["index"]] = tile
+
+    return [found[index] for index in indexes if index in found]
+
+
+async def _iter_cached_tiles(indexes: List[int], collection: Collection, cache: TileCache,
+                             page_size: int) -> AsyncIterator[List[dict]]:
+    """
+    Get tiles from the cache page by page. The first page holds the tiles found in the cache, and the next pages hold
+    the tiles fetched from the collection, which are added to the cache. Tiles are cached with all the fields in
+    TILE_OUTPUT_FIELDS.
+    @param indexes:
+    @param collection:
+    @param cache:
+    @param page_size: maximum number of tiles fetched from the collection with one query.
+    @return: pages of tiles. Indexes without a tile are skipped.
+    """
+    # Drop cached tiles if the collection has been rebuilt
+    await _validate_cache(collection, cache)
+    # Remove duplicates while keeping the order
+    indexes = list(dict.fromkeys(indexes))
+    found, missing = cache.get_many(collection.name, indexes)
+    if len(found) > 0:
+        yield [found[index] for index in indexes if index in found]
+    # Fetch missing tiles
+    for i in range(0, len(missing), page_size):
+        results = await milvus_io.query(
+            collection,
+            expr=f"index in {missing[i:i + page_size]}",
+            output_fields=TILE_OUTPUT_FIELDS,
+            limit=len(missing[i:i + page_size])
+        )
+        cache.put_many(collection.name, results)
+        yield results
+
+
+async def get_tile_from_image(index: int, collection: Collection) -> dict:
     """
     Get the tile data from the collection for a given image.
     @param index:
@@ -56,7 +168,8 @@ def get_tile_from_image(index: int, collection: Collection) -> dict:
     @return:
     """
     # Search image
-    results = collection.query(
+    results = await milvus_io.query(
+        collection,
         expr=f"index in [{index}]",
         output_fields=["*"]
     )
@@ -73,107 +186,174 @@ def get_tile_from_image(index: int, collection: Collection) -> dict:
         return {}
 
 
-def get_paths_from_indexes(indexes: List[int], collection: Collection) -> dict:
+async def get_metadata(indexes: List[int], fields: List[str], collection: Collection | None = None,
+                       metadata: DatasetMetadata | None = None) -> List[dict]:
     """
-    Get images from their indexes.
+    Get the given fields of the images with the given indexes. If the metadata of the dataset is given, the fields are
+    read from it, and the collection is not queried.
     @param indexes:
-    @param collection:
-    @return:
+    @param fields:
+    @param collection: embeddings collection, only used if metadata is None.
+    @param metadata: metadata of the dataset, which must contain the fields.
+    @return: list with the index and the fields of each image, in the order of the indexes. Indexes without an image
+    are skipped.
     """
-    # Search image
-    results = collection.query(
-        expr=f"index in {indexes}",
-        output_fields=["path"]
-    )
+    if metadata is not None:
+        return metadata.get(indexes, fields)
 
-    # Return results
-    return results
+    # Get the fields of all the images with a single query
+    unique_indexes = list(dict.fromkeys(indexes))
+    results = await milvus_io.query(
+        collection,
+        expr=f"index in {unique_indexes}",
+        output_fields=list(dict.fromkeys(["index", *fields])),
+        limit=len(unique_indexes)
+    )
+    entities = {result["index"]: result for result in results}
+    return [entities[index] for index in indexes if index in entities]
 
 
-def get_neighbors(index: int, collection: Collection, top_k: int) -> List[dict]:
+async def get_neighbors(index: int, collection: Collection, top_k: int, embeddings: DatasetEmbeddings | None = None,
+                        engine: MilvusSearchEngine | LocalSearchEngine | None = None,
+                        graph: NeighborGraph | None = None) -> List[dict]:
     """
-    Get the neighbors of a given image.
+    Get the neighbors of a given image. If the embeddings of the dataset are given, the embedding of the image is read
+    from them, and a single search is sent to Milvus. If the neighbor graph of the dataset is also given and contains
+    at least top_k neighbors, the neighbors are read from it.
     @param index:
     @param collection:
     @param top_k:
+    @param embeddings:
+    @param engine: search engine of the dataset. Milvus is used if None.
+    @param graph:
     @return:
     """
-    # First, query the index to find the embedding vector
-    results = collection.query(
-        expr=f"index in [{index}]",
-        output_fields=[EMBEDDING_VECTOR_FIELD_NAME]
-    )
+    return (await get_neighbors_batch([index], collection, top_k, embeddings, engine, graph))[0]
 
-    # Define search parameters
-    search_params = {
-        "metric_type": COSINE_METRIC
-    }
-    # Search image
-    results = collection.search(
-        data=[results[0][EMBEDDING_VECTOR_FIELD_NAME]],
-        anns_field=EMBEDDING_VECTOR_FIELD_NAME,
-        param=search_params,
-        limit=top_k + 1,
-        output_fields=["index", "author", "path", "width", "height", "genre", "date", "title", "caption", "x", "y"]
-    )
-    # Return results
-    return [hit.to_dict()["entity"] for hit in results[0]]
+
+async def get_neighbors_batch(indexes: List[int], collection: Collection, top_k: int,
+                              embeddings: DatasetEmbeddings | None = None,
+                              engine: MilvusSearchEngine | LocalSearchEngine | None = None,
+                              graph: NeighborGraph | None = None) -> List[List[dict]]:
+    """
+    Get the neighbors of the given images with a single search, or from the neighbor graph.
+    @param indexes:
+    @param collection:
+    @param top_k:
+    @param embeddings:
+    @param engine: search engine of the dataset. Milvus is used if None.
+    @param graph:
+    @return: list with the neighbors of each image, in the order of the indexes.
+    """
+    if graph is not None and embeddings is not None and top_k <= graph.k:
+        rows = embeddings.get_rows(indexes)
+        if np.all(rows >= 0):
+            return await _get_neighbors_from_graph(indexes, rows, collection, top_k, graph)
+
+    # Get embedding vectors from the memory-mapped embeddings
+    vectors = embeddings.get_vectors(indexes) if embeddings is not None else None
+    if vectors is None:
+        # Query the indexes to find the embedding vectors
+        results = await milvus_io.query(
+            collection,
+            expr=f"index in {list(indexes)}",
+            output_fields=[EMBEDDING_VECTOR_FIELD_NAME]
+        )
+        vectors_by_index = {result["index"]: result[EMBEDDING_VECTOR_FIELD_NAME] for result in results}
+        # Raise an error if some of the images are not in the collection, as when a single image is not found
+        vectors = [vectors_by_index[index] for index in indexes]
+
+    # Search images. The first neighbor of each image is the image itself.
+    return await (engine or _milvus_search_engine).search(collection, vectors, top_k + 1)
+
+
+async def _get_neighbors_from_graph(indexes: List[int], rows: np.ndarray, collection: Collection, top_k: int,
+                                    graph: NeighborGraph) -> List[List[dict]]:
+    """
+    Get the neighbors of the given images from the neighbor graph. Only the metadata of the images is fetched from the
+    collection, with one query for every SEARCH_LIMIT distinct images, as a batch can have more neighbors than Milvus
+    returns for a single query.
+    @param indexes:
+    @param rows: rows of the images in the embeddings matrix.
+    @param collection:
+    @param top_k:
+    @param graph:
+    @return: list with the neighbors of each image, in the order of the indexes.
+    """
+    # As with a search, the first neighbor of each image is the image itself
+    neighbors = np.concatenate([np.asarray(indexes, dtype=np.int64)[:, None], graph.get_neighbors(rows, top_k)],
+                               axis=1)
+    return await get_entities(collection, neighbors)
 
 
-def get_first_tiles(collection: Collection) -> List[dict]:
+async def get_first_tiles(collection: Collection, cache: TileCache | None = None) -> List[dict]:
     """
     Get tiles from first few zoom levels.
     @param collection:
+    @param cache:
     @return:
     """
-    # Define limit on number of entities
-    limit = min(collection.num_entities, 1365)
+    if cache is not None:
+        # The generation of the collection contains the number of entities
+        _, num_entities = await _validate_cache(collection, cache)
+        return await _get_cached_tiles(list(range(min(num_entities, FIRST_TILES_LIMIT))), collection, cache)
+
     results = []
+    async for tiles in iter_first_tiles(collection, page_size=SEARCH_LIMIT):
+        results += tiles
+
+    # Return results
+    return results
+
+
+async def iter_first_tiles(collection: Collection, cache: TileCache | None = None,
+                           page_size: int = STREAM_PAGE_SIZE) -> AsyncIterator[List[dict]]:
+    """
+    Get tiles from first few zoom levels page by page. Tiles are fetched by increasing index, so that the tiles of the
+    first zoom levels come first.
+    @param collection:
+    @param cache:
+    @param page_size: maximum number of tiles fetched from the collection with one query.
+    @return: pages of tiles.
+    """
+    if cache is not None:
+        # The generation of the collection contains the number of entities
+        _, num_entities = await _validate_cache(collection, cache)
+        async for tiles in _iter_cached_tiles(list(range(min(num_entities, FIRST_TILES_LIMIT))), collection, cache,
+                                              page_size):
+            yield tiles
+        return
+
+    # Define limit on number of entities
+    limit = min(await milvus_io.num_entities(collection), FIRST_TILES_LIMIT)
     i = 0
     while i < limit:
-        search_limit = min(16384, limit - i)
+        search_limit = min(page_size, limit - i)
         # Search image
-        results += collection.query(
+        yield await milvus_io.query(
+            collection,
             expr=f"index in {list(range(i, i + search_limit))}",
-            output_fields=["index", "data", "range"],
+            output_fields=TILE_OUTPUT_FIELDS,
             limit=search_limit
         )
-        i += 16384
-
-    # Return results
-    return results
+        i += page_size
 
 
-def get_umap_data(umap_c: Collection, n_neighbors: int, min_dist: float):
+async def get_umap_projections(umap_c: Collection) -> Dict[int, list]:
     """
-    Get plot umap.
-    @return:
+    Get all the UMAP projections with a single query.
+    @param umap_c:
+    @return: dictionary mapping the index of each projection to its interleaved coordinates x0, y0, x1, y1, ...
     """
-    # Check that n_neighbors and min_dist are among the allowed values
-    if n_neighbors not in N_NEIGHBORS:
-        raise ValueError(f"n_neighbors must be in {N_NEIGHBORS}")
-    if min_dist not in MIN_DISTS:
-        raise ValueError(f"min_dist must be in {MIN_DISTS}")
-    # Get position of n_neighbors and min_dist in the allowed values
-    n_neighbors_index = N_NEIGHBORS.index(n_neighbors)
-    min_dist_index = MIN_DISTS.index(min_dist)
-    # Compute index
-    index = n_neighbors_index * len(MIN_DISTS) + min_dist_index
-
-    # Load data for best artworks from the database
-    results = umap_c.query(
-        expr=f"index in [{index}]",
-        output_fields=["data"]
+    results = await milvus_io.query(
+        umap_c,
+        expr=f"index in {list(range(len(N_NEIGHBORS) * len(MIN_DISTS)))}",
+        output_fields=["index", "data"]
     )
+    return {result["index"]: result["data"] for result in results}
 
-    x = [float(results[0]["data"][i]) for i in range(len(results[0]["data"])) if i % 2 == 0]
-    y = [float(results[0]["data"][i]) for i in range(len(results[0]["data"])) if i % 2 == 1]
-
-    # Return results
-    return {"x": x, "y": y}
 
-
-def get_random_image(num: float, collection: Collection) -> dict:
+async def get_random_image(num: float, collection: Collection) -> dict:
     """
     Get a random image from the collection.
     @param num:
@@ -181,9 +361,10 @@ def get_random_image(num: float, collection: Collection) -> dict:
     @return:
     """
     # Get random index
-    index = int(num * collection.num_entities)
+    index = int(num * await milvus_io.num_entities(collection))
     # Search image
-    results = collection.query(
+    results = await milvus_io.query(
+        collection,
         expr=f"index in [{index}]",
         output_fields=["path", "caption"]
     )
@@ -191,25 +372,16 @@ def get_random_image(num: float, collection: Collection) -> dict:
     return results[0]
 
 
-def get_image_info_from_image_embedding(collection: Collection, image_embeddings: torch.Tensor) -> dict:
+async def get_image_info_from_image_embedding(collection: Collection, image_embeddings: np.ndarray,
+                                              engine: MilvusSearchEngine | LocalSearchEngine | None = None) -> dict:
     """
     Get the image from the collection for a given image embedding.
     @param collection:
     @param image_embeddings:
+    @param engine: search engine of the dataset. Milvus is used if None.
     @return:
     """
-    # Define search parameters
-    search_params = {
-        "metric_type": COSINE_METRIC,
-        "offset": 0
-    }
     # Search image
-    results = collection.search(
-        data=image_embeddings.tolist(),
-        anns_field=EMBEDDING_VECTOR_FIELD_NAME,
-        param=search_params,
-        limit=1,
-        output_fields=["index", "author", "path", "width", "height", "genre", "date", "title", "caption", "x", "y"]
-    )
+    results = await (engine or _milvus_search_engine).search(collection, image_embeddings.tolist(), 1)
     # Return image path
-    return results[0][0].to_dict()["entity"]
+    return results[0][0]
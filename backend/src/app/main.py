@@ -1,38 +1,171 @@
-from io import BytesIO
-
-from PIL import Image
-from fastapi import FastAPI, Depends, HTTPException, Request, File, UploadFile
+import os
+import time
+from typing import AsyncIterator
+
+from PIL import Image, UnidentifiedImageError
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, File, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from pydantic import BaseModel, Field
 from pymilvus import db, MilvusException
 
 from . import gets
+from .cache import TileCache, TextEmbeddingCache, ImageEmbeddingCache
+from .catalog import Catalog
+from .residency import ResidencyManager
+from .search_engines import SearchEngineGetter
+from .startup import Startup, Requirement
 from .dependencies import *
+from .stores import FirstTilesStore, EmbeddingsStore, MetadataStore, NeighborGraphStore, UMAPStore
+from .tile_codec import (TILES_MEDIA_TYPE, NDJSON_MEDIA_TYPE, accepts_binary, accepts_ndjson, encode_tiles,
+                         encode_ndjson, encode_image_to_tile)
+from .uploads import ImageTooLargeError, UploadEmbedder
+from .versions import ConditionalGetter, matches_etag
+from .viewport import VIEWPORT_MODES, get_missing_indexes
 from ..CONSTANTS import *
-from ..db_utilities.utils import create_connection
-from ..embeddings_model.CLIPEmbeddings import ClipEmbeddings
+from ..db_utilities.utils import create_connection, load_environment
+from ..metrics import generate_metrics, observe_response
+
+# Create the components of the app. The slow ones are initialized in the background, so that the endpoints that do not
+# need them are served immediately. Failed initializations are retried with an exponential backoff. Components still
+# failing after STARTUP_RETRIES retries are reported as failed, and retried every STARTUP_MAX_BACKOFF seconds.
+startup = Startup(STARTUP_RETRIES, STARTUP_RETRY_BACKOFF, STARTUP_MAX_BACKOFF, retry_failed=True)
+
+# Load environment variables. The connection to Milvus is created in the background, so that the app starts while
+# Milvus is down.
+load_environment()
+
+
+def connect():
+    # Create connection
+    create_connection(ROOT_USER, ROOT_PASSWD, False)
+    # Set database
+    db.using_database(DEFAULT_DATABASE_NAME)
 
-# Create connection
-create_connection(ROOT_USER, ROOT_PASSWD)
 
-# Load dataset options from datasets.json. The environment variables are loaded in the create_connection function.
-with open(DATASETS_JSON_PATH, "r") as f:
-    datasets = json.load(f)["datasets"]
+startup.add("milvus", connect)
 
-# Set database
-db.using_database(DEFAULT_DATABASE_NAME)
+# Create catalog of the datasets in datasets.json and of the collections in the database. The collections are listed
+# once Milvus is connected, and then refreshed in the background.
+catalog = Catalog(DATASETS_JSON_PATH, CATALOG_REFRESH_INTERVAL, CATALOG_STAT_INTERVAL)
+startup.add("catalog", catalog.start, requires=["milvus"])
+catalog_requirement = Requirement(startup, "catalog")
+
+# Create manager keeping the loaded collections within the memory budget. The workers of the backend load and release
+# the same collections, so each manager checks the state of the collections in Milvus when there are several workers.
+residency_manager = ResidencyManager(RESIDENCY_MEMORY_BUDGET, RESIDENCY_POLICY,
+                                     shared=int(os.getenv(BACKEND_WORKERS, "1")) > 1)
 
 # Create dependency objects
-dataset_collection_name_getter = DatasetCollectionNameGetter(datasets)
-clusters_collection_name_getter = ClustersCollectionNameGetter(datasets)
-image_to_tile_collection_name_getter = ImageToTileCollectionNameGetter(datasets)
-dataset_collection_info_getter = DatasetCollectionInfoGetter(datasets)
-updater = Updater(
-    dataset_collection_name_getter,
-    clusters_collection_name_getter,
-    image_to_tile_collection_name_getter
-)
-
-embeddings = Embedder(ClipEmbeddings(DEVICE))
+dataset_collection_name_getter = DatasetCollectionNameGetter(residency_manager)
+clusters_collection_name_getter = ClustersCollectionNameGetter(residency_manager)
+image_to_tile_collection_name_getter = ImageToTileCollectionNameGetter(residency_manager)
+dataset_collection_info_getter = DatasetCollectionInfoGetter(catalog, residency_manager)
+updater = Updater(catalog)
+# Create dependencies answering conditional requests for the data of each build of the collections
+tiles_conditional_getter = ConditionalGetter(catalog, "clusters", "_zoom_levels_clusters")
+first_tiles_conditional_getter = ConditionalGetter(catalog, "clusters", "_zoom_levels_clusters", compressible=True)
+image_to_tile_conditional_getter = ConditionalGetter(catalog, "image_to_tile", "_image_to_tile")
+umap_conditional_getter = ConditionalGetter(catalog, "umap")
+
+
+def get_dataset_collection_names(dataset: str) -> List[str]:
+    return [dataset, dataset + "_zoom_levels_clusters", dataset + "_image_to_tile"]
+
+
+def warm_up(c: Catalog):
+    # Load in the background the collections of the datasets, in the order of datasets.json, as long as they fit in
+    # the memory budget
+    for dataset in c.datasets:
+        for name in get_dataset_collection_names(dataset["name"]):
+            residency_manager.prefetch(name, evict=False)
+
+
+def add_catalog_listeners(listeners: List[Callable[[Catalog], None]]):
+    # The listeners are called once before being added to the catalog, so that a failure is retried by the startup
+    # without adding a listener twice
+    for listener in listeners:
+        listener(catalog)
+    # Update them every time the catalog changes
+    for listener in listeners:
+        catalog.add_listener(listener)
+
+
+# Create the collections of the datasets and register them with the residency manager, which queries Milvus for each
+# collection. The clusters collections are registered first, so that tiles are served as soon as possible.
+startup.add("clusters", lambda: add_catalog_listeners([clusters_collection_name_getter.update]), requires=["catalog"])
+clusters_requirement = Requirement(startup, "clusters")
+startup.add("collections", lambda: add_catalog_listeners([
+    dataset_collection_name_getter.update, image_to_tile_collection_name_getter.update,
+    dataset_collection_info_getter.update, warm_up
+]), requires=["clusters"])
+collections_requirement = Requirement(startup, "collections")
+
+# Get the precision of the text encoder. Embeddings of the int8 text encoder are cached apart from the fp32 ones.
+text_encoder_precision = os.getenv(TEXT_ENCODER_PRECISION, DEFAULT_TEXT_ENCODER_PRECISION)
+text_encoder_name = CLIP_MODEL if text_encoder_precision == DEFAULT_TEXT_ENCODER_PRECISION else \
+    f"{CLIP_MODEL}:{text_encoder_precision}"
+
+# Create the embedders. Their model is set once it is loaded.
+embeddings = Embedder(None, TextEmbeddingCache(text_encoder_name, TEXT_EMBEDDING_CACHE_SIZE,
+                                               TEXT_EMBEDDING_CACHE_PATH))
+# Uploaded images are decoded outside the event loop, and their embeddings are cached by content hash
+upload_embedder = UploadEmbedder(None, ImageEmbeddingCache(CLIP_MODEL, IMAGE_EMBEDDING_CACHE_SIZE),
+                                 int(os.getenv(UPLOAD_MAX_PIXELS, DEFAULT_UPLOAD_MAX_PIXELS)), UPLOAD_DECODE_WORKERS)
+
+
+def load_embeddings_model():
+    if os.getenv(EMBEDDINGS_SERVICE):
+        # Use the model of the embeddings service shared by the workers, which batches the requests of all the workers
+        from ..embeddings_model.RemoteEmbeddings import RemoteEmbeddings
+
+        authkey = os.getenv(EMBEDDINGS_SERVICE_AUTHKEY)
+        model = RemoteEmbeddings(os.getenv(EMBEDDINGS_SERVICE), authkey.encode() if authkey else None)
+        # Wait for the service to load the model
+        model.wait()
+    else:
+        # Import the model here, as importing torch and transformers takes several seconds
+        from ..embeddings_model.MicroBatchingEmbeddings import MicroBatchingEmbeddings
+        from ..embeddings_model.backends import get_clip_embeddings
+
+        # The model runs on torch, or on ONNX Runtime with the graphs exported in the data directory
+        clip_embeddings = get_clip_embeddings(os.getenv(EMBEDDINGS_BACKEND, DEFAULT_EMBEDDINGS_BACKEND), DEVICE,
+                                              text_encoder_precision, os.path.join(DATA_DIR_PATH, ONNX_MODEL_DIR_NAME),
+                                              int(os.getenv(ONNX_INTRA_OP_THREADS, DEFAULT_ONNX_INTRA_OP_THREADS)))
+        # Requests arriving within INFERENCE_BATCHING_WINDOW seconds are embedded with a single forward pass
+        model = MicroBatchingEmbeddings(clip_embeddings, INFERENCE_BATCHING_WINDOW, INFERENCE_MAX_BATCH_SIZE)
+    # Run a forward pass of each tower, so that the first requests do not pay for the lazy initializations
+    if (model.getTextEmbeddings(["warm up"]) is None or
+            model.getImageEmbeddings([Image.new("RGB", (CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE))]) is None):
+        raise RuntimeError("Warm-up of the embeddings model failed.")
+    embeddings.embeddings = model
+    upload_embedder.embeddings = model
+
+
+startup.add("model", load_embeddings_model)
+model_requirement = Requirement(startup, "model")
+
+# The UMAP collection is loaded in the background
 umap_getter = UMAPCollectionGetter()
+startup.add("umap", umap_getter.load, requires=["milvus"])
+umap_requirement = Requirement(startup, "umap")
+# Create store for the UMAP projections, which are decoded once
+umap_store = UMAPStore(umap_getter, gets.get_umap_projections)
+
+# Create cache for tiles
+tile_cache = TileCache(TILE_CACHE_MAX_BYTES, TILE_CACHE_VALIDATION_INTERVAL)
+# Create store for the precomputed first tiles
+first_tiles_store = FirstTilesStore(DATA_DIR_PATH)
+# Create store for the memory-mapped embeddings of each dataset
+embeddings_store = EmbeddingsStore(DATA_DIR_PATH)
+# Create store for the metadata of each dataset, loaded in memory
+metadata_store = MetadataStore(DATA_DIR_PATH)
+# Create store for the precomputed neighbors of each image
+neighbor_graph_store = NeighborGraphStore(embeddings_store)
+# Create getter for the search engine selected by each dataset in datasets.json
+search_engine_getter = SearchEngineGetter(catalog.datasets, embeddings_store)
+catalog.add_listener(lambda c: search_engine_getter.update(c.datasets))
 
 # Create app
 app = FastAPI()
@@ -46,94 +179,272 @@ async def add_access_control_allow_origin_header(request: Request, call_next):
     return response
 
 
-@app.get("/api/collection-names")
-def get_collection_names(collections: list[str] = Depends(updater)):
+# Add middleware that records the duration and the response size of the requests of each route
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, so that the number of series does not depend on the query parameters
+    route = request.scope.get("route")
+    route = route.path if route is not None else "unmatched"
+    # Record the duration and the size once the body has been sent, as streamed responses start before their body is
+    # complete and have no Content-Length header
+    response.body_iterator = observe_response(response.body_iterator, request.method, route, response.status_code,
+                                              start)
+    return response
+
+
+@app.get("/healthz")
+async def get_health():
+    # The app is alive as long as it answers
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def get_readiness(response: Response, components: str | None = None):
+    # The app is ready when the components given as comma separated list, by default READINESS_COMPONENTS, are ready.
+    # The state of every component is returned, so that the endpoints that can be served are known.
+    required = components.split(",") if components is not None else READINESS_COMPONENTS
+    ready = startup.is_ready(required)
+    if not ready:
+        response.status_code = 503
+    collections = residency_manager.stats()["collections"]
+    return {
+        "ready": ready,
+        "components": startup.status(),
+        "collections": {name: residency["state"] for name, residency in collections.items()}
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Return the metrics in the Prometheus text format, aggregated over the workers and the embeddings service
+    return Response(content=generate_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/api/collection-names", dependencies=[Depends(catalog_requirement)])
+async def get_collection_names(collections: list[str] = Depends(updater)):
     # Return collection names as a list
     return {"collections": collections}
 
 
 # Get collection information.
-@app.get("/api/collection-info")
-def get_collection_info(collection: {} = Depends(dataset_collection_info_getter)):
+@app.get("/api/collection-info", dependencies=[Depends(collections_requirement)])
+async def get_collection_info(name: str = Query(..., alias="collection"),
+                              collection: {} = Depends(dataset_collection_info_getter)):
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
     else:
+        # The client asks for the information of a dataset when the dataset is selected, so start loading the
+        # collections of the dataset before its tiles are requested
+        for collection_name in get_dataset_collection_names(name):
+            residency_manager.prefetch(collection_name)
         # Collection found, return collection info
-        return {"number_of_entities": collection["number_of_entities"], "zoom_levels": collection["zoom_levels"]}
+        return {"number_of_entities": collection["number_of_entities"], "zoom_levels": collection["zoom_levels"],
+                "versions": collection["versions"]}
 
 
-@app.get("/api/image-text")
-def get_image_from_text(collection: Collection = Depends(dataset_collection_name_getter),
-                        text_embedding: torch.Tensor = Depends(embeddings)):
+@app.get("/api/image-text", dependencies=[Depends(collections_requirement), Depends(model_requirement)])
+async def get_image_from_text(collection: Collection = Depends(dataset_collection_name_getter),
+                              text_embedding: np.ndarray = Depends(embeddings)):
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
     else:
         try:
             # Collection found, return image path
-            data = gets.get_image_info_from_text_embedding(collection, text_embedding)
+            data = await gets.get_image_info_from_text_embedding(collection, text_embedding,
+                                                                 search_engine_getter(collection.name))
+            return data
+        except MilvusException:
+            # Milvus error, return code 505
+            raise HTTPException(status_code=505, detail="Milvus error")
+
+
+class TextQueries(BaseModel):
+    texts: List[str] = Field(..., min_length=1, max_length=MAX_TEXT_QUERIES_PER_BATCH)
+    k: int = Field(1, ge=1, le=MAX_TOP_K)
+
+
+@app.post("/api/image-text-batch", dependencies=[Depends(collections_requirement), Depends(model_requirement)])
+async def get_images_from_texts(queries: TextQueries,
+                                collection: Collection = Depends(dataset_collection_name_getter)):
+    if collection is None:
+        # Collection not found, return 404
+        raise HTTPException(status_code=404, detail="Collection not found")
+    else:
+        try:
+            # Embed all texts with one forward pass, and search all the embeddings with one search
+            text_embeddings = await run_in_threadpool(embeddings.embed_batch, queries.texts)
+            data = await gets.get_images_info_from_text_embeddings(collection, text_embeddings, queries.k,
+                                                                   search_engine_getter(collection.name))
             return data
         except MilvusException:
             # Milvus error, return code 505
             raise HTTPException(status_code=505, detail="Milvus error")
 
 
-@app.get("/api/tiles")
-def get_tiles(indexes: List[int] = Depends(parse_comma_separated),
-              collection: Collection = Depends(clusters_collection_name_getter)):
+async def stream_tiles(pages: AsyncIterator[List[dict]], headers: dict) -> StreamingResponse:
+    """
+    Stream tiles as newline-delimited JSON, sending each page of tiles as soon as it is available. Errors of the first
+    page are reported with a status code. Once the response has started, a Milvus error can only end the stream: the
+    error is logged and raised again, so that the server aborts the response instead of ending it like a complete one.
+    Clients must treat a stream closed without its last chunk as failed, and must not cache it.
+    @param pages: pages of tiles, as returned by iter_tiles or iter_first_tiles.
+    @param headers:
+    @return:
+    """
+    # Fetch the first page before the response starts, so that its errors are still reported with a status code
+    first_page = await anext(pages, [])
+
+    async def lines():
+        yield encode_ndjson(first_page)
+        try:
+            async for tiles in pages:
+                yield encode_ndjson(tiles)
+        except MilvusException as e:
+            print("Error in streaming tiles, the response is aborted. Error message: ", e)
+            raise
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+@app.get("/api/tiles", dependencies=[Depends(clusters_requirement)])
+async def get_tiles(request: Request, response: Response, indexes: List[int] = Depends(parse_comma_separated),
+                    caching_headers: dict = Depends(tiles_conditional_getter),
+                    collection: Collection = Depends(clusters_collection_name_getter)):
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
     else:
         # Collection found, return tile data
         try:
-            tile_data = gets.get_tiles(indexes, collection)
-            # Return tile data
+            # Stream tiles one per line if the client asked for it
+            if accepts_ndjson(request.headers.get("accept")):
+                return await stream_tiles(gets.iter_tiles(indexes, collection, tile_cache),
+                                          {"Vary": "Accept", **caching_headers})
+            tile_data = await gets.get_tiles(indexes, collection, tile_cache)
+            # Return tile data, in binary format if the client asked for it
+            if accepts_binary(request.headers.get("accept")):
+                return Response(content=encode_tiles(tile_data), media_type=TILES_MEDIA_TYPE,
+                                headers={"Vary": "Accept", **caching_headers})
+            # JSON and binary responses share the URL, so caches must key them on the Accept header
+            response.headers.update({"Vary": "Accept", **caching_headers})
             return tile_data
         except MilvusException:
             # Milvus error, return code 505
             raise HTTPException(status_code=404, detail="Tile data not found")
 
 
-@app.get("/api/image-to-tile")
-def get_tile_from_image(index: int,
-                        collection: Collection = Depends(image_to_tile_collection_name_getter)):
+class ViewportQuery(BaseModel):
+    # Tile in the upper left corner of the viewport
+    x: int = Field(..., ge=0)
+    y: int = Field(..., ge=0)
+    zoom: int = Field(..., ge=0)
+    mode: str = "full"
+    # Indexes of the tiles held or already requested by the client
+    cached: List[int] = Field([], max_length=MAX_VIEWPORT_CACHED_INDEXES)
+
+
+@app.post("/api/viewport", dependencies=[Depends(clusters_requirement)])
+async def get_viewport(request: Request, query: ViewportQuery,
+                       collection: Collection = Depends(clusters_collection_name_getter)):
+    if collection is None:
+        # Collection not found, return 404
+        raise HTTPException(status_code=404, detail="Collection not found")
+    if query.mode not in VIEWPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode {query.mode}. Mode must be in {VIEWPORT_MODES}")
+    dataset = catalog.get_dataset(collection.name.removesuffix("_zoom_levels_clusters"))
+    max_zoom_level = dataset["zoom_levels"]
+    if query.zoom > max_zoom_level or query.x >= 2 ** query.zoom or query.y >= 2 ** query.zoom:
+        raise HTTPException(status_code=400, detail="Tile out of the map")
+
+    # Compute the tiles to prefetch with the rules of the frontend, and return the ones the client does not hold in a
+    # single response
+    indexes = get_missing_indexes(query.x, query.y, query.zoom, max_zoom_level, set(query.cached), query.mode)
+    try:
+        tile_data = await gets.get_tiles(indexes, collection, tile_cache) if len(indexes) > 0 else []
+    except MilvusException:
+        raise HTTPException(status_code=404, detail="Tile data not found")
+    # Return tile data, in binary format if the client asked for it
+    if accepts_binary(request.headers.get("accept")):
+        return Response(content=encode_tiles(tile_data), media_type=TILES_MEDIA_TYPE, headers={"Vary": "Accept"})
+    return tile_data
+
+
+@app.get("/api/image-to-tile", dependencies=[Depends(collections_requirement)])
+async def get_tile_from_image(request: Request, response: Response, index: int,
+                              caching_headers: dict = Depends(image_to_tile_conditional_getter),
+                              collection: Collection = Depends(image_to_tile_collection_name_getter)):
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
     else:
         # Collection found, return tile data
         try:
-            tile_data = gets.get_tile_from_image(index, collection)
+            tile_data = await gets.get_tile_from_image(index, collection)
             if len(tile_data) == 0:
                 # In the required image is present in the database, the distance should be 0
                 raise HTTPException(status_code=404, detail="Tile data not found")
+            elif accepts_binary(request.headers.get("accept")):
+                return Response(content=encode_image_to_tile(tile_data), media_type=TILES_MEDIA_TYPE,
+                                headers={"Vary": "Accept", **caching_headers})
             else:
+                response.headers.update({"Vary": "Accept", **caching_headers})
                 return tile_data
         except MilvusException:
             # Milvus error, return code 505
             raise HTTPException(status_code=404, detail="Tile data not found")
 
 
-@app.get("/api/images")
-def get_images(indexes: List[int] = Query(...), collection: Collection = Depends(dataset_collection_name_getter)):
-    # Both indexes and collection are query parameters
-    if collection is None:
+async def get_metadata(dataset: str, indexes: List[int], fields: List[str]) -> List[dict]:
+    """
+    Get the given fields of the images of a dataset. The fields are read from the metadata store if it contains them,
+    otherwise from the collection, which is only acquired in that case.
+    @param dataset:
+    @param indexes:
+    @param fields:
+    @return:
+    """
+    if dataset not in dataset_collection_name_getter.collections.keys():
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
-    else:
-        # Collection found, return images
-        try:
-            images = gets.get_paths_from_indexes(indexes, collection)
-            return images
-        except MilvusException:
-            # Milvus error, return code 505
-            raise HTTPException(status_code=505, detail="Milvus error")
+    # The metadata is loaded in the threadpool, as the first load of a dataset reads its file
+    metadata = await run_in_threadpool(metadata_store, dataset)
+    if metadata is not None and set(fields) <= set(metadata.fields):
+        return await gets.get_metadata(indexes, fields, metadata=metadata)
+    try:
+        collection = await run_in_threadpool(dataset_collection_name_getter, dataset)
+        return await gets.get_metadata(indexes, fields, collection)
+    except MilvusException:
+        # Milvus error, return code 505
+        raise HTTPException(status_code=505, detail="Milvus error")
+
+
+@app.get("/api/images", dependencies=[Depends(collections_requirement)])
+async def get_images(indexes: List[int] = Query(...), collection: str = Query(...)):
+    # Both indexes and collection are query parameters. Return the path of each image.
+    return await get_metadata(collection, indexes, ["path"])
+
+
+class MetadataQueries(BaseModel):
+    indexes: List[int] = Field(..., min_length=1, max_length=MAX_METADATA_INDEXES_PER_BATCH)
+    fields: List[str] = Field(..., min_length=1, max_length=len(SEARCH_OUTPUT_FIELDS))
+
+
+@app.post("/api/images-batch", dependencies=[Depends(collections_requirement)])
+async def get_images_batch(queries: MetadataQueries, collection: str = Query(...)):
+    # Return only the requested fields of each image, in the order of the indexes
+    unknown_fields = [field for field in queries.fields if field not in SEARCH_OUTPUT_FIELDS]
+    if len(unknown_fields) > 0:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown_fields}. Fields must be in "
+                                                    f"{SEARCH_OUTPUT_FIELDS}")
+    return await get_metadata(collection, queries.indexes, queries.fields)
 
 
-@app.get("/api/neighbors")
-def get_neighbours(index: int, k: int, collection: Collection = Depends(dataset_collection_name_getter)):
+@app.get("/api/neighbors", dependencies=[Depends(collections_requirement)])
+async def get_neighbours(index: int, k: int, collection: Collection = Depends(dataset_collection_name_getter)):
     # Both index and collection are query parameters
     if collection is None:
         # Collection not found, return 404
@@ -141,49 +452,141 @@ def get_neighbours(index: int, k: int, collection: Collection = Depends(dataset_
     else:
         # Collection found, return neighbours
         try:
-            neighbours = gets.get_neighbors(index, collection, k)
+            neighbours = await gets.get_neighbors(index, collection, k, embeddings_store(collection.name),
+                                                  search_engine_getter(collection.name),
+                                                  neighbor_graph_store(collection.name))
             return neighbours
+        except KeyError:
+            # Image not found, return 404
+            raise HTTPException(status_code=404, detail="Image not found")
         except MilvusException:
             # Milvus error, return code 505
             raise HTTPException(status_code=505, detail="Milvus error")
 
 
-@app.get("/api/first-tiles")
-def get_first_tiles(collection: Collection = Depends(clusters_collection_name_getter)):
+class NeighborQueries(BaseModel):
+    indexes: List[int] = Field(..., min_length=1, max_length=MAX_NEIGHBOR_QUERIES_PER_BATCH)
+    k: int = Field(10, ge=1, le=MAX_TOP_K)
+
+
+@app.post("/api/neighbors-batch", dependencies=[Depends(collections_requirement)])
+async def get_neighbours_batch(queries: NeighborQueries,
+                               collection: Collection = Depends(dataset_collection_name_getter)):
     if collection is None:
         # Collection not found, return 404
         raise HTTPException(status_code=404, detail="Collection not found")
     else:
-        # Collection found, return tile data
+        # Collection found, return the neighbours of each image
         try:
-            tile_data = gets.get_first_tiles(collection)
-            return tile_data
+            neighbours = await gets.get_neighbors_batch(queries.indexes, collection, queries.k,
+                                                        embeddings_store(collection.name),
+                                                        search_engine_getter(collection.name),
+                                                        neighbor_graph_store(collection.name))
+            return neighbours
+        except KeyError:
+            # Image not found, return 404
+            raise HTTPException(status_code=404, detail="Image not found")
         except MilvusException:
             # Milvus error, return code 505
-            raise HTTPException(status_code=404, detail="Tile data not found")
+            raise HTTPException(status_code=505, detail="Milvus error")
+
+
+@app.get("/api/first-tiles", dependencies=[Depends(clusters_requirement)])
+async def get_first_tiles(request: Request, response: Response, collection: str = Query(...),
+                          caching_headers: dict = Depends(first_tiles_conditional_getter)):
+    if collection not in clusters_collection_name_getter.collections.keys():
+        # Collection not found, return 404
+        raise HTTPException(status_code=404, detail="Collection not found")
+
+    # Serve the precomputed first tiles if they have been generated for the dataset
+    payload = first_tiles_store(collection.removesuffix("_zoom_levels_clusters"))
+    if payload is not None:
+        # Each representation of the payload has its own ETag and Vary headers, which replace the ones of the caching
+        # headers
+        if_none_match = request.headers.get("if-none-match")
+        if accepts_ndjson(request.headers.get("accept")):
+            headers = {**caching_headers, "ETag": payload.ndjson_etag, "Vary": "Accept"}
+            if matches_etag(if_none_match, payload.ndjson_etag):
+                return Response(status_code=304, headers=headers)
+            return Response(content=payload.ndjson, media_type=NDJSON_MEDIA_TYPE, headers=headers)
+        if accepts_binary(request.headers.get("accept")):
+            headers = {**caching_headers, "ETag": payload.binary_etag, "Vary": "Accept"}
+            if matches_etag(if_none_match, payload.binary_etag):
+                return Response(status_code=304, headers=headers)
+            return Response(content=payload.binary, media_type=TILES_MEDIA_TYPE, headers=headers)
+        headers = {**caching_headers, "ETag": payload.etag, "Vary": "Accept, Accept-Encoding"}
+        if matches_etag(if_none_match, payload.etag):
+            return Response(status_code=304, headers=headers)
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            return Response(content=payload.compressed, media_type="application/json",
+                            headers={**headers, "Content-Encoding": "gzip"})
+        return Response(content=payload.decompressed, media_type="application/json", headers=headers)
+
+    # Collection found, return tile data
+    try:
+        clusters_collection = await run_in_threadpool(clusters_collection_name_getter, collection)
+        # Stream tiles one per line if the client asked for it, starting with the first zoom levels
+        if accepts_ndjson(request.headers.get("accept")):
+            return await stream_tiles(gets.iter_first_tiles(clusters_collection, tile_cache),
+                                      {"Vary": "Accept", **caching_headers})
+        tile_data = await gets.get_first_tiles(clusters_collection, tile_cache)
+        if accepts_binary(request.headers.get("accept")):
+            return Response(content=encode_tiles(tile_data), media_type=TILES_MEDIA_TYPE,
+                            headers={"Vary": "Accept", **caching_headers})
+        response.headers.update({"Vary": "Accept", **caching_headers})
+        return tile_data
+    except MilvusException:
+        # Milvus error, return code 505
+        raise HTTPException(status_code=404, detail="Tile data not found")
 
 
-@app.get("/api/umap")
-def get_umap_data(n_neighbors: int, min_dist: float):
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    # Return hit/miss counters of the caches
+    return {"tiles": tile_cache.stats(), "text_embeddings": embeddings.cache.stats(),
+            "image_embeddings": upload_embedder.cache.stats()}
+
+
+@app.get("/api/residency-stats")
+async def get_residency_stats():
+    # Return the state of the collections and the load and eviction counters
+    return residency_manager.stats()
+
+
+@app.get("/api/umap", dependencies=[Depends(umap_requirement)])
+async def get_umap_data(request: Request, n_neighbors: int, min_dist: float, format: str = "json",
+                        caching_headers: dict = Depends(umap_conditional_getter)):
+    if format not in UMAP_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be in {UMAP_FORMATS}")
     # Get UMAP data
     try:
-        return gets.get_umap_data(umap_getter(), n_neighbors, min_dist)
+        projection = await umap_store.get(n_neighbors, min_dist)
     except Exception:
         # Error in fetching UMAP data
         raise HTTPException(status_code=404, detail="UMAP data not found")
 
+    # The projections only change when the umap collection is rebuilt. If its version is recorded, conditional
+    # requests have already been answered.
+    headers = caching_headers or {"ETag": projection.etag(format),
+                                  "Cache-Control": f"public, max-age={UMAP_CACHE_MAX_AGE}"}
+    if matches_etag(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=projection.encode(format),
+                    media_type="application/json" if format == "json" else "application/octet-stream",
+                    headers=headers)
+
 
-@app.get("/api/random-image")
-def get_random_image(num: float, collection: Collection = Depends(dataset_collection_name_getter)):
+@app.get("/api/random-image", dependencies=[Depends(collections_requirement)])
+async def get_random_image(num: float, collection: Collection = Depends(dataset_collection_name_getter)):
     # Get random image
     try:
-        return gets.get_random_image(num, collection)
+        return await gets.get_random_image(num, collection)
     except MilvusException:
         # Milvus error, return code 505
         raise HTTPException(status_code=505, detail="Milvus error")
 
 
-@app.post("/api/image-image")
+@app.post("/api/image-image", dependencies=[Depends(collections_requirement), Depends(model_requirement)])
 async def get_image_from_image(collection: Collection = Depends(dataset_collection_name_getter),
                                file: UploadFile = File(...)):
     if collection is None:
@@ -193,11 +596,18 @@ async def get_image_from_image(collection: Collection = Depends(dataset_collecti
         try:
             # Get image
             image_data = await file.read()
-            # Get image embedding
-            image_embedding = embeddings.embeddings.getImageEmbeddings(Image.open(BytesIO(image_data)))
+            # Get image embedding. The image is decoded and embedded outside the event loop.
+            image_embedding = await upload_embedder(image_data)
             # Collection found, return image path
-            data = gets.get_image_info_from_image_embedding(collection, image_embedding)
+            data = await gets.get_image_info_from_image_embedding(collection, image_embedding,
+                                                                  search_engine_getter(collection.name))
             return data
+        except ImageTooLargeError as e:
+            # Image too large, return code 413
+            raise HTTPException(status_code=413, detail=str(e))
+        except UnidentifiedImageError:
+            # File is not an image, return code 400
+            raise HTTPException(status_code=400, detail="Invalid image")
         except MilvusException:
             # Milvus error, return code 505
             raise HTTPException(status_code=505, detail="Milvus error")
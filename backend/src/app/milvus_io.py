@@ -0,0 +1,78 @@
+"""
+Async access layer for Milvus. pymilvus only offers blocking calls, so the calls are run on a dedicated, bounded
+executor instead of the threadpool that serves the endpoints. Every call has a timeout, which is enforced both by
+pymilvus on the gRPC request and by the event loop on the wait.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from pymilvus import Collection, MilvusException
+
+from .CONSTANTS import *
+from ..metrics import MILVUS_CALL_DURATION, MILVUS_CALL_ERRORS
+
+# Define executor for blocking Milvus calls
+_executor = ThreadPoolExecutor(max_workers=MILVUS_IO_WORKERS, thread_name_prefix="milvus-io")
+
+
+async def run(function, *args, timeout: float = MILVUS_CALL_TIMEOUT, **kwargs):
+    """
+    Run a blocking function on the Milvus executor.
+    @param function:
+    @param args:
+    @param timeout: maximum number of seconds to wait for the result.
+    @param kwargs:
+    @return: result of the function.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_executor, partial(function, *args, **kwargs)), timeout)
+    except asyncio.TimeoutError:
+        raise MilvusException(message=f"Milvus call timed out after {timeout} seconds.")
+
+
+async def _timed_run(operation: str, collection: Collection, function, timeout: float):
+    """
+    Run a blocking function on the Milvus executor, and record its duration.
+    @param operation: name of the operation, used as label of the metrics.
+    @param collection:
+    @param function:
+    @param timeout:
+    @return: result of the function.
+    """
+    start = time.perf_counter()
+    try:
+        return await run(function, timeout=timeout)
+    except Exception:
+        MILVUS_CALL_ERRORS.labels(operation, collection.name).inc()
+        raise
+    finally:
+        MILVUS_CALL_DURATION.labels(operation, collection.name).observe(time.perf_counter() - start)
+
+
+async def query(collection: Collection, timeout: float = MILVUS_CALL_TIMEOUT, **kwargs) -> list:
+    """
+    Run collection.query on the Milvus executor.
+    @param collection:
+    @param timeout:
+    @param kwargs: arguments of collection.query.
+    @return:
+    """
+    return await _timed_run("query", collection, partial(collection.query, timeout=timeout, **kwargs), timeout)
+
+
+async def search(collection: Collection, timeout: float = MILVUS_CALL_TIMEOUT, **kwargs):
+    """
+    Run collection.search on the Milvus executor.
+    @param collection:
+    @param timeout:
+    @param kwargs: arguments of collection.search.
+    @return:
+    """
+    return await _timed_run("search", collection, partial(collection.search, timeout=timeout, **kwargs), timeout)
+
+
+async def num_entities(collection: Collection, timeout: float = MILVUS_CALL_TIMEOUT) -> int:
+    return await _timed_run("num_entities", collection, lambda: collection.num_entities, timeout)
@@ -0,0 +1,335 @@
+"""
+Residency manager for the collections used by the app. Loaded collections occupy memory in the Milvus query nodes, so
+the manager keeps the estimated footprint of the loaded collections within a memory budget. When a collection must be
+loaded and the budget is exceeded, idle collections are released in LRU or LFU order. Loads run in the background,
+and requests for a collection that is being loaded wait until it is ready. When the backend runs several workers, each
+worker has its own manager, and the managers check the state of the collections in Milvus, as a collection can be
+loaded or released by another worker.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from pymilvus import Collection, DataType, utility
+from pymilvus.client.types import LoadState
+
+from .CONSTANTS import *
+from ..metrics import COLLECTION_EVENTS, COLLECTION_LOAD_DURATION, RESIDENT_BYTES
+
+# Define states of a collection
+RELEASED = "released"
+LOADING = "loading"
+LOADED = "loaded"
+
+# Define size in bytes of the values of fixed size fields
+_FIELD_SIZES = {
+    DataType.BOOL: 1,
+    DataType.INT8: 1,
+    DataType.INT16: 2,
+    DataType.INT32: 4,
+    DataType.INT64: 8,
+    DataType.FLOAT: 4,
+    DataType.DOUBLE: 8
+}
+
+
+def estimate_footprint(collection: Collection) -> int:
+    """
+    Estimate the memory needed to load a collection from its schema and its number of entities. Variable size fields
+    and dynamic fields are counted as RESIDENCY_VARIABLE_FIELD_BYTES bytes per entity.
+    @param collection:
+    @return: estimated footprint in bytes.
+    """
+    entity_size = 0
+    for field in collection.schema.fields:
+        if field.dtype == DataType.FLOAT_VECTOR:
+            entity_size += 4 * field.params["dim"]
+        elif field.dtype in (DataType.FLOAT16_VECTOR, DataType.BFLOAT16_VECTOR):
+            entity_size += 2 * field.params["dim"]
+        elif field.dtype == DataType.BINARY_VECTOR:
+            entity_size += field.params["dim"] // 8
+        else:
+            entity_size += _FIELD_SIZES.get(field.dtype, RESIDENCY_VARIABLE_FIELD_BYTES)
+    return collection.num_entities * entity_size
+
+
+def measure_footprint(collection: Collection) -> int | None:
+    """
+    Get the memory used by the loaded segments of a collection.
+    @param collection:
+    @return: footprint in bytes, or None if it is not available.
+    """
+    size = sum(segment.mem_size for segment in utility.get_query_segment_info(collection.name))
+    return size if size > 0 else None
+
+
+def is_loaded(collection: Collection) -> bool:
+    return utility.load_state(collection.name) == LoadState.Loaded
+
+
+class Residency:
+    """
+    Residency state of a collection.
+    """
+
+    def __init__(self, collection: Collection, footprint: int):
+        self.collection = collection
+        self.footprint = footprint
+        self.state = RELEASED
+        self.last_used = 0.0
+        self.uses = 0
+        # Number of times the collection has been loaded by the manager
+        self.loads = 0
+        # Time at which the state of the collection was last checked in Milvus
+        self.checked = None
+        # Event set when the collection is not loading
+        self.ready = threading.Event()
+        self.ready.set()
+        # Create lock to ensure that the collection is not loaded and released at the same time
+        self.transition_lock = threading.Lock()
+
+
+class ResidencyManager:
+    """
+    Class for keeping the working set of collections loaded within a memory budget.
+    """
+
+    def __init__(self, budget: int = RESIDENCY_MEMORY_BUDGET, policy: str = RESIDENCY_POLICY,
+                 eviction_grace: float = RESIDENCY_EVICTION_GRACE, load_timeout: float = RESIDENCY_LOAD_TIMEOUT,
+                 load_workers: int = RESIDENCY_LOAD_WORKERS,
+                 estimate: Callable[[Collection], int] = estimate_footprint,
+                 measure: Callable[[Collection], int | None] = measure_footprint,
+                 loaded: Callable[[Collection], bool] = is_loaded, shared: bool = False,
+                 state_check_interval: float = RESIDENCY_STATE_CHECK_INTERVAL):
+        """
+        @param budget: maximum estimated footprint in bytes of the loaded collections.
+        @param policy: "lru" to release the least recently used collections first, "lfu" to release the least
+        frequently used collections first.
+        @param eviction_grace: number of seconds a collection must be idle before it can be released, so that
+        collections are not released while they are queried.
+        @param load_timeout: maximum number of seconds a request waits for a collection to be loaded.
+        @param load_workers: number of collections loaded at the same time.
+        @param estimate: function estimating the footprint of a released collection.
+        @param measure: function measuring the footprint of a loaded collection.
+        @param loaded: function returning whether a collection is loaded in Milvus.
+        @param shared: whether other processes load and release the same collections. If True, the state of a collection
+        in Milvus is checked when it is acquired.
+        @param state_check_interval: number of seconds during which the state of a loaded collection in Milvus is not
+        checked again, when the collections are shared.
+        """
+        if policy not in RESIDENCY_POLICIES:
+            raise ValueError(f"policy must be in {RESIDENCY_POLICIES}")
+        self.budget = budget
+        self.policy = policy
+        self.eviction_grace = eviction_grace
+        self.load_timeout = load_timeout
+        self.estimate = estimate
+        self.measure = measure
+        self.loaded = loaded
+        self.shared = shared
+        self.state_check_interval = state_check_interval
+        self.residencies: Dict[str, Residency] = {}
+        self.resident_bytes = 0
+        # Define counters
+        self.loads = 0
+        self.load_failures = 0
+        self.evictions = 0
+        self.waits = 0
+        self._executor = ThreadPoolExecutor(max_workers=load_workers, thread_name_prefix="residency")
+        # Create lock to ensure that the states are not modified by multiple threads at the same time
+        self.lock = threading.Lock()
+
+    def register(self, collection: Collection):
+        """
+        Start managing a collection. A collection that is already loaded in Milvus is counted as resident.
+        @param collection:
+        @return:
+        """
+        residency = Residency(collection, self.estimate(collection))
+        residency.checked = time.monotonic()
+        if self.loaded(collection):
+            residency.footprint = self.measure(collection) or residency.footprint
+            residency.state = LOADED
+        with self.lock:
+            if collection.name in self.residencies:
+                return
+            # Replace the map, so that readers always see a complete map
+            self.residencies = {**self.residencies, collection.name: residency}
+            if residency.state == LOADED:
+                self.resident_bytes += residency.footprint
+
+    def acquire(self, name: str) -> bool:
+        """
+        Record a use of a collection, and wait until it is loaded.
+        @param name:
+        @return: whether the collection is loaded.
+        """
+        residency = self.residencies[name]
+        now = time.monotonic()
+        residency.last_used = now
+        residency.uses += 1
+        # Other processes can release the collection, so the local state of a shared collection is only trusted for
+        # state_check_interval seconds after its state has been checked in Milvus
+        loaded = None
+        if self.shared and (residency.state != LOADED or residency.checked is None or
+                            now - residency.checked >= self.state_check_interval):
+            loaded = self.loaded(residency.collection)
+            residency.checked = now
+        # A loaded collection is returned without taking the lock. It cannot be released concurrently by this process,
+        # as it has just been used and collections are only released after eviction_grace seconds without use.
+        if residency.state == LOADED and loaded is not False:
+            return True
+
+        with self.lock:
+            if loaded is not None:
+                self._synchronize(residency, loaded)
+            # Check again, as the state can have changed in the meantime
+            if residency.state == LOADED:
+                return True
+            if residency.state == RELEASED:
+                self._start_load(residency)
+            self.waits += 1
+        residency.ready.wait(self.load_timeout)
+        return residency.state == LOADED
+
+    def _synchronize(self, residency: Residency, loaded: bool):
+        """
+        Update the state of a collection from its state in Milvus, which another process may have changed. Must be
+        called with the lock acquired.
+        @param residency:
+        @param loaded: whether the collection is loaded in Milvus.
+        @return:
+        """
+        if residency.state == LOADED and not loaded:
+            # The collection has been released by another process
+            residency.state = RELEASED
+            self.resident_bytes -= residency.footprint
+        elif residency.state == RELEASED and loaded:
+            # The collection has been loaded by another process, possibly after it was repopulated
+            residency.state = LOADED
+            residency.loads += 1
+            self.resident_bytes += residency.footprint
+        else:
+            return
+        RESIDENT_BYTES.set(self.resident_bytes)
+
+    def prefetch(self, name: str, evict: bool = True):
+        """
+        Load a collection in the background, if it is managed and released.
+        @param name:
+        @param evict: whether idle collections can be released to make room for the collection. If False, the
+        collection is only loaded if it fits in the budget.
+        @return:
+        """
+        with self.lock:
+            residency = self.residencies.get(name)
+            if residency is None or residency.state != RELEASED:
+                return
+            if not evict and self.resident_bytes + residency.footprint > self.budget:
+                return
+            self._start_load(residency)
+
+    def _start_load(self, residency: Residency):
+        # Must be called with the lock acquired
+        residency.state = LOADING
+        residency.ready.clear()
+        # Reserve the estimated footprint, so that concurrent loads account for each other
+        self.resident_bytes += residency.footprint
+        victims = self._select_victims(residency)
+        self._executor.submit(self._load, residency, victims)
+
+    def _select_victims(self, residency: Residency) -> List[Residency]:
+        """
+        Select the idle collections to release so that the resident collections fit in the budget. Must be called with
+        the lock acquired. The selected collections are marked as released.
+        @param residency: residency of the collection to load.
+        @return:
+        """
+        now = time.monotonic()
+        candidates = [r for r in self.residencies.values() if r is not residency and r.state == LOADED and
+                      now - r.last_used >= self.eviction_grace]
+        if self.policy == "lru":
+            candidates.sort(key=lambda r: r.last_used)
+        else:
+            candidates.sort(key=lambda r: (r.uses, r.last_used))
+
+        victims = []
+        for candidate in candidates:
+            if self.resident_bytes <= self.budget:
+                break
+            candidate.state = RELEASED
+            self.resident_bytes -= candidate.footprint
+            self.evictions += 1
+            victims.append(candidate)
+        return victims
+
+    def _load(self, residency: Residency, victims: List[Residency]):
+        # Release the victims first, so that the memory is available for the collection
+        for victim in victims:
+            with victim.transition_lock:
+                with self.lock:
+                    if victim.state != RELEASED:
+                        # The victim has been requested again since it was selected
+                        continue
+                    if time.monotonic() - victim.last_used < self.eviction_grace:
+                        # The victim has been used without the lock since it was selected, so keep it loaded
+                        victim.state = LOADED
+                        self.resident_bytes += victim.footprint
+                        self.evictions -= 1
+                        continue
+                try:
+                    victim.collection.release()
+                    COLLECTION_EVENTS.labels("release", victim.collection.name).inc()
+                except Exception as e:
+                    print(f"Error in releasing collection {victim.collection.name}. Error message: ", e)
+
+        with residency.transition_lock:
+            try:
+                with COLLECTION_LOAD_DURATION.labels(residency.collection.name).time():
+                    residency.collection.load()
+                COLLECTION_EVENTS.labels("load", residency.collection.name).inc()
+                footprint = self.measure(residency.collection) or residency.footprint
+                with self.lock:
+                    # Replace the estimated footprint with the measured one
+                    self.resident_bytes += footprint - residency.footprint
+                    residency.footprint = footprint
+                    residency.state = LOADED
+                    residency.checked = time.monotonic()
+                    residency.loads += 1
+                    self.loads += 1
+            except Exception as e:
+                print(f"Error in loading collection {residency.collection.name}. Error message: ", e)
+                COLLECTION_EVENTS.labels("load_failure", residency.collection.name).inc()
+                with self.lock:
+                    self.resident_bytes -= residency.footprint
+                    residency.state = RELEASED
+                    self.load_failures += 1
+            finally:
+                RESIDENT_BYTES.set(self.resident_bytes)
+                residency.ready.set()
+
+    def is_ready(self, name: str) -> bool:
+        residency = self.residencies.get(name)
+        return residency is not None and residency.state == LOADED
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            return {
+                "budget_bytes": self.budget,
+                "resident_bytes": self.resident_bytes,
+                "policy": self.policy,
+                "loads": self.loads,
+                "load_failures": self.load_failures,
+                "evictions": self.evictions,
+                "waits": self.waits,
+                "collections": {
+                    name: {
+                        "state": r.state,
+                        "footprint_bytes": r.footprint,
+                        "uses": r.uses,
+                        "idle_seconds": now - r.last_used if r.uses > 0 else None
+                    } for name, r in self.residencies.items()
+                }
+            }
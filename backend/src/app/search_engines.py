@@ -0,0 +1,202 @@
+"""
+Search engines used to find the images most similar to a set of embedding vectors. Each dataset selects its engine with
+the "search_engine" field of its entry in datasets.json:
+- "milvus" (default): cosine similarity search on the embeddings collection, with the search parameters of the index
+  given in the "embeddings_index" field of the entry.
+- "local": exact search on the memory-mapped embeddings of the dataset, exported by
+  create_and_populate_embeddings_collection. Only the metadata of the results is fetched from the collection.
+"""
+from typing import List, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from pymilvus import Collection
+
+from . import milvus_io
+from .CONSTANTS import *
+from .stores import DatasetEmbeddings, EmbeddingsStore
+from ..CONSTANTS import *
+from ..db_utilities.collections import EMBEDDING_VECTOR_FIELD_NAME, get_embeddings_index
+
+
+def top_k_search(matrix: np.ndarray, queries: np.ndarray, top_k: int,
+                 block_size: int = LOCAL_SEARCH_BLOCK_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the top_k rows of the matrix with the largest dot product with each query. The matrix is processed in blocks
+    of block_size rows, so that only the scores of one block are in memory, and the top_k rows of each block are
+    selected with argpartition before being merged with the best rows found so far.
+    @param matrix: matrix of shape (number of rows, embedding dimension). It can be memory-mapped.
+    @param queries: matrix of shape (number of queries, embedding dimension).
+    @param top_k:
+    @param block_size:
+    @return: rows and scores of shape (number of queries, min(top_k, number of rows)), sorted by decreasing score.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    top_k = min(top_k, matrix.shape[0])
+    best_rows = np.empty((queries.shape[0], 0), dtype=np.int64)
+    best_scores = np.empty((queries.shape[0], 0), dtype=np.float32)
+    if top_k <= 0:
+        return best_rows, best_scores
+
+    for start in range(0, matrix.shape[0], block_size):
+        block = np.asarray(matrix[start:start + block_size], dtype=np.float32)
+        scores = queries @ block.T
+        rows = np.broadcast_to(np.arange(start, start + block.shape[0]), scores.shape)
+        # Merge the rows of the block with the best rows found so far
+        rows = np.concatenate([best_rows, rows], axis=1)
+        scores = np.concatenate([best_scores, scores], axis=1)
+        if scores.shape[1] > top_k:
+            selected = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            rows = np.take_along_axis(rows, selected, axis=1)
+            scores = np.take_along_axis(scores, selected, axis=1)
+        best_rows, best_scores = rows, scores
+
+    # Sort the selected rows by decreasing score
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+async def get_entities(collection: Collection, indexes: np.ndarray, page_size: int = SEARCH_LIMIT) -> List[List[dict]]:
+    """
+    Get the metadata of the images of each row of indexes, with one query for every page_size distinct images.
+    @param collection: embeddings collection.
+    @param indexes: matrix of indexes of images.
+    @param page_size: maximum number of images fetched with one query, which cannot exceed the query limit of Milvus.
+    @return: list with the images of each row, in the order of the indexes. Indexes without an image are skipped.
+    """
+    unique_indexes = np.unique(indexes).tolist()
+    entities = {}
+    for i in range(0, len(unique_indexes), page_size):
+        results = await milvus_io.query(
+            collection,
+            expr=f"index in {unique_indexes[i:i + page_size]}",
+            output_fields=SEARCH_OUTPUT_FIELDS,
+            limit=len(unique_indexes[i:i + page_size])
+        )
+        for result in results:
+            entities[result["index"]] = result
+    return [[entities[index] for index in row if index in entities] for row in np.asarray(indexes).tolist()]
+
+
+class MilvusSearchEngine:
+    """
+    Search engine that runs a cosine similarity search on the embeddings collection.
+    """
+
+    def __init__(self, search_params: dict | None = None):
+        """
+        @param search_params: search parameters of the index of the collection, e.g. {"ef": 64} for HNSW or
+        {"nprobe": 16} for IVF indexes.
+        """
+        self.search_params = search_params if search_params is not None else {}
+
+    def get_search_params(self, top_k: int) -> dict:
+        params = dict(self.search_params)
+        # HNSW needs ef to be at least the number of results
+        if "ef" in params:
+            params["ef"] = max(params["ef"], top_k)
+        return {
+            "metric_type": COSINE_METRIC,
+            "offset": 0,
+            "params": params
+        }
+
+    async def search(self, collection: Collection, vectors, top_k: int) -> List[List[dict]]:
+        """
+        Search the top_k images for each vector.
+        @param collection: embeddings collection.
+        @param vectors: matrix of shape (number of vectors, embedding dimension).
+        @param top_k:
+        @return: list with the images found for each vector, sorted by decreasing similarity.
+        """
+        # Search all the vectors at once
+        results = await milvus_io.search(
+            collection,
+            data=np.asarray(vectors, dtype=np.float32).tolist(),
+            anns_field=EMBEDDING_VECTOR_FIELD_NAME,
+            param=self.get_search_params(top_k),
+            limit=top_k,
+            output_fields=SEARCH_OUTPUT_FIELDS
+        )
+        return [[hit.to_dict()["entity"] for hit in hits] for hits in results]
+
+
+class LocalSearchEngine:
+    """
+    Search engine that computes exact cosine similarities with the memory-mapped embeddings of a dataset. The
+    collection is only used to fetch the metadata of the images found, with a single query.
+    """
+
+    def __init__(self, embeddings: DatasetEmbeddings, block_size: int = LOCAL_SEARCH_BLOCK_SIZE):
+        self.embeddings = embeddings
+        self.block_size = block_size
+
+    def search_indexes(self, vectors, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search the indexes of the top_k images for each vector.
+        @param vectors: matrix of shape (number of vectors, embedding dimension).
+        @param top_k:
+        @return: indexes and cosine similarities of the images, sorted by decreasing similarity.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.embeddings.matrix.shape[1])
+        # The rows of the matrix are normalized, so normalizing the vectors gives cosine similarities
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+        rows, scores = top_k_search(self.embeddings.matrix, vectors, top_k, self.block_size)
+        return self.embeddings.ids[rows], scores
+
+    async def search(self, collection: Collection, vectors, top_k: int) -> List[List[dict]]:
+        """
+        Search the top_k images for each vector.
+        @param collection: embeddings collection.
+        @param vectors: matrix of shape (number of vectors, embedding dimension).
+        @param top_k:
+        @return: list with the images found for each vector, sorted by decreasing similarity.
+        """
+        # Compute the similarities in the threadpool, so that the event loop is not blocked
+        indexes, _ = await run_in_threadpool(self.search_indexes, vectors, top_k)
+        return await get_entities(collection, indexes)
+
+
+class SearchEngineGetter:
+    """
+    Class for getting the search engine of each dataset. Datasets that use the local engine fall back to Milvus while
+    their embeddings have not been exported. Milvus searches use the search parameters of the index of each dataset.
+    """
+
+    def __init__(self, datasets: List, embeddings_store: EmbeddingsStore, block_size: int = LOCAL_SEARCH_BLOCK_SIZE):
+        self.embeddings_store = embeddings_store
+        self.block_size = block_size
+        self.milvus_engine = MilvusSearchEngine()
+        self.local_engines = {}
+        self.update(datasets)
+
+    def update(self, datasets: List):
+        """
+        Update the engine of each dataset from the entries of datasets.json.
+        @param datasets:
+        @return:
+        """
+        self.engines = {dataset["name"]: dataset.get("search_engine", DEFAULT_SEARCH_ENGINE) for dataset in datasets}
+        milvus_engines = {}
+        for dataset in datasets:
+            try:
+                milvus_engines[dataset["name"]] = MilvusSearchEngine(get_embeddings_index(dataset)["search_params"])
+            except ValueError:
+                # Unknown index type, use the default search parameters
+                milvus_engines[dataset["name"]] = self.milvus_engine
+        self.milvus_engines = milvus_engines
+
+    def __call__(self, dataset: str) -> MilvusSearchEngine | LocalSearchEngine:
+        milvus_engine = self.milvus_engines.get(dataset, self.milvus_engine)
+        if self.engines.get(dataset, DEFAULT_SEARCH_ENGINE) != "local":
+            return milvus_engine
+        embeddings = self.embeddings_store(dataset)
+        if embeddings is None:
+            return milvus_engine
+        # Create a new engine when the embeddings are mapped again
+        engine = self.local_engines.get(dataset)
+        if engine is None or engine.embeddings is not embeddings:
+            engine = LocalSearchEngine(embeddings, self.block_size)
+            self.local_engines[dataset] = engine
+        return engine
@@ -0,0 +1,163 @@
+"""
+Background initialization of the components of the app. Slow steps, such as loading the embeddings model or the UMAP
+collection, run in background threads, so that the app serves the endpoints that do not need them as soon as it is
+imported. Failed initializations are retried with an exponential backoff, as the components usually fail because Milvus
+or the embeddings service is not up yet, and the app keeps retrying the components reported as failed. The state of each component is reported by /readyz, and endpoints that need a
+component answer 503 until it is ready.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from fastapi import HTTPException
+
+from .CONSTANTS import *
+
+# Define states of a component
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class Component:
+    """
+    State of a component of the app.
+    """
+
+    def __init__(self, name: str, initialize: Callable[[], Any] | None, requires: List[str] | None = None):
+        self.name = name
+        self.initialize = initialize
+        self.requires = requires if requires is not None else []
+        self.state = PENDING
+        self.error = None
+        self.started = None
+        self.duration = None
+        self.attempts = 0
+        # Event set when the component is ready or has failed
+        self.done = threading.Event()
+
+
+class Startup:
+    """
+    Class for initializing the components of the app in the background.
+    """
+
+    def __init__(self, retries: int = 0, backoff: float = STARTUP_RETRY_BACKOFF,
+                 max_backoff: float = STARTUP_MAX_BACKOFF, retry_failed: bool = False):
+        """
+        @param retries: number of times a failed initialization is retried before the component is marked as failed.
+        @param backoff: number of seconds before the first retry. The wait doubles after each failed retry.
+        @param max_backoff: maximum number of seconds between two attempts.
+        @param retry_failed: whether failed components are still retried every max_backoff seconds, and become ready
+        if an attempt succeeds.
+        """
+        self.components: Dict[str, Component] = {}
+        self.lock = threading.Lock()
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_failed = retry_failed
+
+    def add(self, name: str, initialize: Callable[[], Any] | None = None, start: bool = True,
+            requires: List[str] | None = None):
+        """
+        Add a component.
+        @param name:
+        @param initialize: function initializing the component. If None, the component is ready immediately.
+        @param start: whether to start the initialization immediately.
+        @param requires: names of the components that must be ready before the component is initialized. An attempt
+        made while one of them has failed fails too.
+        @return:
+        """
+        component = Component(name, initialize, requires)
+        with self.lock:
+            self.components = {**self.components, name: component}
+        if initialize is None:
+            component.state = READY
+            component.duration = 0.0
+            component.done.set()
+        elif start:
+            self.start(name)
+
+    def start(self, name: str):
+        """
+        Start the initialization of a component in a background thread.
+        @param name:
+        @return:
+        """
+        component = self.components[name]
+        threading.Thread(target=self._run, args=(component,), name=f"startup-{name}", daemon=True).start()
+
+    def _run(self, component: Component):
+        component.started = time.monotonic()
+        while True:
+            component.attempts += 1
+            try:
+                for name in component.requires:
+                    if not self.wait(name):
+                        raise RuntimeError(f"{name} is not ready")
+                component.initialize()
+                component.error = None
+                component.state = READY
+            except Exception as e:
+                print(f"Error in initializing {component.name}. Error message: ", e)
+                component.error = str(e)
+                if component.attempts > self.retries:
+                    component.state = FAILED
+            if component.state != PENDING:
+                component.duration = time.monotonic() - component.started
+                component.done.set()
+            if component.state == READY or (component.state == FAILED and not self.retry_failed):
+                return
+            # The component stays pending until the next attempt. A failed component is retried every max_backoff
+            # seconds, so that the app recovers once Milvus is up again.
+            time.sleep(min(self.backoff * 2 ** (component.attempts - 1), self.max_backoff))
+
+    def is_ready(self, names: List[str] | None = None) -> bool:
+        """
+        Return whether the given components are ready.
+        @param names: names of the components. If None, all the components are checked.
+        @return:
+        """
+        components = self.components
+        names = names if names is not None else list(components.keys())
+        return all(name in components and components[name].state == READY for name in names)
+
+    def wait(self, name: str, timeout: float | None = None) -> bool:
+        """
+        Wait until a component is ready or has failed.
+        @param name:
+        @param timeout:
+        @return: whether the component is ready.
+        """
+        component = self.components[name]
+        component.done.wait(timeout)
+        return component.state == READY
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            name: {
+                "state": component.state,
+                "error": component.error,
+                "attempts": component.attempts,
+                # Time spent initializing the component so far
+                "seconds": component.duration if component.duration is not None else
+                (now - component.started if component.started is not None else 0.0)
+            } for name, component in self.components.items()
+        }
+
+
+class Requirement:
+    """
+    Dependency answering 503 while the given components of the app are not ready.
+    """
+
+    def __init__(self, startup: Startup, *names: str):
+        self.startup = startup
+        self.names = list(names)
+
+    def __call__(self):
+        if not self.startup.is_ready(self.names):
+            raise HTTPException(status_code=503, detail=f"Waiting for {', '.join(self.names)} to be ready",
+                                headers={"Retry-After": "5"})
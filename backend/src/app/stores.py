@@ -0,0 +1,446 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from pymilvus import Collection
+
+from . import milvus_io
+from .CONSTANTS import *
+from .cache import get_collection_generation
+from .tile_codec import encode_tiles, encode_ndjson
+from ..CONSTANTS import *
+from ..db_utilities.artifacts import (get_first_tiles_path, get_embeddings_paths, load_embeddings,
+                                      get_neighbor_graph_paths, load_neighbor_graph, get_metadata_path, load_metadata)
+
+
+def find_rows(ids: np.ndarray, indexes: List[int], contiguous: bool = False) -> np.ndarray:
+    """
+    Find the rows of the given indexes in a sorted array of indexes.
+    @param ids: sorted array of indexes.
+    @param indexes:
+    @param contiguous: whether ids is 0, 1, ..., n - 1, in which case the row of an index is the index itself.
+    @return: array of rows, with -1 for the indexes that are not in ids.
+    """
+    indexes = np.asarray(indexes, dtype=np.int64)
+    if len(ids) == 0:
+        return np.full(indexes.shape, -1, dtype=np.int64)
+    if contiguous:
+        rows = indexes.copy()
+    else:
+        rows = np.minimum(np.searchsorted(ids, indexes), len(ids) - 1)
+    valid = (rows >= 0) & (rows < len(ids))
+    valid[valid] &= ids[rows[valid]] == indexes[valid]
+    return np.where(valid, rows, -1)
+
+
+class FirstTilesPayload:
+    """
+    Precomputed response of /api/first-tiles for a dataset. The payload is kept compressed in memory, and decompressed
+    only for clients that do not accept gzip encoding. The binary and the NDJSON encodings of the tiles are generated on
+    first use.
+    """
+
+    def __init__(self, compressed: bytes, mtime: int):
+        self.compressed = compressed
+        self.mtime = mtime
+        # Strong ETag derived from the content of the payload
+        self.etag = f'"{hashlib.sha256(compressed).hexdigest()}"'
+        self.binary_etag = self.etag[:-1] + '-bin"'
+        self.ndjson_etag = self.etag[:-1] + '-ndjson"'
+        self._decompressed = None
+        self._binary = None
+        self._ndjson = None
+
+    @property
+    def decompressed(self) -> bytes:
+        if self._decompressed is None:
+            self._decompressed = gzip.decompress(self.compressed)
+        return self._decompressed
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = encode_tiles(json.loads(self.decompressed))
+        return self._binary
+
+    @property
+    def ndjson(self) -> bytes:
+        if self._ndjson is None:
+            self._ndjson = encode_ndjson(json.loads(self.decompressed))
+        return self._ndjson
+
+
+class FirstTilesStore:
+    """
+    Class for serving the first tiles of each dataset from the files generated by
+    create_and_populate_clusters_collection. A file is read again only when its modification time changes.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR_PATH):
+        self.data_dir = data_dir
+        self.payloads = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, dataset: str) -> FirstTilesPayload | None:
+        path = get_first_tiles_path(self.data_dir, dataset)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            # The file has not been generated for this dataset
+            return None
+
+        payload = self.payloads.get(dataset)
+        if payload is not None and payload.mtime == mtime:
+            return payload
+
+        with self.lock:
+            # Check again, as another thread could have read the file in the meantime
+            payload = self.payloads.get(dataset)
+            if payload is None or payload.mtime != mtime:
+                try:
+                    with open(path, "rb") as f:
+                        payload = FirstTilesPayload(f.read(), mtime)
+                except OSError:
+                    return None
+                self.payloads[dataset] = payload
+        return payload
+
+
+class DatasetEmbeddings:
+    """
+    Memory-mapped matrix of L2-normalized embeddings of a dataset, with the index of the image of each row.
+    """
+
+    def __init__(self, ids: np.ndarray, matrix: np.ndarray, mtime: int):
+        self.ids = ids
+        self.matrix = matrix
+        self.mtime = mtime
+        # If the indexes are 0, 1, ..., n - 1, the row of an image is its index
+        self.contiguous = bool(np.array_equal(ids, np.arange(len(ids))))
+
+    def get_rows(self, indexes: List[int]) -> np.ndarray:
+        """
+        Get the rows of the matrix corresponding to the given indexes.
+        @param indexes:
+        @return: array of rows, with -1 for the indexes that are not in the matrix.
+        """
+        return find_rows(self.ids, indexes, self.contiguous)
+
+    def get_vectors(self, indexes: List[int]) -> np.ndarray | None:
+        """
+        Get the embeddings of the given indexes.
+        @param indexes:
+        @return: matrix with one row per index, or None if some of the indexes are not in the matrix.
+        """
+        rows = self.get_rows(indexes)
+        if np.any(rows < 0):
+            return None
+        return np.asarray(self.matrix[rows])
+
+
+class EmbeddingsStore:
+    """
+    Class for reading the embeddings of each dataset from the files generated by
+    create_and_populate_embeddings_collection. A matrix is mapped again only when its modification time changes.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR_PATH):
+        self.data_dir = data_dir
+        self.embeddings = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, dataset: str) -> DatasetEmbeddings | None:
+        embeddings_path, _ = get_embeddings_paths(self.data_dir, dataset)
+        try:
+            mtime = os.stat(embeddings_path).st_mtime_ns
+        except OSError:
+            # The embeddings have not been exported for this dataset
+            return None
+
+        embeddings = self.embeddings.get(dataset)
+        if embeddings is not None and embeddings.mtime == mtime:
+            return embeddings
+
+        with self.lock:
+            # Check again, as another thread could have mapped the matrix in the meantime
+            embeddings = self.embeddings.get(dataset)
+            if embeddings is None or embeddings.mtime != mtime:
+                try:
+                    ids, matrix = load_embeddings(self.data_dir, dataset)
+                except (OSError, ValueError):
+                    return None
+                embeddings = DatasetEmbeddings(ids, matrix, mtime)
+                self.embeddings[dataset] = embeddings
+        return embeddings
+
+
+class StringColumn:
+    """
+    Column of strings stored as the concatenation of their UTF-8 encoded values and the offsets of the values.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data.tobytes()
+
+    def take(self, rows: np.ndarray) -> List[str]:
+        starts = self.offsets[rows].tolist()
+        ends = self.offsets[rows + 1].tolist()
+        return [self.data[start:end].decode("utf-8") for start, end in zip(starts, ends)]
+
+
+class DatasetMetadata:
+    """
+    Metadata of the images of a dataset, stored in columns sorted by index.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray | StringColumn], mtime: int):
+        self.columns = columns
+        self.mtime = mtime
+        self.ids = columns["index"]
+        self.contiguous = bool(np.array_equal(self.ids, np.arange(len(self.ids))))
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.columns.keys())
+
+    def get(self, indexes: List[int], fields: List[str]) -> List[dict]:
+        """
+        Get the given fields of the images with the given indexes.
+        @param indexes:
+        @param fields: fields of the columns.
+        @return: list with the fields of each image, in the order of the indexes. Indexes without an image are skipped.
+        """
+        rows = find_rows(self.ids, indexes, self.contiguous)
+        rows = rows[rows >= 0]
+        # Read each column once, and convert the values to Python values
+        values = {}
+        for field in dict.fromkeys(["index", *fields]):
+            column = self.columns[field]
+            values[field] = column.take(rows) if isinstance(column, StringColumn) else column[rows].tolist()
+        return [{field: values[field][i] for field in values} for i in range(len(rows))]
+
+
+class MetadataStore:
+    """
+    Class for reading the metadata of each dataset from the files generated by
+    create_and_populate_embeddings_collection. The columns are loaded in memory, and loaded again only when the
+    modification time of the file changes.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR_PATH):
+        self.data_dir = data_dir
+        self.metadata = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, dataset: str) -> DatasetMetadata | None:
+        path = get_metadata_path(self.data_dir, dataset)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            # The metadata has not been exported for this dataset
+            return None
+
+        metadata = self.metadata.get(dataset)
+        if metadata is not None and metadata.mtime == mtime:
+            return metadata
+
+        with self.lock:
+            # Check again, as another thread could have loaded the file in the meantime
+            metadata = self.metadata.get(dataset)
+            if metadata is None or metadata.mtime != mtime:
+                try:
+                    columns = load_metadata(self.data_dir, dataset)
+                except (OSError, ValueError):
+                    return None
+                metadata = DatasetMetadata({field: StringColumn(*column) if isinstance(column, tuple) else column
+                                            for field, column in columns.items()}, mtime)
+                self.metadata[dataset] = metadata
+        return metadata
+
+
+class NeighborGraph:
+    """
+    Memory-mapped nearest neighbors of every image of a dataset. Row i contains the neighbors of the image of row i of
+    the embeddings matrix, sorted by decreasing similarity.
+    """
+
+    def __init__(self, indexes: np.ndarray, scores: np.ndarray, mtime: int):
+        self.indexes = indexes
+        self.scores = scores
+        self.mtime = mtime
+
+    @property
+    def k(self) -> int:
+        return self.indexes.shape[1]
+
+    def get_neighbors(self, rows: np.ndarray, k: int) -> np.ndarray:
+        """
+        Get the indexes of the first k neighbors of the given rows.
+        @param rows: rows of the images in the embeddings matrix.
+        @param k: number of neighbors, at most self.k.
+        @return: matrix of shape (number of rows, k).
+        """
+        return np.asarray(self.indexes[rows, :k], dtype=np.int64)
+
+
+class NeighborGraphStore:
+    """
+    Class for reading the neighbor graph of each dataset from the files generated by create_neighbor_graph. A graph is
+    only used if it has been generated after the embeddings it was computed from.
+    """
+
+    def __init__(self, embeddings_store: EmbeddingsStore):
+        self.embeddings_store = embeddings_store
+        self.graphs = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, dataset: str) -> NeighborGraph | None:
+        embeddings = self.embeddings_store(dataset)
+        if embeddings is None:
+            return None
+        indexes_path, _ = get_neighbor_graph_paths(self.embeddings_store.data_dir, dataset)
+        try:
+            mtime = os.stat(indexes_path).st_mtime_ns
+        except OSError:
+            # The graph has not been generated for this dataset
+            return None
+        if mtime < embeddings.mtime:
+            # The graph was computed from older embeddings
+            return None
+
+        graph = self.graphs.get(dataset)
+        if graph is not None and graph.mtime == mtime:
+            return graph
+
+        with self.lock:
+            # Check again, as another thread could have mapped the graph in the meantime
+            graph = self.graphs.get(dataset)
+            if graph is None or graph.mtime != mtime:
+                try:
+                    indexes, scores = load_neighbor_graph(self.embeddings_store.data_dir, dataset)
+                except (OSError, ValueError):
+                    return None
+                if indexes.shape[0] != embeddings.matrix.shape[0]:
+                    return None
+                graph = NeighborGraph(indexes, scores, mtime)
+                self.graphs[dataset] = graph
+        return graph
+
+
+def get_umap_index(n_neighbors: int, min_dist: float) -> int:
+    """
+    Get the index of the UMAP projection computed with the given parameters in the umap collection.
+    @param n_neighbors:
+    @param min_dist:
+    @return:
+    """
+    # Check that n_neighbors and min_dist are among the allowed values
+    if n_neighbors not in N_NEIGHBORS:
+        raise ValueError(f"n_neighbors must be in {N_NEIGHBORS}")
+    if min_dist not in MIN_DISTS:
+        raise ValueError(f"min_dist must be in {MIN_DISTS}")
+    # Compute index from the position of n_neighbors and min_dist in the allowed values
+    return N_NEIGHBORS.index(n_neighbors) * len(MIN_DISTS) + MIN_DISTS.index(min_dist)
+
+
+class UMAPProjection:
+    """
+    Coordinates of the points of a UMAP projection. The encodings of the coordinates are generated on first use.
+
+    The binary encodings consist of a header with a magic number (4 bytes), the number of bytes of each value
+    (uint8), padding (3 bytes) and the number of points (uint32), followed by the little-endian x coordinates and the
+    little-endian y coordinates.
+    """
+    MAGIC = b"AEYU"
+    _HEADER = struct.Struct("<4sBxxxI")
+
+    def __init__(self, x: np.ndarray, y: np.ndarray):
+        self.x = np.ascontiguousarray(x, dtype=np.float32)
+        self.y = np.ascontiguousarray(y, dtype=np.float32)
+        # Strong ETag derived from the coordinates
+        self._hash = hashlib.sha256(self.x.tobytes() + self.y.tobytes()).hexdigest()
+        self._encodings = {}
+
+    def etag(self, data_format: str) -> str:
+        return f'"{self._hash}-{data_format}"'
+
+    def encode(self, data_format: str) -> bytes:
+        """
+        Encode the coordinates.
+        @param data_format: one of UMAP_FORMATS.
+        @return:
+        """
+        encoding = self._encodings.get(data_format)
+        if encoding is None:
+            if data_format == "json":
+                # Use the shortest representation of each float32 value
+                x = ",".join(np.format_float_positional(value, unique=True, trim="0") for value in self.x)
+                y = ",".join(np.format_float_positional(value, unique=True, trim="0") for value in self.y)
+                encoding = f'{{"x":[{x}],"y":[{y}]}}'.encode("utf-8")
+            else:
+                dtype = np.dtype(data_format).newbyteorder("<")
+                encoding = (self._HEADER.pack(self.MAGIC, dtype.itemsize, len(self.x)) +
+                            self.x.astype(dtype).tobytes() + self.y.astype(dtype).tobytes())
+            self._encodings[data_format] = encoding
+        return encoding
+
+
+class UMAPStore:
+    """
+    Class for serving the UMAP projections. All the projections are decoded with a single query on first use, and
+    decoded again only if the umap collection is rebuilt. The generation of the collection is checked at most once
+    every validation_interval seconds.
+    """
+
+    def __init__(self, collection_getter: Callable[[], Collection], load,
+                 validation_interval: float = UMAP_VALIDATION_INTERVAL):
+        """
+        @param collection_getter: function returning the umap collection.
+        @param load: coroutine function mapping the umap collection to a dictionary from the index of each projection
+        to its interleaved coordinates.
+        @param validation_interval:
+        """
+        self.collection_getter = collection_getter
+        self.load = load
+        self.validation_interval = validation_interval
+        self.projections: Dict[int, UMAPProjection] = {}
+        self._generation = None
+        self._checked = None
+        self._lock = asyncio.Lock()
+
+    async def get(self, n_neighbors: int, min_dist: float) -> UMAPProjection:
+        """
+        Get the UMAP projection computed with the given parameters.
+        @param n_neighbors:
+        @param min_dist:
+        @return:
+        """
+        index = get_umap_index(n_neighbors, min_dist)
+        if self._checked is None or time.monotonic() - self._checked >= self.validation_interval:
+            async with self._lock:
+                # Check again, as another request could have validated the projections in the meantime
+                if self._checked is None or time.monotonic() - self._checked >= self.validation_interval:
+                    await self._validate()
+        return self.projections[index]
+
+    async def _validate(self):
+        collection = self.collection_getter()
+        generation = await milvus_io.run(get_collection_generation, collection)
+        if generation != self._generation:
+            projections = {}
+            for index, data in (await self.load(collection)).items():
+                # The coordinates are interleaved: x0, y0, x1, y1, ...
+                coordinates = np.asarray(data, dtype=np.float32).reshape(-1, 2)
+                projections[index] = UMAPProjection(coordinates[:, 0], coordinates[:, 1])
+            self.projections = projections
+            self._generation = generation
+        self._checked = time.monotonic()
@@ -0,0 +1,200 @@
+"""
+Compact binary format for tile responses, served instead of JSON to clients sending TILES_MEDIA_TYPE in the Accept
+header. Numeric fields are stored as little-endian typed arrays and paths are stored once in a string table.
+
+Layout of a tiles payload (every array starts at an offset aligned to the size of its elements):
+    header: magic (4 bytes), version (uint8), kind (uint8), padding (2 bytes), number of tiles, number of
+        representatives, number of tiles with a range, number of strings, length of the string table (5 x uint32),
+        padding (4 bytes)
+    int64 tile indexes, float64 ranges (x_min, x_max, y_min, y_max for each tile with a range),
+    int64 representative indexes, float64 x, float64 y,
+    uint32 number of representatives per tile, uint32 positions of the tiles with a range, uint32 width,
+    uint32 height, uint32 path ids, uint32 string offsets (number of strings + 1),
+    uint8 zoom, UTF-8 string table.
+
+Layout of an image-to-tile payload: magic, version, kind, padding, int64 image index, int32 zoom level, tile x, tile y.
+
+Clients sending NDJSON_MEDIA_TYPE in the Accept header get the tiles streamed as newline-delimited JSON instead, one tile
+per line, with the same fields as in the JSON response.
+"""
+import json
+import struct
+from typing import List
+
+import numpy as np
+
+from ..db_utilities.collections import ZOOM_LEVEL_VECTOR_FIELD_NAME
+from ..metrics import ENCODING_DURATION
+
+TILES_MEDIA_TYPE = "application/vnd.aeye.tiles"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MAGIC = b"AEYT"
+VERSION = 1
+KIND_TILES = 0
+KIND_IMAGE_TO_TILE = 1
+RANGE_KEYS = ["x_min", "x_max", "y_min", "y_max"]
+
+_HEADER = struct.Struct("<4sBBxx")
+_TILES_COUNTS = struct.Struct("<5I4x")
+_IMAGE_TO_TILE = struct.Struct("<q3i")
+
+
+def accepts_binary(accept_header: str | None) -> bool:
+    """
+    Return whether the client asked for the binary format in the Accept header.
+    @param accept_header:
+    @return:
+    """
+    return accept_header is not None and TILES_MEDIA_TYPE in accept_header
+
+
+def accepts_ndjson(accept_header: str | None) -> bool:
+    """
+    Return whether the client asked for streamed newline-delimited JSON in the Accept header.
+    @param accept_header:
+    @return:
+    """
+    return accept_header is not None and NDJSON_MEDIA_TYPE in accept_header
+
+
+@ENCODING_DURATION.labels("ndjson").time()
+def encode_ndjson(tiles: List[dict]) -> bytes:
+    """
+    Encode a list of tiles as newline-delimited JSON, one tile per line.
+    @param tiles:
+    @return:
+    """
+    return "".join(json.dumps(tile, separators=(",", ":")) + "\n" for tile in tiles).encode("utf-8")
+
+
+@ENCODING_DURATION.labels("tiles").time()
+def encode_tiles(tiles: List[dict]) -> bytes:
+    """
+    Encode a list of tiles, as returned by get_tiles or get_first_tiles, in the binary format.
+    @param tiles: list of tiles with fields "index", "data" and optionally "range".
+    @return:
+    """
+    # Flatten representatives
+    tile_indexes = []
+    counts = []
+    range_positions = []
+    ranges = []
+    rep_indexes, xs, ys, widths, heights, zooms, path_ids = [], [], [], [], [], [], []
+    strings = {}
+    for position, tile in enumerate(tiles):
+        tile_indexes.append(tile["index"])
+        counts.append(len(tile["data"]))
+        if "range" in tile:
+            range_positions.append(position)
+            ranges += [tile["range"][key] for key in RANGE_KEYS]
+        for representative in tile["data"]:
+            rep_indexes.append(representative["index"])
+            xs.append(representative["x"])
+            ys.append(representative["y"])
+            widths.append(representative["width"])
+            heights.append(representative["height"])
+            zooms.append(representative["zoom"])
+            # Add path to the string table if it is not already there
+            path_ids.append(strings.setdefault(representative["path"], len(strings)))
+
+    # Build string table
+    encoded_strings = [string.encode("utf-8") for string in strings.keys()]
+    offsets = np.zeros(len(encoded_strings) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(string) for string in encoded_strings], dtype=np.int64)
+    string_table = b"".join(encoded_strings)
+
+    return b"".join([
+        _HEADER.pack(MAGIC, VERSION, KIND_TILES),
+        _TILES_COUNTS.pack(len(tiles), len(rep_indexes), len(range_positions), len(strings), len(string_table)),
+        np.asarray(tile_indexes, dtype="<i8").tobytes(),
+        np.asarray(ranges, dtype="<f8").tobytes(),
+        np.asarray(rep_indexes, dtype="<i8").tobytes(),
+        np.asarray(xs, dtype="<f8").tobytes(),
+        np.asarray(ys, dtype="<f8").tobytes(),
+        np.asarray(counts, dtype="<u4").tobytes(),
+        np.asarray(range_positions, dtype="<u4").tobytes(),
+        np.asarray(widths, dtype="<u4").tobytes(),
+        np.asarray(heights, dtype="<u4").tobytes(),
+        np.asarray(path_ids, dtype="<u4").tobytes(),
+        offsets.tobytes(),
+        np.asarray(zooms, dtype="<u1").tobytes(),
+        string_table
+    ])
+
+
+@ENCODING_DURATION.labels("image_to_tile").time()
+def encode_image_to_tile(tile_data: dict) -> bytes:
+    """
+    Encode the response of get_tile_from_image in the binary format.
+    @param tile_data: dictionary with fields "index" and ZOOM_LEVEL_VECTOR_FIELD_NAME.
+    @return:
+    """
+    return (_HEADER.pack(MAGIC, VERSION, KIND_IMAGE_TO_TILE)
+            + _IMAGE_TO_TILE.pack(tile_data["index"], *tile_data[ZOOM_LEVEL_VECTOR_FIELD_NAME]))
+
+
+def decode(data: bytes) -> List[dict] | dict:
+    """
+    Decode a payload in the binary format into the same objects that are returned as JSON.
+    @param data:
+    @return: list of tiles for a tiles payload, dictionary for an image-to-tile payload.
+    """
+    magic, version, kind = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a tiles payload, or unsupported version.")
+    offset = _HEADER.size
+
+    if kind == KIND_IMAGE_TO_TILE:
+        index, zoom, tile_x, tile_y = _IMAGE_TO_TILE.unpack_from(data, offset)
+        return {"index": index, ZOOM_LEVEL_VECTOR_FIELD_NAME: [zoom, tile_x, tile_y]}
+    if kind != KIND_TILES:
+        raise ValueError(f"Unknown payload kind {kind}.")
+
+    n_tiles, n_reps, n_ranges, n_strings, string_table_length = _TILES_COUNTS.unpack_from(data, offset)
+    offset += _TILES_COUNTS.size
+
+    def read(dtype: str, count: int) -> np.ndarray:
+        nonlocal offset
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    tile_indexes = read("<i8", n_tiles).tolist()
+    ranges = read("<f8", 4 * n_ranges).tolist()
+    rep_indexes = read("<i8", n_reps).tolist()
+    xs = read("<f8", n_reps).tolist()
+    ys = read("<f8", n_reps).tolist()
+    counts = read("<u4", n_tiles).tolist()
+    range_positions = read("<u4", n_ranges).tolist()
+    widths = read("<u4", n_reps).tolist()
+    heights = read("<u4", n_reps).tolist()
+    path_ids = read("<u4", n_reps).tolist()
+    offsets = read("<u4", n_strings + 1).tolist()
+    zooms = read("<u1", n_reps).tolist()
+    string_table = data[offset:offset + string_table_length]
+    strings = [string_table[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(n_strings)]
+
+    tiles = []
+    start = 0
+    for position in range(n_tiles):
+        end = start + counts[position]
+        tiles.append({
+            "index": tile_indexes[position],
+            "data": [
+                {
+                    "index": rep_indexes[i],
+                    "path": strings[path_ids[i]],
+                    "x": xs[i],
+                    "y": ys[i],
+                    "width": widths[i],
+                    "height": heights[i],
+                    "zoom": zooms[i]
+                }
+                for i in range(start, end)
+            ]
+        })
+        start = end
+    for i, position in enumerate(range_positions):
+        tiles[position]["range"] = dict(zip(RANGE_KEYS, ranges[4 * i:4 * i + 4]))
+
+    return tiles
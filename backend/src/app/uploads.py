@@ -0,0 +1,105 @@
+"""
+Decoding and embedding of the images uploaded to /api/image-image. Uploads are decoded by a bounded pool of threads,
+so that large images never block the event loop, and JPEG images are downscaled by the decoder to the input size of
+CLIP. Embeddings of recently uploaded images are cached by the hash of their content.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from fastapi.concurrency import run_in_threadpool
+
+from .CONSTANTS import *
+from .cache import ImageEmbeddingCache
+from ..CONSTANTS import *
+from ..embeddings_model.EmbeddingsModel import EmbeddingsModel, to_numpy
+
+
+class ImageTooLargeError(ValueError):
+    """
+    Raised when an uploaded image has more pixels than allowed.
+    """
+
+    def __init__(self, width: int, height: int, max_pixels: int):
+        super().__init__(f"Image of {width}x{height} pixels exceeds the limit of {max_pixels} pixels.")
+        self.width = width
+        self.height = height
+        self.max_pixels = max_pixels
+
+
+def decode_image(data: bytes, max_pixels: int = DEFAULT_UPLOAD_MAX_PIXELS, size: int = CLIP_IMAGE_SIZE) -> Image.Image:
+    """
+    Decode an uploaded image, downscaled so that its shortest side is still at least size pixels. The number of pixels
+    is checked from the header, before the image is decoded.
+    @param data: content of the uploaded file.
+    @param max_pixels: maximum number of pixels of the image.
+    @param size: input size of the embeddings model.
+    @return: RGB image.
+    """
+    try:
+        image = Image.open(BytesIO(data))
+    except Image.DecompressionBombError:
+        raise ImageTooLargeError(0, 0, max_pixels)
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageTooLargeError(width, height, max_pixels)
+
+    # Let the JPEG decoder scale the image by 1/2, 1/4 or 1/8, keeping both sides at least size pixels. The call has
+    # no effect for other formats.
+    image.draft("RGB", (size, size))
+    image = image.convert("RGB")
+    # Images of other formats are decoded at full size, so reduce them by an integer factor
+    factor = min(image.size) // size
+    if factor > 1:
+        image = image.reduce(factor)
+    return image
+
+
+class UploadEmbedder:
+    """
+    Class for embedding uploaded images without blocking the event loop.
+    """
+
+    def __init__(self, embeddings: EmbeddingsModel | None, cache: ImageEmbeddingCache | None = None,
+                 max_pixels: int = DEFAULT_UPLOAD_MAX_PIXELS, workers: int = UPLOAD_DECODE_WORKERS,
+                 size: int = CLIP_IMAGE_SIZE):
+        """
+        @param embeddings: model used to embed the images. It can be set after the creation of the embedder, once the
+        model is loaded.
+        @param cache: cache of the embeddings of recently uploaded images. If None, every upload is embedded.
+        @param max_pixels: maximum number of pixels of an uploaded image.
+        @param workers: number of images decoded at the same time.
+        @param size: input size of the embeddings model.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.max_pixels = max_pixels
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload-decoder")
+
+    async def __call__(self, data: bytes) -> np.ndarray:
+        """
+        Embed an uploaded image.
+        @param data: content of the uploaded file.
+        @return: array of shape (1, embedding dimension).
+        """
+        key = None
+        if self.cache is not None:
+            key = self.cache.get_key(data)
+            embedding = self.cache.get(key)
+            if embedding is not None:
+                return embedding[np.newaxis]
+
+        # Decode the image in the pool, then compute its embedding in the threadpool, so that concurrent uploads can be
+        # batched
+        image = await asyncio.get_running_loop().run_in_executor(self._executor, decode_image, data, self.max_pixels,
+                                                                 self.size)
+        embedding = await run_in_threadpool(self.embeddings.getImageEmbeddings, image)
+        if embedding is None:
+            raise RuntimeError("Image embeddings could not be computed.")
+        embedding = to_numpy(embedding)
+        if self.cache is not None:
+            self.cache.put(key, embedding)
+        return embedding
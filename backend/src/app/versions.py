@@ -0,0 +1,102 @@
+"""
+Conditional requests for the data of a dataset that only changes when its collections are rebuilt. Every build records
+a version hash in datasets.json (see db_utilities/versions.py), and the ETag of a response is derived from the version,
+the request and the negotiated representation. Requests whose If-None-Match matches are answered with 304 before any
+collection is acquired, so they never touch Milvus.
+"""
+import hashlib
+import json
+
+from fastapi import HTTPException, Query, Request
+
+from .CONSTANTS import *
+from .catalog import Catalog
+from .tile_codec import accepts_binary, accepts_ndjson
+
+
+def get_etag(*parts) -> str:
+    """
+    Compute a strong ETag from JSON-serializable values.
+    @param parts:
+    @return: quoted ETag.
+    """
+    data = json.dumps(parts, separators=(",", ":"))
+    return '"' + hashlib.sha256(data.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def matches_etag(if_none_match: str | None, etag: str) -> bool:
+    """
+    Return whether the If-None-Match header of a request matches an ETag. The comparison is weak, as required for
+    If-None-Match.
+    @param if_none_match: value of the header.
+    @param etag: quoted ETag.
+    @return:
+    """
+    if if_none_match is None:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ConditionalGetter:
+    """
+    Dependency returning the caching headers of a response for the data of a dataset, or answering the request with
+    304 if the client already has the data. Requests with a "v" parameter equal to the current version can be cached
+    for VERSIONED_CACHE_MAX_AGE seconds, as their URL changes with every build. Other requests can be cached for
+    DATASET_CACHE_MAX_AGE seconds, and are then revalidated. If no version is recorded for the dataset, no headers are
+    returned.
+    """
+
+    def __init__(self, catalog: Catalog, kind: str, suffix: str = "", compressible: bool = False):
+        """
+        @param catalog:
+        @param kind: kind of data, among the keys of the "versions" field of the entries of datasets.json.
+        @param suffix: suffix of the name of the collection of the data, removed to get the name of the dataset.
+        @param compressible: whether the response is compressed for clients accepting gzip.
+        """
+        self.catalog = catalog
+        self.kind = kind
+        self.suffix = suffix
+        self.compressible = compressible
+
+    def get_version(self, dataset: str | None) -> str | None:
+        """
+        Get the current version of the data of a dataset.
+        @param dataset: name of the dataset. If None, the version of the data shared by the app, such as the UMAP
+        projections, is returned. It is recorded only for the dataset the shared data was last built from.
+        @return:
+        """
+        if dataset is None:
+            for entry in self.catalog.datasets:
+                if self.kind in entry.get("versions", {}):
+                    return entry["versions"][self.kind]
+            return None
+        entry = self.catalog.get_dataset(dataset)
+        return entry.get("versions", {}).get(self.kind) if entry is not None else None
+
+    def __call__(self, request: Request, collection: str | None = Query(None)) -> dict:
+        dataset = collection.removesuffix(self.suffix) if collection is not None else None
+        version = self.get_version(dataset)
+        if version is None:
+            return {}
+
+        # The ETag depends on the parameters of the request and on the representation of the response
+        binary = accepts_binary(request.headers.get("accept"))
+        ndjson = accepts_ndjson(request.headers.get("accept"))
+        gzip = self.compressible and "gzip" in request.headers.get("accept-encoding", "")
+        parameters = sorted((key, value) for key, value in request.query_params.multi_items() if key != "v")
+        headers = {
+            "ETag": get_etag(self.kind, version, request.url.path, parameters, binary, ndjson, gzip),
+            "Vary": "Accept, Accept-Encoding" if self.compressible else "Accept"
+        }
+        if request.query_params.get("v") == version:
+            headers["Cache-Control"] = f"public, max-age={VERSIONED_CACHE_MAX_AGE}, immutable"
+        else:
+            headers["Cache-Control"] = f"public, max-age={DATASET_CACHE_MAX_AGE}"
+
+        if matches_etag(request.headers.get("if-none-match"), headers["ETag"]):
+            raise HTTPException(status_code=304, headers=headers)
+        return headers
@@ -0,0 +1,170 @@
+"""
+Tiles prefetched by the map for a viewport, computed with the same rules as the frontend (Map/utilities.js, mirrored in
+report/tiling.py). The tile in the upper left corner of the viewport is the center of a 4x4 neighborhood at its zoom
+level, which is extended to the next two zoom levels and to the previous two zoom levels. Tiles are (x, y, zoom)
+tuples, and their indexes in the clusters collection are sum_{i=0}^{zoom-1} 4^i + 2^zoom * x + y.
+"""
+from typing import Iterable, List, Set, Tuple
+
+Tile = Tuple[int, int, int]
+
+# Define prefetch modes. "full" is used when the map stops moving, "translation" and "zoom" while it is translated or
+# zoomed.
+VIEWPORT_MODES = ["full", "translation", "zoom"]
+
+
+def convert_tile_to_index(tile_x: int, tile_y: int, zoom_level: int) -> int:
+    return (4 ** zoom_level - 1) // 3 + 2 ** zoom_level * tile_x + tile_y
+
+
+def convert_index_to_tile(index: int) -> Tile:
+    zoom_level = 0
+    while convert_tile_to_index(0, 0, zoom_level + 1) <= index:
+        zoom_level += 1
+    offset = index - convert_tile_to_index(0, 0, zoom_level)
+    return offset // 2 ** zoom_level, offset % 2 ** zoom_level, zoom_level
+
+
+def get_tiles_from_zoom_level(tile_x: int, tile_y: int, zoom_level: int) -> List[Tile]:
+    """
+    Get the tiles at a distance of 1 from the given tile, plus the tiles at a distance of 2 and 3 on the bottom and on
+    the right, inside the grid of the zoom level.
+    @param tile_x:
+    @param tile_y:
+    @param zoom_level:
+    @return:
+    """
+    number_of_tiles = 2 ** zoom_level
+    tiles = []
+    # Columns are visited in the same order as the frontend: the column of the tile, then the columns on the left and
+    # on the right
+    for dx in (0, -1, 1, 2, 3):
+        x = tile_x + dx
+        if 0 <= x < number_of_tiles:
+            for dy in (0, -1, 1, 2, 3):
+                y = tile_y + dy
+                if 0 <= y < number_of_tiles:
+                    tiles.append((x, y, zoom_level))
+    return tiles
+
+
+def get_tiles_from_next_zoom_level(tiles: Iterable[Tile], zoom_level: int, max_zoom_level: int) -> List[Tile]:
+    """
+    Get the 4 tiles covering each of the given tiles at the next zoom level.
+    @param tiles:
+    @param zoom_level:
+    @param max_zoom_level:
+    @return:
+    """
+    if zoom_level + 1 > max_zoom_level:
+        return []
+    return [(x * 2 + dx, y * 2 + dy, zoom_level + 1) for x, y, _ in tiles
+            for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1))]
+
+
+def get_tiles_from_next_zoom_level_at_border(tile_x: int, tile_y: int, zoom_level: int,
+                                             max_zoom_level: int) -> List[Tile]:
+    """
+    Get the additional frame of tiles around the neighborhood of the given tile at the next zoom level.
+    @param tile_x:
+    @param tile_y:
+    @param zoom_level:
+    @param max_zoom_level:
+    @return:
+    """
+    new_tiles = []
+    if zoom_level + 1 > max_zoom_level:
+        return new_tiles
+    number_of_tiles = 2 ** zoom_level
+    next_zoom_level = zoom_level + 1
+
+    # Columns on the left and on the right, with their corner tiles
+    columns = []
+    if tile_x > 1:
+        columns.append((tile_x - 2) * 2 + 1)
+    if tile_x + 4 < number_of_tiles:
+        columns.append((tile_x + 4) * 2)
+    for x in columns:
+        for i in range(-1, 4):
+            if 0 <= tile_y + i < number_of_tiles:
+                new_tiles.append((x, (tile_y + i) * 2, next_zoom_level))
+                new_tiles.append((x, (tile_y + i) * 2 + 1, next_zoom_level))
+        if tile_y > 1:
+            new_tiles.append((x, (tile_y - 2) * 2 + 1, next_zoom_level))
+        if tile_y + 4 < number_of_tiles:
+            new_tiles.append((x, (tile_y + 4) * 2, next_zoom_level))
+
+    # Rows on the top and on the bottom
+    rows = []
+    if tile_y > 1:
+        rows.append((tile_y - 2) * 2 + 1)
+    if tile_y + 3 < number_of_tiles:
+        rows.append((tile_y + 4) * 2)
+    for y in rows:
+        for i in range(-1, 4):
+            if 0 <= tile_x + i < number_of_tiles:
+                new_tiles.append(((tile_x + i) * 2, y, next_zoom_level))
+                new_tiles.append(((tile_x + i) * 2 + 1, y, next_zoom_level))
+    return new_tiles
+
+
+def get_tiles_from_prev_zoom_level(tile_x: int, tile_y: int, zoom_level: int, levels: int = 1) -> List[Tile]:
+    """
+    Get the neighborhood of the tile containing the given tile, levels zoom levels above.
+    @param tile_x:
+    @param tile_y:
+    @param zoom_level:
+    @param levels:
+    @return:
+    """
+    if zoom_level < levels:
+        return []
+    return get_tiles_from_zoom_level(tile_x // 2 ** levels, tile_y // 2 ** levels, zoom_level - levels)
+
+
+def get_tiles(tile_x: int, tile_y: int, zoom_level: int, max_zoom_level: int, mode: str = "full") -> List[Tile]:
+    """
+    Get the tiles to prefetch for a viewport.
+    @param tile_x: x coordinate of the tile in the upper left corner of the viewport.
+    @param tile_y: y coordinate of the tile in the upper left corner of the viewport.
+    @param zoom_level:
+    @param max_zoom_level:
+    @param mode: one of VIEWPORT_MODES. "full" gets the neighborhood of the tile, the same region at the next two zoom
+    levels with a frame at the next zoom level, and the neighborhoods at the previous two zoom levels. "translation"
+    gets only the neighborhood, and "zoom" gets the neighborhood, the same region at the next zoom level and the
+    neighborhood at the previous zoom level.
+    @return: tiles inside the grid of their zoom level, without duplicates, in the order of the frontend.
+    """
+    tiles = get_tiles_from_zoom_level(tile_x, tile_y, zoom_level)
+    if mode == "full":
+        tiles_next_zoom_level = get_tiles_from_next_zoom_level(tiles, zoom_level, max_zoom_level)
+        tiles_next_zoom_level.extend(get_tiles_from_next_zoom_level_at_border(tile_x, tile_y, zoom_level,
+                                                                              max_zoom_level))
+        tiles_next_next_zoom_level = get_tiles_from_next_zoom_level(tiles_next_zoom_level, zoom_level + 1,
+                                                                    max_zoom_level)
+        tiles = tiles + tiles_next_zoom_level + tiles_next_next_zoom_level
+        tiles.extend(get_tiles_from_prev_zoom_level(tile_x, tile_y, zoom_level, 1))
+        tiles.extend(get_tiles_from_prev_zoom_level(tile_x, tile_y, zoom_level, 2))
+    elif mode == "zoom":
+        tiles = tiles + get_tiles_from_next_zoom_level(tiles, zoom_level, max_zoom_level)
+        tiles.extend(get_tiles_from_prev_zoom_level(tile_x, tile_y, zoom_level, 1))
+    elif mode != "translation":
+        raise ValueError(f"Unknown mode {mode}, expected one of {', '.join(VIEWPORT_MODES)}.")
+    # The frame at the next zoom level can have a row below the grid, whose indexes would be the ones of other tiles
+    return [tile for tile in dict.fromkeys(tiles) if tile[0] < 2 ** tile[2] and tile[1] < 2 ** tile[2]]
+
+
+def get_missing_indexes(tile_x: int, tile_y: int, zoom_level: int, max_zoom_level: int, cached: Set[int],
+                        mode: str = "full") -> List[int]:
+    """
+    Get the indexes of the tiles to prefetch for a viewport that the client does not hold.
+    @param tile_x:
+    @param tile_y:
+    @param zoom_level:
+    @param max_zoom_level:
+    @param cached: indexes of the tiles held by the client.
+    @param mode: one of VIEWPORT_MODES.
+    @return:
+    """
+    indexes = [convert_tile_to_index(*tile) for tile in get_tiles(tile_x, tile_y, zoom_level, max_zoom_level, mode)]
+    return [index for index in indexes if index not in cached]
@@ -0,0 +1,182 @@
+import getopt
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from pymilvus import db, utility
+
+from ..CONSTANTS import *
+from ..app.search_engines import MilvusSearchEngine, top_k_search
+from ..app.stores import EmbeddingsStore
+from ..db_utilities.collections import embeddings_collection, get_embeddings_index, EMBEDDING_VECTOR_FIELD_NAME
+from ..db_utilities.utils import create_connection
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hd:c:i:q:k:"
+    # Long options
+    long_options = ["help", "database", "collection", "index_types", "queries", "top_k"]
+
+    # Prepare flags
+    flags = {"database": DEFAULT_DATABASE_NAME, "dataset": datasets[0]["name"],
+             "index_types": list(DEFAULT_EMBEDDINGS_INDEX_PARAMS.keys()), "queries": 200, "top_k": 10}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script builds a temporary collection with the exported embeddings of a dataset for each index '
+              f'type, and reports recall@k against an exact search, search latency and memory. The parameters of '
+              f'the index type of the dataset are read from datasets.json, the other index types use their default '
+              f'parameters.\n\
+        -d or --database: database name (default={flags["database"]}).\n\
+        -c or --collection: dataset (default={flags["dataset"]}).\n\
+        -i or --index_types: comma separated list of index types (default={",".join(flags["index_types"])}).\n\
+        -q or --queries: number of queries (default={flags["queries"]}).\n\
+        -k or --top_k: number of results of each query (default={flags["top_k"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-d", "--database"):
+            flags["database"] = val
+        elif arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+        elif arg in ("-i", "--index_types"):
+            flags["index_types"] = val.split(",")
+            for index_type in flags["index_types"]:
+                if index_type not in DEFAULT_EMBEDDINGS_INDEX_PARAMS:
+                    print(f"Unknown index type {index_type}. Index types must be among "
+                          f"{list(DEFAULT_EMBEDDINGS_INDEX_PARAMS.keys())}.")
+                    sys.exit(1)
+        elif arg in ("-q", "--queries"):
+            flags["queries"] = int(val)
+        elif arg in ("-k", "--top_k"):
+            flags["top_k"] = int(val)
+
+    # Get the parameters of each index type
+    try:
+        dataset_index = get_embeddings_index([d for d in datasets if d["name"] == flags["dataset"]][0])
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    flags["configurations"] = [dataset_index if dataset_index["index_type"] == index_type
+                               else get_embeddings_index({"name": flags["dataset"],
+                                                          "embeddings_index": {"index_type": index_type}})
+                               for index_type in flags["index_types"]]
+
+    return flags
+
+
+def benchmark_configuration(collection_name: str, configuration: dict, ids: np.ndarray, matrix: np.ndarray,
+                            queries: np.ndarray, ground_truth: np.ndarray, top_k: int) -> dict:
+    """
+    Build a temporary collection with the given index, and measure its searches.
+    @param collection_name: name of the temporary collection.
+    @param configuration: index type, build parameters and search parameters.
+    @param ids: indexes of the images.
+    @param matrix: embeddings of the images.
+    @param queries: query vectors.
+    @param ground_truth: indexes of the exact top_k images of each query.
+    @param top_k:
+    @return: build time, recall@k, latency percentiles and memory of the loaded collection.
+    """
+    if utility.has_collection(collection_name):
+        utility.drop_collection(collection_name)
+    collection = embeddings_collection(collection_name, configuration["index_type"], configuration["params"])
+    try:
+        start = time.perf_counter()
+        for i in range(0, len(ids), INSERT_SIZE):
+            collection.insert(data=[{"index": int(index), EMBEDDING_VECTOR_FIELD_NAME: vector.tolist(), "x": 0.0,
+                                     "y": 0.0} for index, vector in zip(ids[i:i + INSERT_SIZE],
+                                                                        matrix[i:i + INSERT_SIZE])])
+        collection.flush()
+        utility.wait_for_index_building_complete(collection_name)
+        collection.load()
+        build_time = time.perf_counter() - start
+        memory = sum(segment.mem_size for segment in utility.get_query_segment_info(collection_name))
+
+        # Search each query separately, as the backend does
+        search_params = MilvusSearchEngine(configuration["search_params"]).get_search_params(top_k)
+        latencies, recalls = [], []
+        for query, truth in zip(queries, ground_truth):
+            start = time.perf_counter()
+            results = collection.search(data=[query.tolist()], anns_field=EMBEDDING_VECTOR_FIELD_NAME,
+                                        param=search_params, limit=top_k, output_fields=["index"])
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len({hit.id for hit in results[0]} & set(truth.tolist())) / len(truth))
+    finally:
+        collection.release()
+        utility.drop_collection(collection_name)
+
+    latencies = np.array(latencies) * 1000
+    return {"build_time": build_time, "recall": float(np.mean(recalls)), "p50": np.percentile(latencies, 50),
+            "p99": np.percentile(latencies, 99), "memory": memory}
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    # Get arguments
+    flags = parsing()
+
+    # Try creating a connection and selecting a database. If it fails, exit.
+    try:
+        create_connection(ROOT_USER, ROOT_PASSWD, False)
+        db.using_database(flags["database"])
+    except Exception as e:
+        print("Error in main. Connection failed. Error: ", e)
+        sys.exit(1)
+
+    # Load the exported embeddings
+    embeddings = EmbeddingsStore(os.path.join(os.getenv(HOME), DATA_DIR_NAME))(flags["dataset"])
+    if embeddings is None:
+        print(f"The embeddings of {flags['dataset']} have not been exported. Run src.db_utilities.export_artifacts.")
+        sys.exit(1)
+
+    # Use randomly perturbed embeddings of the dataset as queries
+    rng = np.random.default_rng(0)
+    rows = rng.choice(embeddings.matrix.shape[0], size=flags["queries"])
+    queries = np.asarray(embeddings.matrix[rows]) + rng.normal(scale=0.05, size=(flags["queries"],
+                                                                                embeddings.matrix.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+    # The exact search gives the same results as the FLAT index
+    ground_truth = embeddings.ids[top_k_search(embeddings.matrix, queries, flags["top_k"])[0]]
+
+    print(f"Dataset {flags['dataset']}: {embeddings.matrix.shape[0]} images, {flags['queries']} queries, "
+          f"top_k={flags['top_k']}.")
+    for configuration in flags["configurations"]:
+        try:
+            result = benchmark_configuration(flags["dataset"] + "_index_benchmark", configuration, embeddings.ids,
+                                             np.asarray(embeddings.matrix), queries, ground_truth, flags["top_k"])
+        except Exception as e:
+            print(f"Error in benchmarking {configuration['index_type']}. Error message: ", e)
+            continue
+        print(f"{configuration['index_type']} (params={configuration['params']}, "
+              f"search_params={configuration['search_params']}): recall@{flags['top_k']}={result['recall']:.4f}, "
+              f"p50={result['p50']:.3f} ms, p99={result['p99']:.3f} ms, memory={result['memory'] / 2 ** 20:.1f} MiB, "
+              f"build time={result['build_time']:.1f} s")
+    sys.exit(0)
@@ -0,0 +1,137 @@
+import getopt
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from pymilvus import db, Collection, utility
+
+from ..CONSTANTS import *
+from ..app.search_engines import LocalSearchEngine
+from ..app.stores import EmbeddingsStore
+from ..db_utilities.collections import EMBEDDING_VECTOR_FIELD_NAME
+from ..db_utilities.utils import create_connection
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hd:c:q:k:"
+    # Long options
+    long_options = ["help", "database", "collection", "queries", "top_k"]
+
+    # Prepare flags
+    flags = {"database": DEFAULT_DATABASE_NAME, "dataset": datasets[0]["name"], "queries": 200, "top_k": 10}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script compares the Milvus search with the local search on the exported embeddings of a dataset.\n\
+        -d or --database: database name (default={flags["database"]}).\n\
+        -c or --collection: dataset (default={flags["dataset"]}).\n\
+        -q or --queries: number of queries (default={flags["queries"]}).\n\
+        -k or --top_k: number of results of each query (default={flags["top_k"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-d", "--database"):
+            flags["database"] = val
+        elif arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+        elif arg in ("-q", "--queries"):
+            flags["queries"] = int(val)
+        elif arg in ("-k", "--top_k"):
+            flags["top_k"] = int(val)
+
+    return flags
+
+
+def summarize(name: str, latencies: list):
+    """
+    Print the percentiles of the latencies of a search engine.
+    @param name: name of the search engine.
+    @param latencies: latencies in seconds.
+    @return:
+    """
+    latencies = np.array(latencies) * 1000
+    print(f"{name}: p50={np.percentile(latencies, 50):.3f} ms, p99={np.percentile(latencies, 99):.3f} ms, "
+          f"mean={latencies.mean():.3f} ms")
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    # Get arguments
+    flags = parsing()
+
+    # Try creating a connection and selecting a database. If it fails, exit.
+    try:
+        create_connection(ROOT_USER, ROOT_PASSWD, False)
+        db.using_database(flags["database"])
+    except Exception as e:
+        print("Error in main. Connection failed. Error: ", e)
+        sys.exit(1)
+
+    # Load the exported embeddings
+    embeddings = EmbeddingsStore(os.path.join(os.getenv(HOME), DATA_DIR_NAME))(flags["dataset"])
+    if embeddings is None:
+        print(f"The embeddings of {flags['dataset']} have not been exported. Run src.db_utilities.export_artifacts.")
+        sys.exit(1)
+    if not utility.has_collection(flags["dataset"]):
+        print(f"The collection {flags['dataset']} does not exist.")
+        sys.exit(1)
+    collection = Collection(flags["dataset"])
+    collection.load()
+    engine = LocalSearchEngine(embeddings)
+
+    # Use randomly perturbed embeddings of the dataset as queries
+    rng = np.random.default_rng(0)
+    rows = rng.choice(embeddings.matrix.shape[0], size=flags["queries"])
+    queries = np.asarray(embeddings.matrix[rows]) + rng.normal(scale=0.05, size=(flags["queries"],
+                                                                                embeddings.matrix.shape[1]))
+
+    # The collection is not released at the end, as it can be used by the backend
+    milvus_latencies, local_latencies, overlaps = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        results = collection.search(data=[query.tolist()], anns_field=EMBEDDING_VECTOR_FIELD_NAME,
+                                    param={"metric_type": COSINE_METRIC, "offset": 0}, limit=flags["top_k"],
+                                    output_fields=["index"])
+        milvus_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        indexes, _ = engine.search_indexes(query, flags["top_k"])
+        local_latencies.append(time.perf_counter() - start)
+
+        # Fraction of the Milvus results also returned by the local search
+        milvus_indexes = [hit.id for hit in results[0]]
+        overlaps.append(len(set(milvus_indexes) & set(indexes[0].tolist())) / max(len(milvus_indexes), 1))
+
+    print(f"Dataset {flags['dataset']}: {embeddings.matrix.shape[0]} images, {flags['queries']} queries, "
+          f"top_k={flags['top_k']}.")
+    summarize("Milvus search", milvus_latencies)
+    summarize("Local search", local_latencies)
+    print(f"Agreement between the results: {np.mean(overlaps):.4f}")
+    sys.exit(0)
@@ -0,0 +1,222 @@
+import getopt
+import json
+import os
+import sys
+import time
+from typing import List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from pymilvus import db, utility, Collection
+
+from ..CONSTANTS import *
+from ..app.search_engines import MilvusSearchEngine
+from ..db_utilities.artifacts import load_metadata
+from ..db_utilities.collections import get_embeddings_index, EMBEDDING_VECTOR_FIELD_NAME
+from ..db_utilities.utils import create_connection
+from ..embeddings_model.CLIPEmbeddings import ClipEmbeddings, get_text_encoder_size
+from ..embeddings_model.EmbeddingsModel import to_numpy
+from ..embeddings_model.utils import cosine_agreement
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hd:c:f:q:r:"
+    # Long options
+    long_options = ["help", "database=", "collections=", "file=", "queries=", "repeats=", "min_cosine=", "min_top1="]
+
+    # Prepare flags
+    flags = {"database": DEFAULT_DATABASE_NAME, "datasets": [d["name"] for d in datasets], "file": None,
+             "queries": 200, "repeats": 3, "min_cosine": MIN_QUANTIZED_COSINE_AGREEMENT,
+             "min_top1": MIN_QUANTIZED_TOP1_AGREEMENT}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script compares the int8 text encoder with the fp32 text encoder on a corpus of queries. It '
+              f'reports the cosine similarity between the embeddings of each query, the fraction of queries with the '
+              f'same top-1 image in the embeddings collection of each dataset, the speedup and the memory saving of '
+              f'the text encoder. It exits with an error if the agreements are below the minimums.\n\
+        -d or --database: database name (default={flags["database"]}).\n\
+        -c or --collections: comma separated list of datasets (default={",".join(flags["datasets"])}).\n\
+        -f or --file: file with one query per line (default=captions of the first dataset, exported by '
+              f'src.db_utilities.export_artifacts).\n\
+        -q or --queries: maximum number of queries (default={flags["queries"]}).\n\
+        -r or --repeats: number of times the queries are embedded (default={flags["repeats"]}).\n\
+        --min_cosine: minimum mean cosine similarity (default={flags["min_cosine"]}).\n\
+        --min_top1: minimum top-1 agreement on each dataset (default={flags["min_top1"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-d", "--database"):
+            flags["database"] = val
+        elif arg in ("-c", "--collections"):
+            flags["datasets"] = val.split(",")
+            for dataset in flags["datasets"]:
+                if dataset not in [d["name"] for d in datasets]:
+                    print(f"Dataset {dataset} not found.")
+                    sys.exit(1)
+        elif arg in ("-f", "--file"):
+            if os.path.exists(val):
+                flags["file"] = val
+            else:
+                print("Queries file not found.")
+                sys.exit(1)
+        elif arg in ("-q", "--queries"):
+            flags["queries"] = int(val)
+        elif arg in ("-r", "--repeats"):
+            flags["repeats"] = int(val)
+        elif arg == "--min_cosine":
+            flags["min_cosine"] = float(val)
+        elif arg == "--min_top1":
+            flags["min_top1"] = float(val)
+
+    # Get the search parameters of the index of each dataset
+    try:
+        flags["search_params"] = {d["name"]: get_embeddings_index(d)["search_params"] for d in datasets
+                                  if d["name"] in flags["datasets"]}
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    return flags
+
+
+def get_queries(file: str | None, dataset: str, n: int) -> List[str]:
+    """
+    Get the queries from a file, or sample them from the captions of a dataset.
+    @param file: file with one query per line. If None, the captions of the dataset are used.
+    @param dataset:
+    @param n: maximum number of queries.
+    @return:
+    """
+    if file is not None:
+        with open(file, "r") as f:
+            queries = [line.strip() for line in f if line.strip()]
+        return queries[:n]
+
+    columns = load_metadata(os.path.join(os.getenv(HOME), DATA_DIR_NAME), dataset)
+    if "caption" not in columns:
+        raise ValueError(f"Dataset {dataset} has no captions. Run src.db_utilities.add_captions, or pass a file of "
+                         f"queries.")
+    offsets, data = columns["caption"]
+    data = data.tobytes()
+    rows = np.random.default_rng(0).choice(len(offsets) - 1, size=min(n, len(offsets) - 1), replace=False)
+    return [data[offsets[row]:offsets[row + 1]].decode("utf-8") for row in rows]
+
+
+def embed(model: ClipEmbeddings, queries: List[str], repeats: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Embed each query separately, as the backend does for /api/image-text, and measure the latency.
+    @param model:
+    @param queries:
+    @param repeats: number of times the queries are embedded.
+    @return: embeddings of the queries and latency of each call in milliseconds.
+    """
+    # Run a forward pass, so that the lazy initializations are not measured
+    model.getTextEmbeddings(["warm up"])
+    embeddings, latencies = [], []
+    for repeat in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            embedding = to_numpy(model.getTextEmbeddings([query]))
+            latencies.append(time.perf_counter() - start)
+            if repeat == 0:
+                embeddings.append(embedding[0])
+    return np.stack(embeddings), np.array(latencies) * 1000
+
+
+def get_top1(collection: Collection, search_params: dict, embeddings: np.ndarray) -> np.ndarray:
+    """
+    Get the index of the most similar image to each embedding in an embeddings collection.
+    @param collection:
+    @param search_params: search parameters of the index of the collection.
+    @param embeddings:
+    @return:
+    """
+    results = collection.search(data=embeddings.tolist(), anns_field=EMBEDDING_VECTOR_FIELD_NAME,
+                                param=MilvusSearchEngine(search_params).get_search_params(1), limit=1,
+                                output_fields=["index"])
+    return np.array([hits[0].id if len(hits) > 0 else -1 for hits in results])
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    # Get arguments
+    flags = parsing()
+
+    # Try creating a connection and selecting a database. If it fails, exit.
+    try:
+        create_connection(ROOT_USER, ROOT_PASSWD, False)
+        db.using_database(flags["database"])
+    except Exception as e:
+        print("Error in main. Connection failed. Error: ", e)
+        sys.exit(1)
+
+    try:
+        queries = get_queries(flags["file"], flags["datasets"][0], flags["queries"])
+    except Exception as e:
+        print("Error in loading the queries. Error message: ", e)
+        sys.exit(1)
+
+    # Embed the queries with both text encoders
+    fp32_model = ClipEmbeddings("cpu", "fp32")
+    int8_model = ClipEmbeddings("cpu", "int8")
+    fp32_embeddings, fp32_latencies = embed(fp32_model, queries, flags["repeats"])
+    int8_embeddings, int8_latencies = embed(int8_model, queries, flags["repeats"])
+    fp32_size = get_text_encoder_size(fp32_model.model)
+    int8_size = get_text_encoder_size(int8_model.model)
+
+    similarities = cosine_agreement(fp32_embeddings, int8_embeddings)
+    passed = float(np.mean(similarities)) >= flags["min_cosine"]
+    print(f"{len(queries)} queries.")
+    print(f"Cosine agreement: mean={np.mean(similarities):.4f}, min={np.min(similarities):.4f}, "
+          f"p1={np.percentile(similarities, 1):.4f}")
+    print(f"Latency: fp32 p50={np.percentile(fp32_latencies, 50):.2f} ms, "
+          f"int8 p50={np.percentile(int8_latencies, 50):.2f} ms, "
+          f"speedup={np.percentile(fp32_latencies, 50) / np.percentile(int8_latencies, 50):.2f}x")
+    print(f"Text encoder memory: fp32={fp32_size / 2 ** 20:.1f} MiB, int8={int8_size / 2 ** 20:.1f} MiB, "
+          f"saving={(fp32_size - int8_size) / 2 ** 20:.1f} MiB ({1 - int8_size / fp32_size:.0%})")
+
+    # Compare the top-1 image of each query in the embeddings collection of each dataset
+    for dataset in flags["datasets"]:
+        if not utility.has_collection(dataset):
+            print(f"The collection {dataset} does not exist.")
+            continue
+        try:
+            collection = Collection(dataset)
+            collection.load()
+            fp32_top1 = get_top1(collection, flags["search_params"][dataset], fp32_embeddings)
+            int8_top1 = get_top1(collection, flags["search_params"][dataset], int8_embeddings)
+        except Exception as e:
+            print(f"Error in searching {dataset}. Error message: ", e)
+            passed = False
+            continue
+        agreement = float(np.mean(fp32_top1 == int8_top1))
+        passed = passed and agreement >= flags["min_top1"]
+        print(f"Top-1 agreement on {dataset}: {agreement:.4f}")
+
+    if not passed:
+        print(f"The int8 text encoder does not meet the minimum agreements (cosine={flags['min_cosine']}, "
+              f"top-1={flags['min_top1']}).")
+        sys.exit(1)
+    print("The int8 text encoder meets the minimum agreements. Set TEXT_ENCODER_PRECISION=int8 to use it.")
+    sys.exit(0)
@@ -32,12 +32,12 @@ class DatasetPreprocessor:
         Generate _embeddings of data using the provided _embeddings embeddings_model. The method requires the inputs
         to the data encoder.
         """
-        # This code works for dataloader with batch_size == 1
+        # This code works for dataloader with batch_size == 1. Models running under ONNX Runtime return arrays.
+        embeddings = torch.as_tensor(self.embeddings_model.getEmbeddings(inputs)).detach()
         if self._embeddings is None:
-            self._embeddings = self.embeddings_model.getEmbeddings(inputs).detach()
+            self._embeddings = embeddings
         else:
-            self._embeddings = torch.cat((self._embeddings,
-                                          self.embeddings_model.getEmbeddings(inputs)), dim=0).detach()
+            self._embeddings = torch.cat((self._embeddings, embeddings), dim=0)
 
     def _storeAttributes(self, data, attribute):
         if attribute not in self._attributes:
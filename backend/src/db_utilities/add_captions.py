@@ -7,7 +7,8 @@ import sys
 from dotenv import load_dotenv
 from pymilvus import db, Collection, utility
 
-from .collections import embeddings_collection
+from .artifacts import save_metadata
+from .collections import EMBEDDING_VECTOR_FIELD_NAME, embeddings_collection
 from .utils import create_connection
 from ..CONSTANTS import *
 
@@ -141,3 +142,12 @@ if __name__ == "__main__":
     except Exception as e:
         print("Error in update_metadata. Update failed. Error message: ", e)
         sys.exit(1)
+
+    # Save the metadata with the captions, which the backend loads to serve metadata without querying the collection
+    try:
+        save_metadata(os.path.join(os.getenv(HOME), DATA_DIR_NAME), flags["collection"],
+                      [{key: value for key, value in entity.items() if key != EMBEDDING_VECTOR_FIELD_NAME}
+                       for entity in entities])
+    except Exception as e:
+        print("Error in saving metadata. Error message: ", e)
+        sys.exit(1)
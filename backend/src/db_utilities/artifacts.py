@@ -0,0 +1,211 @@
+"""
+Module for reading and writing the files that are generated for each dataset next to its collections. The files of a
+dataset are saved in a subdirectory of the data directory, which is mounted in the backend container.
+"""
+import gzip
+import io
+import json
+import os
+from typing import Dict, Tuple
+
+import numpy as np
+
+from ..CONSTANTS import *
+
+
+def get_dataset_directory(data_dir: str, dataset: str) -> str:
+    """
+    Return the directory containing the files of a dataset.
+    @param data_dir: data directory.
+    @param dataset: name of the dataset.
+    @return:
+    """
+    return os.path.join(data_dir, dataset)
+
+
+def get_first_tiles_path(data_dir: str, dataset: str) -> str:
+    return os.path.join(get_dataset_directory(data_dir, dataset), FIRST_TILES_FILE_NAME)
+
+
+def get_embeddings_paths(data_dir: str, dataset: str) -> Tuple[str, str]:
+    """
+    Return the paths of the embeddings matrix and of the indexes of its rows.
+    @param data_dir:
+    @param dataset:
+    @return:
+    """
+    directory = get_dataset_directory(data_dir, dataset)
+    return os.path.join(directory, EMBEDDINGS_FILE_NAME), os.path.join(directory, EMBEDDING_IDS_FILE_NAME)
+
+
+def get_neighbor_graph_paths(data_dir: str, dataset: str) -> Tuple[str, str]:
+    """
+    Return the paths of the indexes and of the scores of the neighbors of each image.
+    @param data_dir:
+    @param dataset:
+    @return:
+    """
+    directory = get_dataset_directory(data_dir, dataset)
+    return os.path.join(directory, NEIGHBOR_INDEXES_FILE_NAME), os.path.join(directory, NEIGHBOR_SCORES_FILE_NAME)
+
+
+def get_metadata_path(data_dir: str, dataset: str) -> str:
+    return os.path.join(get_dataset_directory(data_dir, dataset), METADATA_FILE_NAME)
+
+
+def write_file_atomically(path: str, data: bytes):
+    """
+    Write data to a file. The data is first written to a temporary file, which then replaces the file, so that readers
+    never see a partially written file.
+    @param path:
+    @param data:
+    @return:
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def save_first_tiles(data_dir: str, dataset: str, tiles: list):
+    """
+    Save the tiles of the first zoom levels as a gzip-compressed JSON list. The list has the same format as the
+    response of /api/first-tiles.
+    @param data_dir: data directory.
+    @param dataset: name of the dataset.
+    @param tiles: list of tiles with fields "index", "data" and, for the tile at zoom level 0, "range".
+    @return:
+    """
+    tiles = sorted(tiles, key=lambda tile: tile["index"])
+    # Set mtime to 0 so that the same tiles always produce the same file
+    data = gzip.compress(json.dumps(tiles, separators=(",", ":")).encode("utf-8"), mtime=0)
+    write_file_atomically(get_first_tiles_path(data_dir, dataset), data)
+
+
+def save_array(path: str, array: np.ndarray):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    write_file_atomically(path, buffer.getvalue())
+
+
+def save_embeddings(data_dir: str, dataset: str, indexes, embeddings):
+    """
+    Save the L2-normalized embeddings of a dataset as a float32 matrix, together with the index of the image of each
+    row. Rows are sorted by index.
+    @param data_dir: data directory.
+    @param dataset: name of the dataset.
+    @param indexes: indexes of the images.
+    @param embeddings: matrix of shape (number of images, embedding dimension).
+    @return:
+    """
+    indexes = np.asarray(indexes, dtype=np.int64)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    assert embeddings.ndim == 2 and embeddings.shape[0] == indexes.shape[0]
+    # Sort rows by index
+    order = np.argsort(indexes, kind="stable")
+    indexes = indexes[order]
+    embeddings = embeddings[order]
+    # Normalize embeddings, so that cosine similarities are dot products
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings = embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+    embeddings_path, ids_path = get_embeddings_paths(data_dir, dataset)
+    # Write the matrix last, as readers check its modification time
+    save_array(ids_path, indexes)
+    save_array(embeddings_path, embeddings.astype(np.float32))
+
+
+def load_embeddings(data_dir: str, dataset: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the embeddings of a dataset saved by save_embeddings. The matrix is memory-mapped.
+    @param data_dir:
+    @param dataset:
+    @return: indexes of the rows, and matrix of L2-normalized embeddings.
+    """
+    embeddings_path, ids_path = get_embeddings_paths(data_dir, dataset)
+    return np.load(ids_path), np.load(embeddings_path, mmap_mode="r")
+
+
+def save_neighbor_graph(data_dir: str, dataset: str, neighbor_indexes: np.ndarray, neighbor_scores: np.ndarray):
+    """
+    Save the neighbors of each image, as int32 indexes and float16 cosine similarities. The rows are in the same order
+    as the rows of the embeddings saved by save_embeddings, and each row is sorted by decreasing similarity.
+    @param data_dir: data directory.
+    @param dataset: name of the dataset.
+    @param neighbor_indexes: matrix of shape (number of images, number of neighbors).
+    @param neighbor_scores: matrix of shape (number of images, number of neighbors).
+    @return:
+    """
+    assert neighbor_indexes.shape == neighbor_scores.shape
+    indexes_path, scores_path = get_neighbor_graph_paths(data_dir, dataset)
+    # Write the indexes last, as readers check their modification time
+    save_array(scores_path, neighbor_scores.astype(np.float16))
+    save_array(indexes_path, neighbor_indexes.astype(np.int32))
+
+
+def load_neighbor_graph(data_dir: str, dataset: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the neighbor graph of a dataset saved by save_neighbor_graph. The matrices are memory-mapped.
+    @param data_dir:
+    @param dataset:
+    @return: indexes and scores of the neighbors of each image.
+    """
+    indexes_path, scores_path = get_neighbor_graph_paths(data_dir, dataset)
+    return np.load(indexes_path, mmap_mode="r"), np.load(scores_path, mmap_mode="r")
+
+
+def save_metadata(data_dir: str, dataset: str, entities: list):
+    """
+    Save the metadata of the images of a dataset in columns, in an uncompressed npz file. Numeric fields are saved as
+    arrays. String fields are saved as the concatenation of their UTF-8 encoded values, in the array "<field>.data",
+    and the offsets of the values, in the array "<field>.offsets". Fields that are not set for every image, and fields
+    whose values are neither numbers nor strings, such as the embeddings, are skipped. Rows are sorted by index.
+    @param data_dir: data directory.
+    @param dataset: name of the dataset.
+    @param entities: list of entities with at least the field "index".
+    @return:
+    """
+    entities = sorted(entities, key=lambda entity: entity["index"])
+    fields = set.intersection(*[set(entity.keys()) for entity in entities]) if len(entities) > 0 else {"index"}
+    arrays = {}
+    for field in sorted(fields):
+        # Convert numpy scalars to Python values
+        values = [entity[field].item() if isinstance(entity[field], np.generic) else entity[field]
+                  for entity in entities]
+        if all(isinstance(value, bool) for value in values):
+            arrays[field] = np.asarray(values, dtype=np.bool_)
+        elif all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            arrays[field] = np.asarray(values, dtype=np.int64)
+        elif all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            arrays[field] = np.asarray(values, dtype=np.float64)
+        elif all(isinstance(value, str) for value in values):
+            encoded = [value.encode("utf-8") for value in values]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(value) for value in encoded])
+            arrays[field + ".offsets"] = offsets
+            arrays[field + ".data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    write_file_atomically(get_metadata_path(data_dir, dataset), buffer.getvalue())
+
+
+def load_metadata(data_dir: str, dataset: str) -> Dict[str, np.ndarray | Tuple[np.ndarray, np.ndarray]]:
+    """
+    Load the metadata of a dataset saved by save_metadata.
+    @param data_dir:
+    @param dataset:
+    @return: dictionary mapping each field to its array, or, for string fields, to the offsets and the concatenated
+    UTF-8 encoded values.
+    """
+    with np.load(get_metadata_path(data_dir, dataset)) as f:
+        arrays = {name: f[name] for name in f.files}
+    columns = {}
+    for name, array in arrays.items():
+        if name.endswith(".offsets"):
+            field = name.removesuffix(".offsets")
+            columns[field] = (array, arrays[field + ".data"])
+        elif not name.endswith(".data"):
+            columns[name] = array
+    return columns
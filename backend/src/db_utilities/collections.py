@@ -7,7 +7,53 @@ EMBEDDING_VECTOR_FIELD_NAME = "embedding"
 ZOOM_LEVEL_VECTOR_FIELD_NAME = "tile"
 
 
-def embeddings_collection(collection_name: str):
+def get_embeddings_index(dataset: dict) -> dict:
+    """
+    Get the index of the embeddings collection of a dataset from its entry in datasets.json. The entry can contain a
+    field "embeddings_index" with the following format:
+    {
+        "index_type": one of the keys of DEFAULT_EMBEDDINGS_INDEX_PARAMS,
+        "params": build parameters of the index,
+        "search_params": search parameters of the index
+    }
+    Missing parameters take their default values.
+    @param dataset: entry of the dataset in datasets.json.
+    @return: dictionary with keys "index_type", "params" and "search_params".
+    """
+    index = dataset.get("embeddings_index", {})
+    index_type = index.get("index_type", INDEX_TYPE)
+    if index_type not in DEFAULT_EMBEDDINGS_INDEX_PARAMS:
+        raise ValueError(f"Index type {index_type} of dataset {dataset['name']} must be among "
+                         f"{list(DEFAULT_EMBEDDINGS_INDEX_PARAMS.keys())}.")
+    defaults = DEFAULT_EMBEDDINGS_INDEX_PARAMS[index_type]
+    return {
+        "index_type": index_type,
+        "params": {**defaults["params"], **index.get("params", {})},
+        "search_params": {**defaults["search_params"], **index.get("search_params", {})}
+    }
+
+
+def create_embeddings_index(collection: Collection, index_type: str = INDEX_TYPE, params: dict | None = None):
+    """
+    Create the index of the embedding field of an embeddings collection.
+    @param collection:
+    @param index_type: one of the keys of DEFAULT_EMBEDDINGS_INDEX_PARAMS.
+    @param params: build parameters of the index.
+    @return:
+    """
+    index_params = {
+        "metric_type": COSINE_METRIC,
+        "index_type": index_type,
+        "params": params if params is not None else DEFAULT_EMBEDDINGS_INDEX_PARAMS[index_type]["params"]
+    }
+
+    collection.create_index(
+        field_name=EMBEDDING_VECTOR_FIELD_NAME,
+        index_params=index_params
+    )
+
+
+def embeddings_collection(collection_name: str, index_type: str = INDEX_TYPE, params: dict | None = None):
     # Create fields for collection
     index = FieldSchema(
         name="index",
@@ -45,16 +91,7 @@ def embeddings_collection(collection_name: str):
     )
 
     # Create index for embedding field to make similarity search faster
-    index_params = {
-        "metric_type": COSINE_METRIC,
-        "index_type": INDEX_TYPE,
-        "params": {}
-    }
-
-    collection.create_index(
-        field_name="embedding",
-        index_params=index_params
-    )
+    create_embeddings_index(collection, index_type, params)
 
     return collection
 
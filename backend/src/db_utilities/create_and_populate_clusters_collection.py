@@ -9,9 +9,11 @@ from dotenv import load_dotenv
 from pymilvus import db, Collection, utility
 from tqdm import tqdm
 
+from .artifacts import save_first_tiles
 from .collections import clusters_collection, image_to_tile_collection, ZOOM_LEVEL_VECTOR_FIELD_NAME
 from .utils import ModifiedKMeans
 from .utils import create_connection
+from .versions import ContentVersion, save_dataset_version
 from ..CONSTANTS import *
 
 # Increase pixel limit
@@ -113,8 +115,53 @@ def get_index_from_tile(zoom_level, tile_x, tile_y):
     return index
 
 
+def create_tile_entity(zoom_levels, images_to_tile, zoom, tile_x, tile_y) -> dict:
+    new_representatives = []
+    for representative in zoom_levels[zoom][tile_x][tile_y]["representatives"]:
+        new_representative = {
+            "index": int(representative["representative"]["index"]),
+            "path": str(representative["representative"]["path"]),
+            "x": float(representative["representative"]["x"]),
+            "y": float(representative["representative"]["y"]),
+            "width": int(representative["representative"]["width"]),
+            "height": int(representative["representative"]["height"]),
+            "zoom": int(images_to_tile[representative["representative"]["index"]][0])
+        }
+        new_representatives.append(new_representative)
+
+    # Create entity
+    entity = {
+        "index": get_index_from_tile(zoom, tile_x, tile_y),
+        ZOOM_LEVEL_VECTOR_FIELD_NAME: [zoom, tile_x, tile_y],
+        "data": new_representatives
+    }
+
+    if zoom == 0:
+        entity["range"] = {
+            "x_min": float(zoom_levels[zoom][tile_x][tile_y]["range"]["x_min"]),
+            "x_max": float(zoom_levels[zoom][tile_x][tile_y]["range"]["x_max"]),
+            "y_min": float(zoom_levels[zoom][tile_x][tile_y]["range"]["y_min"]),
+            "y_max": float(zoom_levels[zoom][tile_x][tile_y]["range"]["y_max"])
+        }
+
+    return entity
+
+
+def get_first_tiles(zoom_levels, images_to_tile, last_zoom_level) -> list:
+    # Get the tiles of zoom levels from 0 to last_zoom_level, in the format returned by /api/first-tiles
+    first_tiles = []
+    for zoom in range(last_zoom_level + 1):
+        for tile_x in zoom_levels[zoom].keys():
+            for tile_y in zoom_levels[zoom][tile_x].keys():
+                entity = create_tile_entity(zoom_levels, images_to_tile, zoom, tile_x, tile_y)
+                del entity[ZOOM_LEVEL_VECTOR_FIELD_NAME]
+                first_tiles.append(entity)
+    return first_tiles
+
+
 def insert_vectors_in_clusters_collection(zoom_levels, images_to_tile, collection: Collection, entities_per_zoom_level,
-                                          zoom_level, current_tile_x, current_tile_y, last_call=False) -> bool:
+                                          zoom_level, current_tile_x, current_tile_y, last_call=False,
+                                          version: ContentVersion | None = None) -> bool:
     try:
         # Define list of entities to insert in the collection
         entities_to_insert = []
@@ -125,36 +172,9 @@ def insert_vectors_in_clusters_collection(zoom_levels, images_to_tile, collectio
                     # Check if the tile has already been inserted
                     if zoom_levels[zoom][tile_x][tile_y]["already_inserted"]:
                         continue
-                    new_representatives = []
-                    for representative in zoom_levels[zoom][tile_x][tile_y]["representatives"]:
-                        new_representative = {
-                            "index": int(representative["representative"]["index"]),
-                            "path": str(representative["representative"]["path"]),
-                            "x": float(representative["representative"]["x"]),
-                            "y": float(representative["representative"]["y"]),
-                            "width": int(representative["representative"]["width"]),
-                            "height": int(representative["representative"]["height"]),
-                            "zoom": int(images_to_tile[representative["representative"]["index"]][0])
-                        }
-                        new_representatives.append(new_representative)
-
-                    # Create entity
-                    entity = {
-                        "index": get_index_from_tile(zoom, tile_x, tile_y),
-                        ZOOM_LEVEL_VECTOR_FIELD_NAME: [zoom, tile_x, tile_y],
-                        "data": new_representatives
-                    }
-
-                    if zoom == 0:
-                        entity["range"] = {
-                            "x_min": float(zoom_levels[zoom][tile_x][tile_y]["range"]["x_min"]),
-                            "x_max": float(zoom_levels[zoom][tile_x][tile_y]["range"]["x_max"]),
-                            "y_min": float(zoom_levels[zoom][tile_x][tile_y]["range"]["y_min"]),
-                            "y_max": float(zoom_levels[zoom][tile_x][tile_y]["range"]["y_max"])
-                        }
 
                     # Insert entity
-                    entities_to_insert.append(entity)
+                    entities_to_insert.append(create_tile_entity(zoom_levels, images_to_tile, zoom, tile_x, tile_y))
                     # Mark as inserted
                     zoom_levels[zoom][tile_x][tile_y]["already_inserted"] = True
 
@@ -165,6 +185,11 @@ def insert_vectors_in_clusters_collection(zoom_levels, images_to_tile, collectio
         # Flush collection
         collection.flush()
 
+        # Add the inserted entities to the version of the collection
+        if version is not None:
+            for entity in entities_to_insert:
+                version.add(entity)
+
     except Exception as e:
         print("Error in insert_vectors_in_clusters_collection. Error message: ", e)
         return False
@@ -388,6 +413,11 @@ def create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_col
     # Define dictionary for mapping from images to coarser zoom level (and tile)
     images_to_tile = {}
 
+    # Define list of tiles of the first zoom levels, which are saved to a file for /api/first-tiles
+    first_tiles = []
+    # Define version of the content of the clusters collection, computed while the tiles are inserted
+    clusters_version = ContentVersion()
+
     # Load the collection of zoom levels
     zoom_levels_collection.load()
 
@@ -411,7 +441,7 @@ def create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_col
                     # Insert data in collection
                     result = insert_vectors_in_clusters_collection(
                         zoom_levels, images_to_tile, zoom_levels_collection, entities_per_zoom_level,
-                        zoom_level, tile_x_index, tile_y_index
+                        zoom_level, tile_x_index, tile_y_index, version=clusters_version
                     )
                     if result:
                         # Adjust zoom_levels dictionary
@@ -615,9 +645,15 @@ def create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_col
                             zoom_level, tile_x_index, tile_y_index
                         ]
 
+        # Once the last of the first zoom levels is complete, collect their tiles. All these tiles are still in
+        # zoom_levels, as they are far fewer than LIMIT_FOR_TOTAL.
+        if zoom_level == min(FIRST_TILES_MAX_ZOOM_LEVEL, max_zoom_level):
+            first_tiles = get_first_tiles(zoom_levels, images_to_tile, zoom_level)
+
     # Do a final insert in the collection
     result = insert_vectors_in_clusters_collection(
-        zoom_levels, images_to_tile, zoom_levels_collection, entities_per_zoom_level, -1, -1, -1, True
+        zoom_levels, images_to_tile, zoom_levels_collection, entities_per_zoom_level, -1, -1, -1, True,
+        version=clusters_version
     )
     if not result:
         # Shut down application
@@ -630,6 +666,27 @@ def create_zoom_levels(entities, zoom_levels_collection_name, images_to_tile_col
     zoom_levels_collection.release()
     create_image_to_tile_collection(images_to_tile, zoom_levels_collection_name, images_to_tile_collection_name)
 
+    # Save the tiles of the first zoom levels. The collections are kept if the file cannot be written, as the app then
+    # gets the first tiles from the clusters collection.
+    try:
+        save_first_tiles(os.path.join(os.getenv(HOME), DATA_DIR_NAME),
+                         zoom_levels_collection_name.removesuffix("_zoom_levels_clusters"), first_tiles)
+    except Exception as e:
+        print(f"Error in save_first_tiles, the first tiles will be served from the collection. Error message: {e}")
+
+    # Record the versions of the new collections, from which the app derives the ETags of the data it serves. The
+    # collections are kept if the versions cannot be recorded, as the app then serves the data without ETags.
+    dataset = zoom_levels_collection_name.removesuffix("_zoom_levels_clusters")
+    datasets_json_path = os.path.join(os.getenv(HOME), DATASETS_JSON_NAME)
+    images_to_tile_version = ContentVersion()
+    for index, tile in images_to_tile.items():
+        images_to_tile_version.add([index, tile])
+    try:
+        save_dataset_version(datasets_json_path, dataset, "clusters", clusters_version.hexdigest())
+        save_dataset_version(datasets_json_path, dataset, "image_to_tile", images_to_tile_version.hexdigest())
+    except Exception as e:
+        print(f"Error in save_dataset_version, the data will be served without ETags. Error message: {e}")
+
 
 def check_if_collection_exists(collection_name: str, repopulate: bool):
     if utility.has_collection(collection_name) and (repopulate or Collection(collection_name).num_entities == 0):
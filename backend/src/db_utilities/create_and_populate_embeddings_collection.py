@@ -10,11 +10,12 @@ from dotenv import load_dotenv
 from pymilvus import utility, db, Collection
 
 from .DatasetPreprocessor import DatasetPreprocessor
-from .collections import embeddings_collection, EMBEDDING_VECTOR_FIELD_NAME
+from .artifacts import save_embeddings, save_metadata
+from .collections import embeddings_collection, get_embeddings_index, EMBEDDING_VECTOR_FIELD_NAME
 from .datasets import get_dataset_object
 from .utils import create_connection
 from ..CONSTANTS import *
-from ..embeddings_model.CLIPEmbeddings import ClipEmbeddings
+from ..embeddings_model.backends import get_clip_embeddings
 
 # Increase pixel limit
 PIL.Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
@@ -28,14 +29,14 @@ def parsing():
     arguments = sys.argv[1:]
 
     # Options
-    options = "hd:c:b:r:"
+    options = "hd:c:b:r:e:"
 
     # Long options
-    long_options = ["help", "database", "collection", "batch_size", "repopulate"]
+    long_options = ["help", "database", "collection", "batch_size", "repopulate", "backend"]
 
     # Prepare flags
     flags = {"database": DEFAULT_DATABASE_NAME, "dataset": datasets[0]["name"],
-             "batch_size": BATCH_SIZE, "repopulate": False}
+             "batch_size": BATCH_SIZE, "repopulate": False, "backend": DEFAULT_EMBEDDINGS_BACKEND}
 
     # Parsing argument
     arguments, values = getopt.getopt(arguments, options, long_options)
@@ -46,7 +47,9 @@ def parsing():
         -c or --collection: dataset (default={flags["dataset"]}).\n\
         -b or --batch_size: batch size used for loading the dataset (default={BATCH_SIZE}).\n\
         -r or --repopulate: whether to empty the database and repopulate. Type y for repopulating the store, '
-              f'n otherwise (default={"n" if not flags["repopulate"] else "y"}).')
+              f'n otherwise (default={"n" if not flags["repopulate"] else "y"}).\n\
+        -e or --backend: backend running the embeddings model, among {", ".join(EMBEDDINGS_BACKENDS)}. The onnx '
+              f'backend needs the graphs exported by src.embeddings_model.export_onnx (default={flags["backend"]}).')
         sys.exit()
 
     # Checking each argument
@@ -73,6 +76,19 @@ def parsing():
             else:
                 print("Repopulate must be either y or n.")
                 sys.exit(1)
+        elif arg in ("-e", "--backend"):
+            if val in EMBEDDINGS_BACKENDS:
+                flags["backend"] = val
+            else:
+                print(f"Backend must be among {EMBEDDINGS_BACKENDS}.")
+                sys.exit(1)
+
+    # Get the index of the embeddings collection of the dataset
+    try:
+        flags["embeddings_index"] = get_embeddings_index([d for d in datasets if d["name"] == flags["dataset"]][0])
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
 
     return flags
 
@@ -116,7 +132,8 @@ def modify_data(data: dict) -> list:
     return new_data
 
 
-def generate_low_dimensional_embeddings(entities: list, dp: DatasetPreprocessor, collection_name: str):
+def generate_low_dimensional_embeddings(entities: list, dp: DatasetPreprocessor, collection_name: str,
+                                        embeddings_index: dict | None = None):
     # Process records
     embeddings = torch.tensor([entities[i][EMBEDDING_VECTOR_FIELD_NAME] for i in range(len(entities))]).detach()
 
@@ -134,7 +151,11 @@ def generate_low_dimensional_embeddings(entities: list, dp: DatasetPreprocessor,
 
     # Create collection
     try:
-        collection = embeddings_collection(collection_name)
+        if embeddings_index is None:
+            collection = embeddings_collection(collection_name)
+        else:
+            collection = embeddings_collection(collection_name, embeddings_index["index_type"],
+                                               embeddings_index["params"])
     except Exception as e:
         print("Error in creation of embeddings collection. Error message: ", e)
         sys.exit(1)
@@ -152,6 +173,23 @@ def generate_low_dimensional_embeddings(entities: list, dp: DatasetPreprocessor,
     # Release collection
     collection.release()
 
+    # Save the embeddings to a file, which the backend memory-maps to get the embedding of an image without querying
+    # the collection
+    try:
+        save_embeddings(os.path.join(os.getenv(HOME), DATA_DIR_NAME), collection_name,
+                        [entity["index"] for entity in entities], embeddings.numpy())
+    except Exception as e:
+        print("Error in saving embeddings. Error message: ", e)
+        sys.exit(1)
+
+    # Save the metadata of the images to a file, which the backend loads to serve metadata without querying the
+    # collection
+    try:
+        save_metadata(os.path.join(os.getenv(HOME), DATA_DIR_NAME), collection_name, entities)
+    except Exception as e:
+        print("Error in saving metadata. Error message: ", e)
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     if ENV_FILE_LOCATION not in os.environ:
@@ -190,7 +228,8 @@ if __name__ == "__main__":
         # Get dataset object
         dataset = get_dataset_object(flags["dataset"])
         # Create an embedding object
-        embeddings = ClipEmbeddings(device=DEVICE)
+        embeddings = get_clip_embeddings(flags["backend"], DEVICE, onnx_model_dir=os.path.join(
+            os.getenv(HOME), DATA_DIR_NAME, ONNX_MODEL_DIR_NAME))
         # Create dataset preprocessor
         dp = DatasetPreprocessor(embeddings)
         # Get dataloader
@@ -200,7 +239,7 @@ if __name__ == "__main__":
         # Get entities
         entities = modify_data(data)
         # Generate low dimensional embeddings
-        generate_low_dimensional_embeddings(entities, dp, flags["dataset"])
+        generate_low_dimensional_embeddings(entities, dp, flags["dataset"], flags["embeddings_index"])
 
         print(f"Embeddings collection created and populated for dataset {flags['dataset']}.")
         sys.exit(0)
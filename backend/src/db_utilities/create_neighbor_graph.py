@@ -0,0 +1,149 @@
+import getopt
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .artifacts import load_embeddings, save_neighbor_graph
+from ..CONSTANTS import *
+from ..app.search_engines import top_k_search
+
+# Embeddings matrix of each worker process
+_matrix = None
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hc:k:p:"
+    # Long options
+    long_options = ["help", "collection", "neighbors", "processes"]
+
+    # Prepare flags
+    flags = {"dataset": datasets[0]["name"], "neighbors": NEIGHBOR_GRAPH_K, "processes": os.cpu_count()}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script computes the nearest neighbors of every image of a dataset from its exported embeddings.\n\
+        -c or --collection: dataset (default={flags["dataset"]}).\n\
+        -k or --neighbors: number of neighbors of each image (default={flags["neighbors"]}).\n\
+        -p or --processes: number of processes (default={flags["processes"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+        elif arg in ("-k", "--neighbors"):
+            if int(val) >= 1:
+                flags["neighbors"] = int(val)
+            else:
+                print("The number of neighbors must be greater than 0.")
+                sys.exit(1)
+        elif arg in ("-p", "--processes"):
+            if int(val) >= 1:
+                flags["processes"] = int(val)
+            else:
+                print("The number of processes must be greater than 0.")
+                sys.exit(1)
+
+    return flags
+
+
+def _init_worker(data_dir: str, dataset: str):
+    # Each worker memory-maps the embeddings, so that the matrix is shared through the page cache
+    global _matrix
+    _, _matrix = load_embeddings(data_dir, dataset)
+
+
+def _compute_block(start: int, end: int, k: int):
+    return start, *get_neighbors_of_rows(_matrix, start, end, k)
+
+
+def get_neighbors_of_rows(matrix: np.ndarray, start: int, end: int, k: int):
+    """
+    Compute the k nearest neighbors of the rows start, ..., end - 1 of the matrix, excluding the rows themselves.
+    @param matrix: matrix of L2-normalized embeddings.
+    @param start:
+    @param end:
+    @param k:
+    @return: rows and cosine similarities of the neighbors, sorted by decreasing similarity.
+    """
+    rows, scores = top_k_search(matrix, np.asarray(matrix[start:end]), k + 1, NEIGHBOR_GRAPH_BLOCK_SIZE)
+    # Remove each row from its own neighbors. If a row is not among its neighbors, because of duplicate embeddings,
+    # its last neighbor is removed instead.
+    is_neighbor = rows != np.arange(start, end)[:, None]
+    selected = np.argsort(~is_neighbor, axis=1, kind="stable")[:, :min(k, rows.shape[1] - 1)]
+    return np.take_along_axis(rows, selected, axis=1), np.take_along_axis(scores, selected, axis=1)
+
+
+def compute_neighbor_graph(data_dir: str, dataset: str, k: int, processes: int):
+    """
+    Compute the k nearest neighbors of every image of a dataset. The rows of the embeddings matrix are split in blocks
+    of NEIGHBOR_GRAPH_QUERY_BLOCK_SIZE rows, which are processed in parallel.
+    @param data_dir: data directory.
+    @param dataset: name of the dataset.
+    @param k: number of neighbors of each image.
+    @param processes: number of processes.
+    @return: indexes and cosine similarities of the neighbors of each image.
+    """
+    ids, matrix = load_embeddings(data_dir, dataset)
+    k = min(k, len(ids) - 1)
+    neighbor_rows = np.empty((len(ids), k), dtype=np.int64)
+    neighbor_scores = np.empty((len(ids), k), dtype=np.float32)
+
+    blocks = [(start, min(start + NEIGHBOR_GRAPH_QUERY_BLOCK_SIZE, len(ids)), k)
+              for start in range(0, len(ids), NEIGHBOR_GRAPH_QUERY_BLOCK_SIZE)]
+    with Pool(processes, initializer=_init_worker, initargs=(data_dir, dataset)) as pool:
+        for i, (start, rows, scores) in enumerate(pool.starmap(_compute_block, blocks)):
+            neighbor_rows[start:start + len(rows)] = rows
+            neighbor_scores[start:start + len(rows)] = scores
+            print(f"Computed neighbors of block {i + 1}/{len(blocks)}.")
+
+    return ids[neighbor_rows], neighbor_scores
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    # Get arguments
+    flags = parsing()
+
+    data_dir = os.path.join(os.getenv(HOME), DATA_DIR_NAME)
+    try:
+        neighbor_indexes, neighbor_scores = compute_neighbor_graph(data_dir, flags["dataset"], flags["neighbors"],
+                                                                   flags["processes"])
+        save_neighbor_graph(data_dir, flags["dataset"], neighbor_indexes, neighbor_scores)
+    except OSError as e:
+        print(f"The embeddings of {flags['dataset']} could not be read. Run src.db_utilities.export_artifacts. "
+              f"Error message: ", e)
+        sys.exit(1)
+    except Exception as e:
+        print("Error in compute_neighbor_graph. Error message: ", e)
+        sys.exit(1)
+
+    print(f"Neighbor graph created for dataset {flags['dataset']}.")
+    sys.exit(0)
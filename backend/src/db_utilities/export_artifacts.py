@@ -0,0 +1,182 @@
+import getopt
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+from pymilvus import db, Collection, utility
+
+from .artifacts import save_first_tiles, save_embeddings, save_metadata
+from .collections import EMBEDDING_VECTOR_FIELD_NAME
+from .utils import create_connection
+from ..CONSTANTS import *
+
+ARTIFACTS = ["first_tiles", "embeddings", "metadata"]
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hd:c:a:"
+    # Long options
+    long_options = ["help", "database", "collection", "artifacts"]
+
+    # Prepare flags
+    flags = {"database": DEFAULT_DATABASE_NAME, "dataset": datasets[0]["name"], "artifacts": ARTIFACTS}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script exports the files generated for a dataset from its existing collections.\n\
+        -d or --database: database name (default={flags["database"]}).\n\
+        -c or --collection: dataset (default={flags["dataset"]}).\n\
+        -a or --artifacts: comma separated list of files to export, among {ARTIFACTS} (default=all).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-d", "--database"):
+            flags["database"] = val
+        elif arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+        elif arg in ("-a", "--artifacts"):
+            flags["artifacts"] = val.split(",")
+            for artifact in flags["artifacts"]:
+                if artifact not in ARTIFACTS:
+                    print(f"Unknown artifact {artifact}. Artifacts must be among {ARTIFACTS}.")
+                    sys.exit(1)
+
+    return flags
+
+
+def export_first_tiles(data_dir: str, dataset: str):
+    collection_name = dataset + "_zoom_levels_clusters"
+    if not utility.has_collection(collection_name):
+        print(f"The collection {collection_name}, which is needed for exporting the first tiles, does not exist.")
+        sys.exit(1)
+
+    collection = Collection(collection_name)
+    collection.load()
+    try:
+        # The first zoom levels contain 4^0 + 4^1 + ... + 4^FIRST_TILES_MAX_ZOOM_LEVEL tiles
+        limit = min(collection.num_entities, sum([4 ** zoom for zoom in range(FIRST_TILES_MAX_ZOOM_LEVEL + 1)]))
+        tiles = []
+        for i in range(0, limit, SEARCH_LIMIT):
+            tiles += collection.query(
+                expr=f"index in {list(range(i, min(i + SEARCH_LIMIT, limit)))}",
+                output_fields=["index", "data", "range"]
+            )
+        save_first_tiles(data_dir, dataset, [dict(tile) for tile in tiles])
+    except Exception as e:
+        print("Error in export_first_tiles. Error message: ", e)
+        sys.exit(1)
+    finally:
+        collection.release()
+
+    print(f"First tiles exported for dataset {dataset}.")
+
+
+def export_embeddings(data_dir: str, dataset: str):
+    if not utility.has_collection(dataset):
+        print(f"The collection {dataset}, which is needed for exporting the embeddings, does not exist.")
+        sys.exit(1)
+
+    collection = Collection(dataset)
+    collection.load()
+    try:
+        # Iterate over all the entities of the collection
+        indexes = []
+        embeddings = []
+        iterator = collection.query_iterator(batch_size=SEARCH_LIMIT // 4, expr="index >= 0",
+                                             output_fields=["index", EMBEDDING_VECTOR_FIELD_NAME])
+        while True:
+            entities = iterator.next()
+            if len(entities) == 0:
+                iterator.close()
+                break
+            for entity in entities:
+                indexes.append(entity["index"])
+                embeddings.append(entity[EMBEDDING_VECTOR_FIELD_NAME])
+        save_embeddings(data_dir, dataset, indexes, embeddings)
+    except Exception as e:
+        print("Error in export_embeddings. Error message: ", e)
+        sys.exit(1)
+    finally:
+        collection.release()
+
+    print(f"Embeddings exported for dataset {dataset}.")
+
+
+def export_metadata(data_dir: str, dataset: str):
+    if not utility.has_collection(dataset):
+        print(f"The collection {dataset}, which is needed for exporting the metadata, does not exist.")
+        sys.exit(1)
+
+    collection = Collection(dataset)
+    collection.load()
+    try:
+        # Iterate over all the entities of the collection
+        entities = []
+        iterator = collection.query_iterator(batch_size=SEARCH_LIMIT // 4, expr="index >= 0", output_fields=["*"])
+        while True:
+            batch = iterator.next()
+            if len(batch) == 0:
+                iterator.close()
+                break
+            for entity in batch:
+                # Drop the embedding, which is exported separately
+                entity = dict(entity)
+                entity.pop(EMBEDDING_VECTOR_FIELD_NAME, None)
+                entities.append(entity)
+        save_metadata(data_dir, dataset, entities)
+    except Exception as e:
+        print("Error in export_metadata. Error message: ", e)
+        sys.exit(1)
+    finally:
+        collection.release()
+
+    print(f"Metadata exported for dataset {dataset}.")
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    # Get arguments
+    flags = parsing()
+
+    # Try creating a connection and selecting a database. If it fails, exit.
+    try:
+        create_connection(ROOT_USER, ROOT_PASSWD, False)
+        db.using_database(flags["database"])
+    except Exception as e:
+        print("Error in main. Connection failed. Error: ", e)
+        sys.exit(1)
+
+    # Export files
+    data_dir = os.path.join(os.getenv(HOME), DATA_DIR_NAME)
+    if "first_tiles" in flags["artifacts"]:
+        export_first_tiles(data_dir, flags["dataset"])
+    if "embeddings" in flags["artifacts"]:
+        export_embeddings(data_dir, flags["dataset"])
+    if "metadata" in flags["artifacts"]:
+        export_metadata(data_dir, flags["dataset"])
+    sys.exit(0)
@@ -0,0 +1,102 @@
+import getopt
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+from pymilvus import db, Collection, utility
+
+from .collections import create_embeddings_index, get_embeddings_index
+from .utils import create_connection
+from ..CONSTANTS import *
+
+
+def parsing():
+    # Load dataset options from datasets.json
+    with open(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), "r") as f:
+        datasets = json.load(f)["datasets"]
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "hd:c:"
+    # Long options
+    long_options = ["help", "database", "collection"]
+
+    # Prepare flags
+    flags = {"database": DEFAULT_DATABASE_NAME, "dataset": datasets[0]["name"]}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script rebuilds the index of the embeddings collection of a dataset with the index type and the '
+              f'parameters given in the "embeddings_index" field of its entry in datasets.json. The collection is not '
+              f'available for searches while the index is built.\n\
+        -d or --database: database name (default={flags["database"]}).\n\
+        -c or --collection: dataset (default={flags["dataset"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-d", "--database"):
+            flags["database"] = val
+        elif arg in ("-c", "--collection"):
+            if val in [d["name"] for d in datasets]:
+                flags["dataset"] = val
+            else:
+                print("Dataset not found.")
+                sys.exit(1)
+
+    # Get the index of the embeddings collection of the dataset
+    try:
+        flags["embeddings_index"] = get_embeddings_index([d for d in datasets if d["name"] == flags["dataset"]][0])
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    return flags
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    # Get arguments
+    flags = parsing()
+
+    # Try creating a connection and selecting a database. If it fails, exit.
+    try:
+        create_connection(ROOT_USER, ROOT_PASSWD, False)
+        db.using_database(flags["database"])
+    except Exception as e:
+        print("Error in main. Connection failed. Error: ", e)
+        sys.exit(1)
+
+    if not utility.has_collection(flags["dataset"]):
+        print(f"The collection {flags['dataset']} does not exist.")
+        sys.exit(1)
+
+    try:
+        collection = Collection(flags["dataset"])
+        # An index can only be dropped from a released collection
+        collection.release()
+        collection.drop_index()
+        create_embeddings_index(collection, flags["embeddings_index"]["index_type"],
+                                flags["embeddings_index"]["params"])
+        utility.wait_for_index_building_complete(flags["dataset"])
+        collection.load()
+    except Exception as e:
+        print("Error in rebuilding the index. Error message: ", e)
+        sys.exit(1)
+
+    print(f"Index {flags['embeddings_index']['index_type']} built for dataset {flags['dataset']}.")
+    sys.exit(0)
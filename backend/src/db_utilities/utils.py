@@ -10,18 +10,22 @@ from sklearn.metrics import euclidean_distances
 from ..CONSTANTS import *
 
 
+def load_environment():
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+
 def create_connection(user, passwd, load_vars=True):
     if load_vars:
-        if ENV_FILE_LOCATION not in os.environ:
-            # Try to load /.env file
-            if os.path.exists("/.env"):
-                load_dotenv("/.env")
-            else:
-                print("export .env file location as ENV_FILE_LOCATION.")
-                sys.exit(1)
-        else:
-            # Load environment variables
-            load_dotenv(os.getenv(ENV_FILE_LOCATION))
+        load_environment()
 
     connections.connect(
         host=os.getenv(MILVUS_IP),
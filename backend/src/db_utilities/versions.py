@@ -0,0 +1,76 @@
+"""
+Module for recording the version of the data of each dataset. Every build of the clusters, image-to-tile and UMAP
+collections of a dataset records a version hash of the content of the build in the "versions" field of the entry of the
+dataset in datasets.json, e.g. {"clusters": "3f2a...", "image_to_tile": "9c1e...", "umap": "b4d0..."}. The app derives
+the ETags of the data served for a dataset from these hashes, so that conditional requests are answered without
+querying Milvus, and a rebuild producing the same content keeps the caches of the clients valid.
+"""
+import hashlib
+import json
+
+# Define kinds of versioned data
+VERSION_KINDS = ["clusters", "image_to_tile", "umap"]
+# Define kinds of data shared by all the datasets. Only the dataset the data was last built from has their version.
+SHARED_VERSION_KINDS = ["umap"]
+
+
+def compute_version(*parts) -> str:
+    """
+    Compute the version hash of the content of a build.
+    @param parts: JSON-serializable values with the content of the build.
+    @return: hexadecimal hash.
+    """
+    data = json.dumps(parts, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+
+class ContentVersion:
+    """
+    Version hash of the content of a build, computed while its entities are inserted. The hash does not depend on the
+    order in which the entities are added, so that builds inserting the same entities in another order get the same
+    version. Only the sum of the hashes of the entities is kept, so that the entities do not need to stay in memory.
+    """
+
+    def __init__(self):
+        self._sum = 0
+        self.count = 0
+
+    def add(self, entity):
+        """
+        Add an entity of the build.
+        @param entity: JSON-serializable value.
+        @return:
+        """
+        data = json.dumps(entity, separators=(",", ":"), sort_keys=True, default=str)
+        self._sum = (self._sum + int(hashlib.sha256(data.encode("utf-8")).hexdigest(), 16)) % 2 ** 256
+        self.count += 1
+
+    def hexdigest(self) -> str:
+        return compute_version(hex(self._sum), self.count)
+
+
+def save_dataset_version(datasets_json_path: str, dataset: str, kind: str, version: str):
+    """
+    Record the version of the data of a dataset in datasets.json. The version of shared data is removed from the other
+    datasets. The file is written in place, as it is mounted in the backend container, which parses it again when its
+    modification time changes.
+    @param datasets_json_path: path of datasets.json.
+    @param dataset: name of the dataset.
+    @param kind: kind of data, among VERSION_KINDS.
+    @param version: version hash.
+    @return:
+    """
+    if kind not in VERSION_KINDS:
+        raise ValueError(f"kind must be in {VERSION_KINDS}")
+    with open(datasets_json_path, "r") as f:
+        datasets = json.load(f)["datasets"]
+    if dataset not in [entry["name"] for entry in datasets]:
+        raise ValueError(f"Dataset {dataset} not found in {datasets_json_path}.")
+    for entry in datasets:
+        if entry["name"] == dataset:
+            entry.setdefault("versions", {})[kind] = version
+        elif kind in SHARED_VERSION_KINDS:
+            # The shared data has been rebuilt from another dataset, so the version of the previous build is stale
+            entry.get("versions", {}).pop(kind, None)
+    with open(datasets_json_path, "w") as f:
+        json.dump({"datasets": datasets}, f, indent=4)
@@ -1,16 +1,61 @@
 from abc import ABC
+from io import BytesIO
 
 import torch
 from transformers import CLIPProcessor, CLIPModel
 
 from ..CONSTANTS import *
+from ..metrics import INFERENCE_DURATION, INFERENCE_BATCH_SIZE
 from .EmbeddingsModel import EmbeddingsModel
 
 
+def quantize_text_encoder(model: CLIPModel) -> CLIPModel:
+    """
+    Quantize the linear layers of the text encoder of a CLIP model to int8, in place. Weights are quantized ahead of
+    time and activations are quantized dynamically at each forward pass. The image encoder is left in fp32.
+    :param model: CLIP model on the CPU.
+    :return: The same model.
+    """
+    # Select the linear layers by name, as the embedding layers of the text encoder can not be quantized dynamically
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name.split(".")[0] in ("text_model", "text_projection")
+    }
+    return torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8, inplace=True)
+
+
+def get_text_encoder_size(model: CLIPModel) -> int:
+    """
+    Return the size in bytes of the weights of the text encoder of a CLIP model. Quantized weights are packed and are
+    not parameters of the model, so the size is the one of the serialized state dicts.
+    :param model: CLIP model.
+    :return: Size in bytes.
+    """
+    size = 0
+    for module in (model.text_model, model.text_projection):
+        buffer = BytesIO()
+        torch.save(module.state_dict(), buffer)
+        size += buffer.tell()
+    return size
+
+
 class ClipEmbeddings(EmbeddingsModel, ABC):
-    def __init__(self, device):
+    def __init__(self, device, text_precision=DEFAULT_TEXT_ENCODER_PRECISION):
+        """
+        :param device: Device of the model.
+        :param text_precision: Precision of the text encoder, one of TEXT_ENCODER_PRECISIONS. The int8 text encoder is
+        only available on the CPU.
+        """
+        if text_precision not in TEXT_ENCODER_PRECISIONS:
+            raise ValueError(f"Unknown text encoder precision {text_precision}, expected one of "
+                             f"{', '.join(TEXT_ENCODER_PRECISIONS)}.")
+        if text_precision == "int8" and device != "cpu":
+            raise ValueError("The int8 text encoder is only available on the CPU.")
         self.device = device
-        self.model = CLIPModel.from_pretrained(CLIP_MODEL).to(self.device)
+        self.text_precision = text_precision
+        self.model = CLIPModel.from_pretrained(CLIP_MODEL).to(self.device).eval()
+        if text_precision == "int8":
+            quantize_text_encoder(self.model)
         self.processor = CLIPProcessor.from_pretrained(CLIP_MODEL, )
         self.cosine_similarity = torch.nn.CosineSimilarity()
 
@@ -27,19 +72,23 @@ class ClipEmbeddings(EmbeddingsModel, ABC):
 
     def getTextEmbeddings(self, text):
         try:
-            # Get text inputs
-            inputs = self.processor(text, padding=True, truncation=True, return_tensors="pt").to(self.device)
-            # Return _embeddings
-            return self.model.get_text_features(**inputs)
+            INFERENCE_BATCH_SIZE.labels("text").observe(len(text) if isinstance(text, list) else 1)
+            with INFERENCE_DURATION.labels("text").time():
+                # Get text inputs
+                inputs = self.processor(text, padding=True, truncation=True, return_tensors="pt").to(self.device)
+                # Return _embeddings
+                return self.model.get_text_features(**inputs)
         except Exception as e:
             print(e.__str__())
 
     def getImageEmbeddings(self, image):
         try:
-            # Get image inputs
-            inputs = self.processor(images=image, return_tensors="pt").to(self.device)
-            # Return _embeddings
-            return self.model.get_image_features(**inputs)
+            INFERENCE_BATCH_SIZE.labels("image").observe(len(image) if isinstance(image, list) else 1)
+            with INFERENCE_DURATION.labels("image").time():
+                # Get image inputs
+                inputs = self.processor(images=image, return_tensors="pt").to(self.device)
+                # Return _embeddings
+                return self.model.get_image_features(**inputs)
         except Exception as e:
             print(e.__str__())
 
@@ -1,8 +1,24 @@
+from __future__ import annotations
+
 import typing
 from abc import ABC, abstractmethod
 
 import numpy as np
-import torch
+
+if typing.TYPE_CHECKING:
+    # torch is only imported by the models, so that importing the interface is fast
+    import torch
+
+
+def to_numpy(embeddings: torch.Tensor | np.ndarray) -> np.ndarray:
+    """
+    Convert the embeddings returned by a model to a float32 array.
+    :param embeddings: Tensor or array of embeddings.
+    :return: Array of embeddings.
+    """
+    if hasattr(embeddings, "detach"):
+        embeddings = embeddings.detach().cpu().numpy()
+    return np.asarray(embeddings, dtype=np.float32)
 
 
 class EmbeddingsModel(ABC):
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+import typing
+from abc import ABC
+from concurrent.futures import Future
+
+if typing.TYPE_CHECKING:
+    import torch
+
+from ..CONSTANTS import *
+from .EmbeddingsModel import EmbeddingsModel
+
+
+class _MicroBatcher:
+    """
+    Collect the inputs submitted by concurrent threads and process them together. A batch is closed when it reaches
+    max_batch_size inputs, or when window seconds have passed since its first input arrived. If the processing of a
+    batch fails, its inputs are processed one by one, so that only the requests with invalid inputs fail.
+    """
+
+    def __init__(self, process_batch, window: float, max_batch_size: int, name: str):
+        """
+        :param process_batch: function mapping a list of inputs to a tensor or an array with one row per input.
+        :param window: maximum time in seconds an input waits for other inputs.
+        :param max_batch_size: maximum number of inputs in a batch.
+        :param name: name of the worker thread.
+        """
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._queue = queue.Queue()
+        # Define counters
+        self.batches = 0
+        self.inputs = 0
+        # Start worker thread
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, data) -> torch.Tensor:
+        """
+        Add an input to the next batch and wait for its result.
+        :param data: Input.
+        :return: Tensor or array of shape (1, ...) with the result for the input.
+        """
+        future = Future()
+        self._queue.put((data, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            # Wait for the first input of the batch
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            # Collect inputs until the batch is full or the window is over
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            self.batches += 1
+            self.inputs += len(batch)
+            try:
+                results = self.process_batch([data for data, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    # Process the inputs one by one, so that an invalid input only fails its own request
+                    self._process_separately(batch)
+                continue
+            for i, (_, future) in enumerate(batch):
+                future.set_result(results[i:i + 1])
+
+    def _process_separately(self, batch: list):
+        for data, future in batch:
+            try:
+                future.set_result(self.process_batch([data])[0:1])
+            except Exception as e:
+                future.set_exception(e)
+
+
+class MicroBatchingEmbeddings(EmbeddingsModel, ABC):
+    """
+    Embeddings model that batches the requests of concurrent threads. Single texts and single images submitted within
+    a short window are embedded with one forward pass of the wrapped model, and each caller receives its own row.
+    """
+
+    def __init__(self, embeddings_model: EmbeddingsModel, window: float = INFERENCE_BATCHING_WINDOW,
+                 max_batch_size: int = INFERENCE_MAX_BATCH_SIZE):
+        """
+        :param embeddings_model: Model used for the forward passes.
+        :param window: Maximum time in seconds a request waits for other requests.
+        :param max_batch_size: Maximum number of requests in a forward pass.
+        """
+        self.embeddings_model = embeddings_model
+        self._text_batcher = _MicroBatcher(self._embed_texts, window, max_batch_size, "text-batcher")
+        self._image_batcher = _MicroBatcher(self._embed_images, window, max_batch_size, "image-batcher")
+
+    def _embed_texts(self, texts):
+        embeddings = self.embeddings_model.getTextEmbeddings(texts)
+        if embeddings is None:
+            raise RuntimeError("Text embeddings could not be computed.")
+        return embeddings.detach() if hasattr(embeddings, "detach") else embeddings
+
+    def _embed_images(self, images):
+        embeddings = self.embeddings_model.getImageEmbeddings(images)
+        if embeddings is None:
+            raise RuntimeError("Image embeddings could not be computed.")
+        return embeddings.detach() if hasattr(embeddings, "detach") else embeddings
+
+    def getSimilarityScore(self, emb1, emb2):
+        return self.embeddings_model.getSimilarityScore(emb1, emb2)
+
+    def getTextEmbeddings(self, text):
+        # Lists of texts are already batched by the caller
+        if isinstance(text, list):
+            return self.embeddings_model.getTextEmbeddings(text)
+        return self._text_batcher.submit(text)
+
+    def getImageEmbeddings(self, image):
+        # Lists of images are already batched by the caller
+        if isinstance(image, list):
+            return self.embeddings_model.getImageEmbeddings(image)
+        return self._image_batcher.submit(image)
+
+    def processData(self, data):
+        return self.embeddings_model.processData(data)
+
+    def getEmbeddings(self, inputs):
+        return self.embeddings_model.getEmbeddings(inputs)
+
+    def stats(self) -> dict:
+        return {
+            "text": {"batches": self._text_batcher.batches, "inputs": self._text_batcher.inputs},
+            "image": {"batches": self._image_batcher.batches, "inputs": self._image_batcher.inputs}
+        }
@@ -0,0 +1,95 @@
+import os
+from abc import ABC
+
+import numpy as np
+import onnxruntime
+from transformers import CLIPProcessor
+
+from ..CONSTANTS import *
+from ..metrics import INFERENCE_DURATION, INFERENCE_BATCH_SIZE
+from .EmbeddingsModel import EmbeddingsModel
+
+
+def create_session(path: str, intra_op_threads: int = DEFAULT_ONNX_INTRA_OP_THREADS) -> onnxruntime.InferenceSession:
+    """
+    Create an ONNX Runtime session on the CPU for an exported graph.
+    :param path: Path of the graph.
+    :param intra_op_threads: Number of threads used within an operator. 0 lets ONNX Runtime use one thread per physical
+    core.
+    :return: Session.
+    """
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # The towers are sequences of operators, so parallelism comes from the threads within each operator
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = 1
+    return onnxruntime.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+class OnnxClipEmbeddings(EmbeddingsModel, ABC):
+    """
+    CLIP model whose text and image towers run as ONNX graphs under ONNX Runtime. The graphs and the processor are
+    exported by src.embeddings_model.export_onnx. Embeddings are returned as float32 arrays.
+    """
+
+    def __init__(self, model_dir, intra_op_threads=DEFAULT_ONNX_INTRA_OP_THREADS):
+        """
+        :param model_dir: Directory with the exported graphs and processor.
+        :param intra_op_threads: Number of threads used within an operator by each tower. 0 lets ONNX Runtime use one
+        thread per physical core.
+        """
+        self.model_dir = model_dir
+        self.processor = CLIPProcessor.from_pretrained(model_dir)
+        self.text_session = create_session(os.path.join(model_dir, ONNX_TEXT_MODEL_FILE_NAME), intra_op_threads)
+        self.image_session = create_session(os.path.join(model_dir, ONNX_IMAGE_MODEL_FILE_NAME), intra_op_threads)
+
+    def getSimilarityScore(self, emb1, emb2):
+        """
+        Return the cosine similarity between the two _embeddings.
+        :param emb1: First embedding.
+        :param emb2: Second embedding.
+        :return: Cosine similarity.
+        """
+        assert emb1.shape == emb2.shape
+        emb1 = np.asarray(emb1, dtype=np.float32)
+        emb2 = np.asarray(emb2, dtype=np.float32)
+        # Return cosine similarity between _embeddings, along the same dimension as torch.nn.CosineSimilarity
+        return np.sum(emb1 * emb2, axis=1) / np.maximum(np.linalg.norm(emb1, axis=1) * np.linalg.norm(emb2, axis=1),
+                                                         1e-8)
+
+    def getTextEmbeddings(self, text):
+        try:
+            INFERENCE_BATCH_SIZE.labels("text").observe(len(text) if isinstance(text, list) else 1)
+            with INFERENCE_DURATION.labels("text").time():
+                # Get text inputs
+                inputs = self.processor(text=text, padding=True, truncation=True, return_tensors="np")
+                # Return _embeddings
+                return self.text_session.run(None, {
+                    "input_ids": inputs["input_ids"].astype(np.int64),
+                    "attention_mask": inputs["attention_mask"].astype(np.int64)
+                })[0]
+        except Exception as e:
+            print(e.__str__())
+
+    def getImageEmbeddings(self, image):
+        try:
+            INFERENCE_BATCH_SIZE.labels("image").observe(len(image) if isinstance(image, list) else 1)
+            with INFERENCE_DURATION.labels("image").time():
+                # Return _embeddings
+                return self.getEmbeddings(self.processData(image))
+        except Exception as e:
+            print(e.__str__())
+
+    def processData(self, data):
+        # Return inputs for CLIP embeddings_model
+        try:
+            return self.processor(images=data, return_tensors="np")
+        except Exception as e:
+            print(e.__str__())
+
+    def getEmbeddings(self, inputs):
+        # Return _embeddings. The inputs can be tensors collated by a data loader.
+        return self.image_session.run(None, {
+            "pixel_values": np.asarray(inputs["pixel_values"], dtype=np.float32)
+        })[0]
@@ -0,0 +1,103 @@
+import queue
+import time
+from abc import ABC
+from multiprocessing.connection import Client, Connection
+
+import numpy as np
+
+from ..CONSTANTS import *
+from .EmbeddingsModel import EmbeddingsModel
+
+
+class RemoteEmbeddings(EmbeddingsModel, ABC):
+    """
+    Embeddings model running in the embeddings service, src.embeddings_model.embeddings_service, shared by the workers
+    of the backend. Each call uses its own connection to the service, so that concurrent calls are batched together by
+    the service. Embeddings are returned as float32 arrays.
+    """
+
+    def __init__(self, address, authkey=None, max_connections=EMBEDDINGS_SERVICE_MAX_CONNECTIONS):
+        """
+        :param address: Path of the Unix socket of the service.
+        :param authkey: Key used to authenticate with the service.
+        :param max_connections: Maximum number of idle connections kept open.
+        """
+        self.address = address
+        self.authkey = authkey
+        self._connections = queue.LifoQueue(maxsize=max_connections)
+
+    def wait(self, timeout=EMBEDDINGS_SERVICE_CONNECT_TIMEOUT):
+        """
+        Wait until the service accepts connections, e.g. while it loads the model.
+        :param timeout: Maximum time to wait in seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._release(Client(self.address, authkey=self.authkey))
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Embeddings service at {self.address} not available after {timeout} s.")
+                time.sleep(1)
+
+    def _acquire(self) -> Connection:
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            return Client(self.address, authkey=self.authkey)
+
+    def _release(self, connection: Connection):
+        try:
+            self._connections.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _request(self, kind: str, data) -> np.ndarray:
+        # Retry once with a new connection, as idle connections are closed if the service restarts
+        for attempt in range(2):
+            connection = self._acquire()
+            try:
+                connection.send((kind, data))
+                status, result = connection.recv()
+            except (EOFError, OSError):
+                connection.close()
+                if attempt == 1:
+                    raise
+                continue
+            self._release(connection)
+            if status != "ok":
+                raise RuntimeError(result)
+            return result
+
+    def getSimilarityScore(self, emb1, emb2):
+        """
+        Return the cosine similarity between the two _embeddings.
+        :param emb1: First embedding.
+        :param emb2: Second embedding.
+        :return: Cosine similarity.
+        """
+        assert emb1.shape == emb2.shape
+        emb1 = np.asarray(emb1, dtype=np.float32)
+        emb2 = np.asarray(emb2, dtype=np.float32)
+        return np.sum(emb1 * emb2, axis=1) / np.maximum(np.linalg.norm(emb1, axis=1) * np.linalg.norm(emb2, axis=1),
+                                                         1e-8)
+
+    def getTextEmbeddings(self, text):
+        try:
+            return self._request("text", text)
+        except Exception as e:
+            print(e.__str__())
+
+    def getImageEmbeddings(self, image):
+        try:
+            return self._request("image", image)
+        except Exception as e:
+            print(e.__str__())
+
+    def processData(self, data):
+        # Images are processed by the service
+        return data
+
+    def getEmbeddings(self, inputs):
+        return self.getImageEmbeddings(inputs)
@@ -0,0 +1,30 @@
+import os
+
+from ..CONSTANTS import *
+from .EmbeddingsModel import EmbeddingsModel
+
+
+def get_clip_embeddings(backend: str = DEFAULT_EMBEDDINGS_BACKEND, device: str = DEVICE,
+                        text_precision: str = DEFAULT_TEXT_ENCODER_PRECISION, onnx_model_dir: str | None = None,
+                        onnx_intra_op_threads: int = DEFAULT_ONNX_INTRA_OP_THREADS) -> EmbeddingsModel:
+    """
+    Create the CLIP model running on the given backend. The backends are imported lazily, so that only the selected
+    one needs to be installed.
+    :param backend: One of EMBEDDINGS_BACKENDS.
+    :param device: Device of the torch backend. The onnx backend runs on the CPU.
+    :param text_precision: Precision of the text encoder of the torch backend, one of TEXT_ENCODER_PRECISIONS.
+    :param onnx_model_dir: Directory with the graphs exported by src.embeddings_model.export_onnx.
+    :param onnx_intra_op_threads: Number of threads used within an operator by the onnx backend.
+    :return: Embeddings model.
+    """
+    if backend == "torch":
+        from .CLIPEmbeddings import ClipEmbeddings
+        return ClipEmbeddings(device, text_precision)
+    elif backend == "onnx":
+        if text_precision != DEFAULT_TEXT_ENCODER_PRECISION:
+            raise ValueError(f"The {text_precision} text encoder is only available with the torch backend.")
+        if onnx_model_dir is None or not os.path.exists(onnx_model_dir):
+            raise ValueError(f"ONNX model not found in {onnx_model_dir}. Run src.embeddings_model.export_onnx.")
+        from .OnnxClipEmbeddings import OnnxClipEmbeddings
+        return OnnxClipEmbeddings(onnx_model_dir, onnx_intra_op_threads)
+    raise ValueError(f"Unknown embeddings backend {backend}, expected one of {', '.join(EMBEDDINGS_BACKENDS)}.")
@@ -0,0 +1,156 @@
+import getopt
+import os
+import sys
+import threading
+from multiprocessing.connection import Listener, Connection
+
+from dotenv import load_dotenv
+
+from ..CONSTANTS import *
+from ..app.CONSTANTS import DATA_DIR_PATH
+from .EmbeddingsModel import EmbeddingsModel, to_numpy
+
+
+class EmbeddingsService:
+    """
+    Service owning the embeddings model shared by the workers of the backend. Each connection is served by its own
+    thread and carries one request at a time. Requests are tuples (kind, data), where kind is "text" or "image" and
+    data is a text, an image, or a list of them. Responses are tuples ("ok", embeddings) or ("error", message).
+    Single inputs are submitted to the model one by one, so that a MicroBatchingEmbeddings model batches the requests
+    of all the workers together.
+    """
+
+    def __init__(self, model: EmbeddingsModel, address: str, authkey: bytes | None = None):
+        """
+        :param model: Embeddings model.
+        :param address: Path of the Unix socket.
+        :param authkey: Key the clients must authenticate with. If None, clients are not authenticated.
+        """
+        self.model = model
+        self.address = address
+        # Remove the socket left by a previous run
+        if os.path.exists(address):
+            os.remove(address)
+        self._listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        self._closed = False
+
+    def serve_forever(self):
+        while not self._closed:
+            try:
+                connection = self._listener.accept()
+            except Exception as e:
+                if self._closed:
+                    break
+                # Clients failing the authentication are rejected
+                print("Error in accepting a connection. Error message: ", e)
+                continue
+            threading.Thread(target=self._serve, args=(connection,), name="embeddings-connection", daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        self._listener.close()
+
+    def embed(self, kind: str, data):
+        """
+        Embed the texts or the images of a request.
+        :param kind: "text" or "image".
+        :param data: Text, image, or list of them.
+        :return: Embeddings as a float32 array.
+        """
+        if kind == "text":
+            embed = self.model.getTextEmbeddings
+        elif kind == "image":
+            embed = self.model.getImageEmbeddings
+        else:
+            raise ValueError(f"Unknown request kind {kind}.")
+        # Lists with a single input are submitted as single inputs, so that they are batched with other requests
+        embeddings = embed(data[0]) if isinstance(data, list) and len(data) == 1 else embed(data)
+        if embeddings is None:
+            raise RuntimeError(f"{kind.capitalize()} embeddings could not be computed.")
+        return to_numpy(embeddings)
+
+    def _serve(self, connection: Connection):
+        with connection:
+            while True:
+                try:
+                    kind, data = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = ("ok", self.embed(kind, data))
+                except Exception as e:
+                    response = ("error", str(e))
+                try:
+                    connection.send(response)
+                except OSError:
+                    return
+
+
+def parsing():
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "ha:e:"
+    # Long options
+    long_options = ["help", "address=", "backend="]
+
+    # Prepare flags
+    flags = {"address": os.getenv(EMBEDDINGS_SERVICE, DEFAULT_EMBEDDINGS_SERVICE_ADDRESS),
+             "backend": os.getenv(EMBEDDINGS_BACKEND, DEFAULT_EMBEDDINGS_BACKEND)}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script runs the embeddings model in a service shared by the workers of the backend, which connect '
+              f'to it when EMBEDDINGS_SERVICE is set to the address of the service. Clients authenticate with the key '
+              f'in EMBEDDINGS_SERVICE_AUTHKEY, if set.\n\
+        -a or --address: path of the Unix socket (default={flags["address"]}).\n\
+        -e or --backend: backend running the embeddings model, among {", ".join(EMBEDDINGS_BACKENDS)} '
+              f'(default={flags["backend"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-a", "--address"):
+            flags["address"] = val
+        elif arg in ("-e", "--backend"):
+            if val in EMBEDDINGS_BACKENDS:
+                flags["backend"] = val
+            else:
+                print(f"Backend must be among {EMBEDDINGS_BACKENDS}.")
+                sys.exit(1)
+
+    return flags
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION in os.environ:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    # Get arguments
+    flags = parsing()
+
+    from .MicroBatchingEmbeddings import MicroBatchingEmbeddings
+    from .backends import get_clip_embeddings
+
+    try:
+        # Requests of all the workers arriving within INFERENCE_BATCHING_WINDOW seconds are embedded with a single
+        # forward pass
+        model = MicroBatchingEmbeddings(
+            get_clip_embeddings(flags["backend"], DEVICE,
+                                os.getenv(TEXT_ENCODER_PRECISION, DEFAULT_TEXT_ENCODER_PRECISION),
+                                os.path.join(DATA_DIR_PATH, ONNX_MODEL_DIR_NAME),
+                                int(os.getenv(ONNX_INTRA_OP_THREADS, DEFAULT_ONNX_INTRA_OP_THREADS))),
+            INFERENCE_BATCHING_WINDOW, INFERENCE_MAX_BATCH_SIZE
+        )
+    except Exception as e:
+        print("Error in loading the embeddings model. Error message: ", e)
+        sys.exit(1)
+
+    authkey = os.getenv(EMBEDDINGS_SERVICE_AUTHKEY)
+    service = EmbeddingsService(model, flags["address"], authkey.encode() if authkey else None)
+    print(f"Embeddings service listening on {flags['address']}.")
+    service.serve_forever()
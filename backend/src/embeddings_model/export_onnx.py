@@ -0,0 +1,148 @@
+import getopt
+import os
+import sys
+
+import numpy as np
+import torch
+from dotenv import load_dotenv
+from transformers import CLIPModel, CLIPProcessor
+
+from ..CONSTANTS import *
+
+
+class TextEncoder(torch.nn.Module):
+    """
+    Text tower of a CLIP model, with the same outputs as CLIPModel.get_text_features.
+    """
+
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        outputs = self.model.text_model(input_ids=input_ids, attention_mask=attention_mask)
+        return self.model.text_projection(outputs.pooler_output)
+
+
+class ImageEncoder(torch.nn.Module):
+    """
+    Image tower of a CLIP model, with the same outputs as CLIPModel.get_image_features.
+    """
+
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        outputs = self.model.vision_model(pixel_values=pixel_values)
+        return self.model.visual_projection(outputs.pooler_output)
+
+
+def export_onnx(output_dir: str, model_name: str = CLIP_MODEL, opset: int = ONNX_OPSET,
+                local_files_only: bool = True) -> float | None:
+    """
+    Export the text and image towers of a CLIP model to ONNX graphs, and save its processor next to them, so that
+    OnnxClipEmbeddings does not need the weights of the model.
+    :param output_dir: Directory of the graphs and of the processor.
+    :param model_name: Name of the model.
+    :param opset: ONNX opset of the graphs.
+    :param local_files_only: Whether to load the model from the local Hugging Face cache only.
+    :return: Largest absolute difference between the embeddings of the graphs and of the model on sample inputs, or
+    None if ONNX Runtime is not installed.
+    """
+    model = CLIPModel.from_pretrained(model_name, local_files_only=local_files_only).eval()
+    processor = CLIPProcessor.from_pretrained(model_name, local_files_only=local_files_only)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Sample inputs. The batch and sequence dimensions of the graphs are dynamic.
+    text_inputs = processor(text=["a painting of a river", "a portrait"], padding=True, return_tensors="pt")
+    image_inputs = processor(images=[np.zeros((CLIP_IMAGE_SIZE, CLIP_IMAGE_SIZE, 3), dtype=np.uint8)] * 2,
+                             return_tensors="pt")
+    text_encoder, image_encoder = TextEncoder(model), ImageEncoder(model)
+
+    with torch.no_grad():
+        torch.onnx.export(text_encoder, (text_inputs["input_ids"], text_inputs["attention_mask"]),
+                          os.path.join(output_dir, ONNX_TEXT_MODEL_FILE_NAME),
+                          input_names=["input_ids", "attention_mask"], output_names=["embeddings"],
+                          dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                        "attention_mask": {0: "batch", 1: "sequence"}, "embeddings": {0: "batch"}},
+                          opset_version=opset, dynamo=False)
+        torch.onnx.export(image_encoder, (image_inputs["pixel_values"],),
+                          os.path.join(output_dir, ONNX_IMAGE_MODEL_FILE_NAME),
+                          input_names=["pixel_values"], output_names=["embeddings"],
+                          dynamic_axes={"pixel_values": {0: "batch"}, "embeddings": {0: "batch"}},
+                          opset_version=opset, dynamo=False)
+        processor.save_pretrained(output_dir)
+
+        # Compare the embeddings of the graphs with the ones of the model
+        try:
+            from .OnnxClipEmbeddings import create_session
+        except ImportError:
+            return None
+        text_session = create_session(os.path.join(output_dir, ONNX_TEXT_MODEL_FILE_NAME))
+        image_session = create_session(os.path.join(output_dir, ONNX_IMAGE_MODEL_FILE_NAME))
+        text_difference = np.abs(text_session.run(None, {key: value.numpy() for key, value in text_inputs.items()})[0]
+                                 - text_encoder(**text_inputs).numpy()).max()
+        image_difference = np.abs(image_session.run(None, {"pixel_values": image_inputs["pixel_values"].numpy()})[0]
+                                  - image_encoder(**image_inputs).numpy()).max()
+    return float(max(text_difference, image_difference))
+
+
+def parsing():
+    # Remove 1st argument from the list of command line arguments
+    arguments = sys.argv[1:]
+
+    # Options
+    options = "ho:"
+    # Long options
+    long_options = ["help", "output="]
+
+    # Prepare flags
+    flags = {"output": os.path.join(os.getenv(HOME), DATA_DIR_NAME, ONNX_MODEL_DIR_NAME)}
+
+    # Parsing argument
+    arguments, values = getopt.getopt(arguments, options, long_options)
+
+    if len(arguments) > 0 and arguments[0][0] in ("-h", "--help"):
+        print(f'This script exports the text and image towers of {CLIP_MODEL} from the local Hugging Face cache to '
+              f'ONNX graphs, used by the backend when EMBEDDINGS_BACKEND=onnx.\n\
+        -o or --output: output directory (default={flags["output"]}).')
+        sys.exit(0)
+
+    # Checking each argument
+    for arg, val in arguments:
+        if arg in ("-o", "--output"):
+            flags["output"] = val
+
+    return flags
+
+
+if __name__ == "__main__":
+    if ENV_FILE_LOCATION not in os.environ:
+        # Try to load /.env file
+        if os.path.exists("/.env"):
+            load_dotenv("/.env")
+        else:
+            print("export .env file location as ENV_FILE_LOCATION.")
+            sys.exit(1)
+    else:
+        # Load environment variables
+        load_dotenv(os.getenv(ENV_FILE_LOCATION))
+
+    # Get arguments
+    flags = parsing()
+
+    try:
+        difference = export_onnx(flags["output"])
+    except Exception as e:
+        print("Error in exporting the model. Error message: ", e)
+        sys.exit(1)
+
+    if difference is None:
+        print(f"Model exported to {flags['output']}. Install onnxruntime to check the exported graphs.")
+    elif difference > ONNX_EXPORT_TOLERANCE:
+        print(f"The exported graphs differ from the model by up to {difference:.2e}.")
+        sys.exit(1)
+    else:
+        print(f"Model exported to {flags['output']}. Largest difference with the model: {difference:.2e}.")
+    sys.exit(0)
@@ -25,3 +25,18 @@ def project_embeddings_UMAP(embeddings: torch.Tensor | np.ndarray, n_neighbors=D
         reducer = UMAP(n_neighbors=n_neighbors, n_components=dim, min_dist=min_dist, random_state=RANDOM_STATE,
                        n_jobs=1)
         return reducer.fit_transform(embeddings)
+
+
+def cosine_agreement(reference: torch.Tensor | np.ndarray, candidate: torch.Tensor | np.ndarray) -> np.ndarray:
+    """
+    Return the cosine similarity between each embedding of a reference model and the embedding of the same input by a
+    candidate model, e.g. a quantized version of the reference model.
+    :param reference: Embeddings of shape (NUM_EMBEDDINGS, EMBEDDINGS_DIM).
+    :param candidate: Embeddings of the same shape.
+    :return: Cosine similarities of shape (NUM_EMBEDDINGS,).
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    assert reference.shape == candidate.shape and len(reference.shape) == 2
+    return np.sum(reference * candidate, axis=1) / (np.linalg.norm(reference, axis=1) *
+                                                   np.linalg.norm(candidate, axis=1))
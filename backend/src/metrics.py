@@ -0,0 +1,113 @@
+"""
+Prometheus metrics of the backend. The metrics are defined in one module, so that the app, the Milvus access layer and
+the embeddings models record into the same registry, which is exposed by the /metrics endpoint of the app. When the
+backend runs several workers, PROMETHEUS_MULTIPROC_DIR is set, and every process, including the embeddings service,
+writes its metrics to that directory, from which /metrics aggregates them.
+"""
+import os
+import time
+from typing import AsyncIterator
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+from .CONSTANTS import PROMETHEUS_MULTIPROC_DIR
+
+# Define buckets in seconds for latencies, from 1 ms to 30 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Define buckets in bytes for payload sizes, from 256 B to 64 MiB
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(10))
+
+REQUEST_DURATION = Histogram(
+    "aeye_http_request_duration_seconds",
+    "Duration of HTTP requests until their body has been sent, by route template.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    "aeye_http_response_size_bytes",
+    "Size of HTTP response bodies, by route template.",
+    ["route"],
+    buckets=SIZE_BUCKETS
+)
+MILVUS_CALL_DURATION = Histogram(
+    "aeye_milvus_call_duration_seconds",
+    "Duration of Milvus calls, including the wait for a free Milvus worker thread.",
+    ["operation", "collection"],
+    buckets=LATENCY_BUCKETS
+)
+MILVUS_CALL_ERRORS = Counter(
+    "aeye_milvus_call_errors_total",
+    "Number of Milvus calls that failed or timed out.",
+    ["operation", "collection"]
+)
+INFERENCE_DURATION = Histogram(
+    "aeye_inference_duration_seconds",
+    "Duration of the forward passes of the embeddings model, including preprocessing.",
+    ["modality"],
+    buckets=LATENCY_BUCKETS
+)
+INFERENCE_BATCH_SIZE = Histogram(
+    "aeye_inference_batch_size",
+    "Number of inputs of the forward passes of the embeddings model.",
+    ["modality"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+)
+ENCODING_DURATION = Histogram(
+    "aeye_encoding_duration_seconds",
+    "Duration of the encoding of response payloads.",
+    ["format"],
+    buckets=LATENCY_BUCKETS
+)
+COLLECTION_EVENTS = Counter(
+    "aeye_collection_events_total",
+    "Number of collection loads, releases and failed loads.",
+    ["event", "collection"]
+)
+COLLECTION_LOAD_DURATION = Histogram(
+    "aeye_collection_load_duration_seconds",
+    "Duration of collection loads.",
+    ["collection"],
+    buckets=LATENCY_BUCKETS
+)
+RESIDENT_BYTES = Gauge(
+    "aeye_resident_bytes",
+    "Estimated memory footprint of the loaded collections.",
+    # Every worker estimates the footprint of the collections loaded in Milvus
+    multiprocess_mode="livemax"
+)
+
+
+def generate_metrics() -> bytes:
+    """
+    Get the metrics of the backend in the Prometheus text format.
+    @return:
+    """
+    if not os.getenv(PROMETHEUS_MULTIPROC_DIR):
+        return generate_latest()
+    # Aggregate the metrics written by all the processes
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+async def observe_response(body: AsyncIterator[bytes], method: str, route: str, status: int,
+                           start: float) -> AsyncIterator[bytes]:
+    """
+    Pass the chunks of a response body through, and record the duration of the request and the size of the body once
+    the body has been sent. Streamed responses start before their body is complete, so their duration and their size,
+    which has no Content-Length header, are only known at the end.
+    @param body: body iterator of the response.
+    @param method: method of the request.
+    @param route: route template of the request.
+    @param status: status code of the response.
+    @param start: time.perf_counter() value at the start of the request.
+    @return:
+    """
+    size = 0
+    try:
+        async for chunk in body:
+            size += len(chunk)
+            yield chunk
+    finally:
+        REQUEST_DURATION.labels(method, route, status).observe(time.perf_counter() - start)
+        RESPONSE_SIZE.labels(route).observe(size)
@@ -11,6 +11,7 @@ from umap import UMAP
 from ..CONSTANTS import *
 from ..db_utilities.collections import EMBEDDING_VECTOR_FIELD_NAME, umap_collection
 from ..db_utilities.utils import create_connection
+from ..db_utilities.versions import ContentVersion, save_dataset_version
 
 
 def parsing():
@@ -96,6 +97,18 @@ def generate_scatter_plots(collection: Collection):
         utility.drop_collection(umap_c.name)
         return
 
+    # Record the version of the new collection, from which the app derives the ETags of the projections. The UMAP
+    # collection is shared, so the version is removed from the other datasets.
+    version = ContentVersion()
+    for datapoint in umap_data:
+        version.add(datapoint)
+    try:
+        save_dataset_version(os.path.join(os.getenv(HOME), DATASETS_JSON_NAME), collection.name, "umap",
+                             version.hexdigest())
+    except Exception as e:
+        print(e.__str__())
+        print("Error in saving the version of the UMAP collection.")
+
     print("Scatter plots data generated and inserted into UMAP collection.")
     return
 
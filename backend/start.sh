@@ -10,10 +10,6 @@ export ENV_FILE_LOCATION=/.env
 
 cat /.env
 
-# Install netcat
-apt-get update
-apt-get install -y netcat-openbsd
-
 # Loop until milvus service is available. It should be available as the backend depends on it
 max_retries=10
 retry_count=0
@@ -35,7 +31,22 @@ fi
 echo "Creating default database..."
 python -m src.db_utilities.create_database
 
+workers=${BACKEND_WORKERS:-1}
+if [ "$workers" -gt 1 ]; then
+  # Start the embeddings service, so that the workers share a single copy of the model
+  echo "Starting embeddings service..."
+  export EMBEDDINGS_SERVICE=/tmp/embeddings.sock
+  EMBEDDINGS_SERVICE_AUTHKEY=$(head -c 32 /dev/urandom | od -An -tx1 | tr -d ' \n')
+  export EMBEDDINGS_SERVICE_AUTHKEY
+  # Every process writes its metrics to the same directory, so that /metrics reports the metrics of all the workers and
+  # of the embeddings service
+  export PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+  mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+  python -m src.embeddings_model.embeddings_service &
+fi
+
 echo "Starting backend..."
 
 # Start the backend
-uvicorn src.app.main:app --host 0.0.0.0 --port "$BACKEND_PORT" --reload --log-level critical
+uvicorn src.app.main:app --host 0.0.0.0 --port "$BACKEND_PORT" --workers "$workers" --log-level critical
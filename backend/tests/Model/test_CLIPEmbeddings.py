@@ -1,29 +1,39 @@
+import importlib.util
+import tempfile
 import unittest
 
+import numpy as np
 import torch
+from transformers import CLIPConfig, CLIPModel
 
-from backend.src.embeddings_model.CLIPEmbeddings import ClipEmbeddings
-from backend.src.embeddings_model.EmbeddingsModel import EmbeddingsModel
+from backend.src.embeddings_model.CLIPEmbeddings import ClipEmbeddings, get_text_encoder_size, quantize_text_encoder
+from backend.src.embeddings_model.EmbeddingsModel import EmbeddingsModel, to_numpy
 
 
-class TestCLIPEmbeddings(unittest.TestCase):
+class CLIPEmbeddingsTests:
+    """
+    Tests run against each backend of CLIP.
+    """
+
+    def create_model(self) -> EmbeddingsModel:
+        raise NotImplementedError
 
     def test_CLIPEmbeddings_instance_of_EmbeddingsModel(self):
-        clip = ClipEmbeddings("cpu")
+        clip = self.create_model()
         self.assertIsInstance(clip, EmbeddingsModel)
 
     def test_shape_text_embeddings(self):
-        clip = ClipEmbeddings("cpu")
+        clip = self.create_model()
         text = "test shape _embeddings"
         self.assertEqual((1, 512), clip.getTextEmbeddings(text).shape)
 
     def test_shape_image_embeddings(self):
-        clip = ClipEmbeddings("cpu")
+        clip = self.create_model()
         img = torch.rand(3, 224, 224)
         self.assertEqual((1, 512), clip.getEmbeddings(clip.processData(img)).shape)
 
     def test_get_similarity_score(self):
-        clip = ClipEmbeddings("cpu")
+        clip = self.create_model()
 
         with self.assertRaises(AssertionError):
             clip.getSimilarityScore(torch.randn(100, 128), torch.randn(100, 126))
@@ -38,3 +48,69 @@ class TestCLIPEmbeddings(unittest.TestCase):
         score = clip.getSimilarityScore(img_embeddings, text_embeddings)
 
         self.assertTrue(0 <= score.item() <= 1)
+
+
+class TestCLIPEmbeddings(CLIPEmbeddingsTests, unittest.TestCase):
+
+    def create_model(self) -> EmbeddingsModel:
+        return ClipEmbeddings("cpu")
+
+    def test_quantize_text_encoder(self):
+        # Small randomly initialized model with the architecture of CLIP
+        config = CLIPConfig(
+            text_config={"hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2, "num_attention_heads": 2,
+                         "vocab_size": 100, "bos_token_id": 0, "eos_token_id": 1, "pad_token_id": 1},
+            vision_config={"hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2,
+                           "num_attention_heads": 2, "image_size": 32, "patch_size": 8},
+            projection_dim=32
+        )
+        model = CLIPModel(config).eval()
+        size = get_text_encoder_size(model)
+
+        quantize_text_encoder(model)
+        # Only the linear layers of the text encoder are quantized
+        self.assertIsInstance(model.text_projection, torch.ao.nn.quantized.dynamic.Linear)
+        self.assertIsInstance(model.text_model.encoder.layers[0].mlp.fc1, torch.ao.nn.quantized.dynamic.Linear)
+        self.assertIsInstance(model.text_model.embeddings.token_embedding, torch.nn.Embedding)
+        self.assertIs(type(model.vision_model.encoder.layers[0].mlp.fc1), torch.nn.Linear)
+        self.assertLess(get_text_encoder_size(model), size)
+
+    def test_int8_text_encoder_only_on_cpu(self):
+        with self.assertRaises(ValueError):
+            ClipEmbeddings("cuda", "int8")
+        with self.assertRaises(ValueError):
+            ClipEmbeddings("cpu", "int4")
+
+
+@unittest.skipUnless(importlib.util.find_spec("onnxruntime"), "onnxruntime is not installed")
+class TestOnnxCLIPEmbeddings(CLIPEmbeddingsTests, unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from backend.src.embeddings_model.export_onnx import export_onnx
+
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.difference = export_onnx(cls.directory.name, local_files_only=False)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def create_model(self) -> EmbeddingsModel:
+        from backend.src.embeddings_model.OnnxClipEmbeddings import OnnxClipEmbeddings
+
+        return OnnxClipEmbeddings(self.directory.name)
+
+    def test_same_embeddings_as_torch(self):
+        self.assertLess(self.difference, 1e-3)
+        clip, reference = self.create_model(), ClipEmbeddings("cpu")
+        texts = ["a painting of a river", "a much longer description of a portrait of a woman in a garden"]
+        np.testing.assert_allclose(to_numpy(reference.getTextEmbeddings(texts)), clip.getTextEmbeddings(texts),
+                                   atol=1e-3)
+        img = torch.rand(3, 224, 224)
+        np.testing.assert_allclose(to_numpy(reference.getEmbeddings(reference.processData(img))),
+                                   clip.getEmbeddings(clip.processData(img)), atol=1e-3)
+
+
+if __name__ == "__main__":
+    unittest.main()
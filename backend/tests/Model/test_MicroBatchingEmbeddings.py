@@ -0,0 +1,109 @@
+import threading
+import unittest
+
+import torch
+
+from backend.src.embeddings_model.EmbeddingsModel import EmbeddingsModel
+from backend.src.embeddings_model.MicroBatchingEmbeddings import MicroBatchingEmbeddings
+
+
+class FakeEmbeddings(EmbeddingsModel):
+    """
+    Model whose embedding of a text is its length repeated, which records the size of each forward pass.
+    """
+
+    def __init__(self):
+        self.text_batch_sizes = []
+
+    def getSimilarityScore(self, emb1, emb2):
+        return torch.nn.CosineSimilarity()(emb1, emb2)
+
+    def getTextEmbeddings(self, text):
+        texts = text if isinstance(text, list) else [text]
+        self.text_batch_sizes.append(len(texts))
+        return torch.tensor([[float(len(t))] * 4 for t in texts])
+
+    def getImageEmbeddings(self, image):
+        images = image if isinstance(image, list) else [image]
+        return torch.stack([img.mean(dim=(1, 2)) for img in images])
+
+    def processData(self, data):
+        return data
+
+    def getEmbeddings(self, inputs):
+        return self.getImageEmbeddings(inputs)
+
+
+class TestMicroBatchingEmbeddings(unittest.TestCase):
+
+    def test_MicroBatchingEmbeddings_instance_of_EmbeddingsModel(self):
+        self.assertIsInstance(MicroBatchingEmbeddings(FakeEmbeddings()), EmbeddingsModel)
+
+    def test_concurrent_texts_are_batched(self):
+        model = FakeEmbeddings()
+        batching = MicroBatchingEmbeddings(model, window=0.5, max_batch_size=8)
+        texts = ["a" * i for i in range(1, 9)]
+        results = {}
+
+        def embed(text):
+            results[text] = batching.getTextEmbeddings(text)
+
+        threads = [threading.Thread(target=embed, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every caller receives its own embedding
+        for text in texts:
+            self.assertEqual((1, 4), results[text].shape)
+            self.assertTrue(torch.equal(torch.full((1, 4), float(len(text))), results[text]))
+        # The texts are embedded with fewer forward passes than requests
+        self.assertLess(len(model.text_batch_sizes), len(texts))
+        self.assertEqual(len(texts), sum(model.text_batch_sizes))
+
+    def test_image_embeddings(self):
+        batching = MicroBatchingEmbeddings(FakeEmbeddings(), window=0.01)
+        img = torch.rand(3, 8, 8)
+        self.assertTrue(torch.allclose(img.mean(dim=(1, 2)).unsqueeze(0), batching.getImageEmbeddings(img)))
+
+    def test_errors_are_propagated(self):
+        model = FakeEmbeddings()
+        model.getTextEmbeddings = lambda text: None
+        batching = MicroBatchingEmbeddings(model, window=0.01)
+        with self.assertRaises(RuntimeError):
+            batching.getTextEmbeddings("text")
+
+    def test_invalid_input_only_fails_its_request(self):
+        model = FakeEmbeddings()
+        embed = model.getTextEmbeddings
+
+        def getTextEmbeddings(text):
+            texts = text if isinstance(text, list) else [text]
+            if "invalid" in texts:
+                raise ValueError("invalid text")
+            return embed(text)
+
+        model.getTextEmbeddings = getTextEmbeddings
+        batching = MicroBatchingEmbeddings(model, window=0.5, max_batch_size=4)
+        texts = ["a", "bb", "invalid", "dddd"]
+        results = {}
+        barrier = threading.Barrier(len(texts))
+
+        def request(text):
+            barrier.wait()
+            try:
+                results[text] = batching.getTextEmbeddings(text)
+            except ValueError as e:
+                results[text] = e
+
+        threads = [threading.Thread(target=request, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The batch fails, and its texts are embedded one by one
+        self.assertIsInstance(results["invalid"], ValueError)
+        for text in ["a", "bb", "dddd"]:
+            self.assertTrue(torch.equal(torch.full((1, 4), float(len(text))), results[text]))
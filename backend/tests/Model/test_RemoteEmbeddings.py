@@ -0,0 +1,118 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import torch
+
+from backend.src.embeddings_model.EmbeddingsModel import EmbeddingsModel
+from backend.src.embeddings_model.MicroBatchingEmbeddings import MicroBatchingEmbeddings
+from backend.src.embeddings_model.RemoteEmbeddings import RemoteEmbeddings
+from backend.src.embeddings_model.embeddings_service import EmbeddingsService
+
+
+class FakeEmbeddings(EmbeddingsModel):
+    """
+    Model whose embedding of a text is its length repeated, which records the size of each forward pass.
+    """
+
+    def __init__(self):
+        self.text_batch_sizes = []
+
+    def getSimilarityScore(self, emb1, emb2):
+        return torch.nn.CosineSimilarity()(emb1, emb2)
+
+    def getTextEmbeddings(self, text):
+        texts = text if isinstance(text, list) else [text]
+        if "fail" in texts:
+            return None
+        self.text_batch_sizes.append(len(texts))
+        return torch.tensor([[float(len(t))] * 4 for t in texts])
+
+    def getImageEmbeddings(self, image):
+        images = image if isinstance(image, list) else [image]
+        return torch.stack([torch.tensor(img, dtype=torch.float32).mean(dim=(0, 1)) for img in images])
+
+    def processData(self, data):
+        return data
+
+    def getEmbeddings(self, inputs):
+        return self.getImageEmbeddings(inputs)
+
+
+class TestRemoteEmbeddings(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.directory.name, "embeddings.sock")
+        self.model = FakeEmbeddings()
+        self.service = None
+
+    def tearDown(self):
+        if self.service is not None:
+            self.service.close()
+        self.directory.cleanup()
+
+    def start_service(self, model: EmbeddingsModel, authkey: bytes | None = b"key"):
+        self.service = EmbeddingsService(model, self.address, authkey)
+        threading.Thread(target=self.service.serve_forever, daemon=True).start()
+
+    def test_embeddings(self):
+        self.start_service(self.model)
+        client = RemoteEmbeddings(self.address, b"key")
+        client.wait(5)
+
+        np.testing.assert_array_equal(np.full((1, 4), 4.0), client.getTextEmbeddings("four"))
+        np.testing.assert_array_equal(np.array([[1.0] * 4, [3.0] * 4]), client.getTextEmbeddings(["a", "abc"]))
+        image = np.full((2, 2, 3), 2.0)
+        self.assertEqual((1, 3), client.getImageEmbeddings([image]).shape)
+        # Errors of the model are reported to the caller
+        self.assertIsNone(client.getTextEmbeddings("fail"))
+        self.assertEqual(8.0, client.getTextEmbeddings("eight...")[0, 0])
+
+    def test_requests_of_workers_are_batched(self):
+        model = MicroBatchingEmbeddings(self.model, window=0.2, max_batch_size=64)
+        self.start_service(model)
+        # Each client stands for a worker of the backend
+        clients = [RemoteEmbeddings(self.address, b"key") for _ in range(4)]
+        results = {}
+        barrier = threading.Barrier(8)
+
+        def request(client, i):
+            barrier.wait()
+            results[i] = client.getTextEmbeddings(["x" * i])
+
+        threads = [threading.Thread(target=request, args=(clients[i % 4], i)) for i in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for i in range(1, 9):
+            np.testing.assert_array_equal(np.full((1, 4), float(i)), results[i])
+        self.assertEqual(8, sum(self.model.text_batch_sizes))
+        self.assertLess(len(self.model.text_batch_sizes), 8)
+
+    def test_authentication(self):
+        self.start_service(self.model)
+        self.assertIsNone(RemoteEmbeddings(self.address, b"other").getTextEmbeddings("text"))
+
+    def test_reconnection(self):
+        self.start_service(self.model)
+        client = RemoteEmbeddings(self.address, b"key")
+        client.wait(5)
+        client.getTextEmbeddings("text")
+
+        # Broken idle connections, e.g. after a restart of the service, are replaced by new ones
+        for connection in list(client._connections.queue):
+            connection.close()
+        np.testing.assert_array_equal(np.full((1, 4), 4.0), client.getTextEmbeddings("text"))
+
+    def test_wait_timeout(self):
+        with self.assertRaises(TimeoutError):
+            RemoteEmbeddings(self.address).wait(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
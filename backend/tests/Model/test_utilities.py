@@ -15,3 +15,12 @@ class TestEmbeddingsModel(unittest.TestCase):
         projections = project_embeddings_UMAP(torch.randn(1000, 128), dim=2)
         self.assertTrue(projections.shape[0] == 1000 and projections.shape[1] == 2)
         self.assertIsInstance(projections, np.ndarray)
+
+    def test_cosine_agreement(self):
+        with self.assertRaises(AssertionError):
+            cosine_agreement(torch.randn(10, 4), torch.randn(10, 3))
+
+        reference = torch.randn(10, 4)
+        np.testing.assert_allclose(cosine_agreement(reference, 2 * reference), np.ones(10))
+        np.testing.assert_allclose(cosine_agreement(reference, -reference), -np.ones(10))
+
@@ -31,7 +31,10 @@ def test_get_collection_info():
     # Create request
     response = requests.get("http://localhost:32145/api/collection-info", params={"collection": "best_artworks"})
     assert response.status_code == 200
-    assert response.json() == {"number_of_entities": 7947, "zoom_levels": 7}
+    assert response.json()["number_of_entities"] == 7947
+    assert response.json()["zoom_levels"] == 7
+    # The versions are recorded when the collections are built
+    assert isinstance(response.json()["versions"], dict)
 
     # Make second request to test that status code is 404 when collection is not found
     response = requests.get("http://localhost:32145/api/collection-info", params={"collection": "test_collection"})
@@ -49,12 +52,34 @@ def test_get_image_from_text():
     assert response.json()["author"] == "Henri de Toulouse"
 
 
+def test_get_images_from_texts():
+    texts = ["A painting of a dog.", "A portrait of a woman.", "A painting of a dog."]
+    response = requests.post("http://localhost:32145/api/image-text-batch", params={"collection": "best_artworks"},
+                             json={"texts": texts, "k": 5})
+    assert response.status_code == 200
+    assert len(response.json()) == len(texts)
+    for images in response.json():
+        assert len(images) == 5
+    # The batch search must return the same best match as the single search
+    single = requests.get("http://localhost:32145/api/image-text",
+                          params={"text": texts[0], "collection": "best_artworks"})
+    assert response.json()[0][0]["path"] == single.json()["path"]
+    assert response.json()[0] == response.json()[2]
+
+    # Make second request to test that status code is 404 when collection is not found
+    response = requests.post("http://localhost:32145/api/image-text-batch", params={"collection": "test_collection"},
+                             json={"texts": texts, "k": 5})
+    assert response.status_code == 404
+
+
 def test_get_tiles():
     response = requests.get("http://localhost:32145/api/tiles",
                             params={"indexes": [34, 557], "collection": "best_artworks_zoom_levels_clusters"})
     assert response.status_code == 200
     # Check that the response is a list
     assert isinstance(response.json(), list)
+    # The JSON response must not be served from a cache to clients asking for another format
+    assert "Accept" in response.headers["vary"]
     # Check that the response has the same length as the request
     assert len(response.json()) == 1
     # Check that the response has the same keys as the request
@@ -67,6 +92,48 @@ def test_get_tiles():
     assert response.status_code == 404
 
 
+def test_get_tiles_ndjson():
+    params = {"indexes": [0, 1, 2, 3, 4], "collection": "best_artworks_zoom_levels_clusters"}
+    response = requests.get("http://localhost:32145/api/tiles", params=params)
+    # Tiles are streamed one per line, with the same fields as the JSON response
+    streamed = requests.get("http://localhost:32145/api/tiles", params=params,
+                            headers={"Accept": "application/x-ndjson"}, stream=True)
+    assert streamed.status_code == 200
+    assert streamed.headers["content-type"].startswith("application/x-ndjson")
+    tiles = [json.loads(line) for line in streamed.iter_lines() if line]
+    assert sorted(tiles, key=lambda tile: tile["index"]) == sorted(response.json(), key=lambda tile: tile["index"])
+
+    response = requests.get("http://localhost:32145/api/first-tiles",
+                            params={"collection": "best_artworks_zoom_levels_clusters"})
+    streamed = requests.get("http://localhost:32145/api/first-tiles",
+                            params={"collection": "best_artworks_zoom_levels_clusters"},
+                            headers={"Accept": "application/x-ndjson"}, stream=True)
+    assert streamed.status_code == 200
+    tiles = [json.loads(line) for line in streamed.iter_lines() if line]
+    assert sorted(tiles, key=lambda tile: tile["index"]) == sorted(response.json(), key=lambda tile: tile["index"])
+
+
+def test_get_viewport():
+    response = requests.post("http://localhost:32145/api/viewport",
+                             params={"collection": "best_artworks_zoom_levels_clusters"},
+                             json={"x": 0, "y": 0, "zoom": 0, "mode": "translation", "cached": []})
+    assert response.status_code == 200
+    assert [tile["index"] for tile in response.json()] == [0]
+
+    # Tiles held by the client are not returned
+    response = requests.post("http://localhost:32145/api/viewport",
+                             params={"collection": "best_artworks_zoom_levels_clusters"},
+                             json={"x": 0, "y": 0, "zoom": 1, "mode": "translation", "cached": [1, 2]})
+    assert response.status_code == 200
+    assert sorted(tile["index"] for tile in response.json()) == [3, 4]
+
+    # Make second request to test that status code is 400 when the mode is unknown
+    response = requests.post("http://localhost:32145/api/viewport",
+                             params={"collection": "best_artworks_zoom_levels_clusters"},
+                             json={"x": 0, "y": 0, "zoom": 0, "mode": "pan", "cached": []})
+    assert response.status_code == 400
+
+
 def test_get_tile_from_image():
     response = requests.get("http://localhost:32145/api/image-to-tile",
                             params={"index": 1, "collection": "best_artworks_image_to_tile"})
@@ -96,6 +163,29 @@ def test_get_images():
     assert response.status_code == 404
 
 
+def test_health_and_readiness():
+    response = requests.get("http://localhost:32145/healthz")
+    assert response.status_code == 200
+    response = requests.get("http://localhost:32145/readyz")
+    assert response.status_code == 200
+    assert response.json()["ready"]
+    assert {"milvus", "catalog", "clusters", "collections", "model", "umap"} <= response.json()["components"].keys()
+
+
+def test_get_images_batch():
+    response = requests.post("http://localhost:32145/api/images-batch", params={"collection": "best_artworks"},
+                             json={"indexes": [5432, 2881], "fields": ["path", "width", "height"]})
+    assert response.status_code == 200
+    # Images are returned in the order of the indexes, with the requested fields only
+    assert [image["index"] for image in response.json()] == [5432, 2881]
+    assert response.json()[1]["path"] == "2881-Henri_de_Toulouse-Lautrec.jpg"
+    assert response.json()[0].keys() == {"index", "path", "width", "height"}
+    # Make second request to test that status code is 400 when a field is unknown
+    response = requests.post("http://localhost:32145/api/images-batch", params={"collection": "best_artworks"},
+                             json={"indexes": [2881], "fields": ["embedding"]})
+    assert response.status_code == 400
+
+
 def test_get_neighbours():
     response = requests.get("http://localhost:32145/api/neighbors",
                             params={"index": 2881, "k": 10, "collection": "best_artworks"})
@@ -109,6 +199,22 @@ def test_get_neighbours():
     assert response.status_code == 404
 
 
+def test_get_neighbours_batch():
+    response = requests.post("http://localhost:32145/api/neighbors-batch", params={"collection": "best_artworks"},
+                             json={"indexes": [2881, 5432], "k": 10})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    # The batch search must return the same neighbours as the single search
+    single = requests.get("http://localhost:32145/api/neighbors",
+                          params={"index": 2881, "k": 10, "collection": "best_artworks"})
+    assert [image["index"] for image in response.json()[0]] == [image["index"] for image in single.json()]
+
+    # Make second request to test that status code is 404 when the image is not found
+    response = requests.post("http://localhost:32145/api/neighbors-batch", params={"collection": "best_artworks"},
+                             json={"indexes": [2881, 8000], "k": 10})
+    assert response.status_code == 404
+
+
 def test_get_first_tiles():
     response = requests.get("http://localhost:32145/api/first-tiles",
                             params={"collection": "best_artworks_zoom_levels_clusters"})
@@ -121,6 +227,15 @@ def test_get_first_tiles():
 
     assert list(response.json()["clusters"][0]["range"].keys()) == ['x_min', 'x_max', 'y_min', 'y_max']
 
+    # Weak and comma separated ETags are matched, and the 304 has the headers of the 200
+    etag = response.headers["etag"]
+    revalidated = requests.get("http://localhost:32145/api/first-tiles",
+                               params={"collection": "best_artworks_zoom_levels_clusters"},
+                               headers={"If-None-Match": f'"other", W/{etag}'})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == etag
+    assert revalidated.headers.get("cache-control") == response.headers.get("cache-control")
+
     # Make second request to test that status code is 404 when collection is not found
     response = requests.get("http://localhost:32145/api/first-tiles",
                             params={"collection": "test_collection"})
@@ -0,0 +1,147 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+from backend.src.app.cache import (TileCache, EmbeddingCache, TextEmbeddingCache, ImageEmbeddingCache,
+                                   normalize_text)
+
+
+class FakeCollection:
+    def __init__(self, name: str, collection_id: int, num_entities: int):
+        self.name = name
+        self.collection_id = collection_id
+        self.num_entities = num_entities
+
+    def describe(self):
+        return {"collection_id": self.collection_id}
+
+
+def make_tile(index: int) -> dict:
+    return {"index": index, "data": [{"index": index, "path": f"{index}.jpg", "x": 0.0, "y": 0.0}]}
+
+
+class TestTileCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = TileCache(max_bytes=1000000, validation_interval=0)
+        found, missing = cache.get_many("c", [1, 2])
+        self.assertEqual({}, found)
+        self.assertEqual([1, 2], missing)
+
+        cache.put_many("c", [make_tile(1), make_tile(2)])
+        found, missing = cache.get_many("c", [1, 2, 3])
+        self.assertEqual({1: make_tile(1), 2: make_tile(2)}, found)
+        self.assertEqual([3], missing)
+
+        stats = cache.stats()
+        self.assertEqual(2, stats["hits"])
+        self.assertEqual(3, stats["misses"])
+        self.assertEqual(2, stats["entries"])
+
+    def test_lru_eviction(self):
+        tile_size = len(json.dumps(make_tile(1)))
+        cache = TileCache(max_bytes=2 * tile_size, validation_interval=0)
+        cache.put_many("c", [make_tile(1), make_tile(2)])
+        # Use tile 1, so that tile 2 becomes the least recently used tile
+        cache.get_many("c", [1])
+        cache.put_many("c", [make_tile(3)])
+
+        found, missing = cache.get_many("c", [1, 2, 3])
+        self.assertEqual([1, 3], sorted(found.keys()))
+        self.assertEqual([2], missing)
+        self.assertEqual(1, cache.stats()["evictions"])
+        self.assertLessEqual(cache.stats()["size_bytes"], 2 * tile_size)
+
+    def test_invalidation_on_rebuild(self):
+        cache = TileCache(max_bytes=1000000, validation_interval=0)
+        collection = FakeCollection("c", collection_id=1, num_entities=10)
+        other = FakeCollection("d", collection_id=2, num_entities=10)
+        cache.validate(collection)
+        cache.validate(other)
+        cache.put_many("c", [make_tile(1)])
+        cache.put_many("d", [make_tile(1)])
+
+        # Same generation: tiles are kept
+        cache.validate(collection)
+        self.assertEqual([], cache.get_many("c", [1])[1])
+
+        # The number of entities changes: tiles of the collection are dropped
+        collection.num_entities = 11
+        cache.validate(collection)
+        self.assertEqual([1], cache.get_many("c", [1])[1])
+        self.assertEqual([], cache.get_many("d", [1])[1])
+
+        # The collection is dropped and created again
+        cache.put_many("c", [make_tile(1)])
+        collection.collection_id = 3
+        cache.validate(collection)
+        self.assertEqual([1], cache.get_many("c", [1])[1])
+        self.assertEqual(2, cache.stats()["invalidations"])
+
+
+class TestTextEmbeddingCache(unittest.TestCase):
+
+    def test_normalize_text(self):
+        self.assertEqual("a painting of a dog", normalize_text("  A painting\tof a  DOG "))
+
+    def test_memory_tier(self):
+        cache = TextEmbeddingCache("model", max_entries=2)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", np.ones(4))
+        cache.put("b", np.zeros(4))
+        np.testing.assert_array_equal(np.ones(4, dtype=np.float32), cache.get("a"))
+        # "b" is the least recently used entry, so it is evicted
+        cache.put("c", np.zeros(4))
+        self.assertIsNone(cache.get("b"))
+
+        stats = cache.stats()
+        self.assertEqual(1, stats["memory_hits"])
+        self.assertEqual(2, stats["misses"])
+        self.assertFalse(stats["disk_tier"])
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.sqlite3")
+            cache = TextEmbeddingCache("model", path=path)
+            cache.put("a", np.arange(4))
+
+            # A new cache, as after a restart, reads the embedding from disk
+            cache = TextEmbeddingCache("model", path=path)
+            np.testing.assert_array_equal(np.arange(4, dtype=np.float32), cache.get("a"))
+            self.assertEqual(1, cache.stats()["disk_hits"])
+
+            # Embeddings of a different model are not returned
+            cache = TextEmbeddingCache("other-model", path=path)
+            self.assertIsNone(cache.get("a"))
+
+    def test_disk_tier_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.sqlite3")
+            cache = TextEmbeddingCache("model", path=path)
+            # The database becomes unusable, as when another worker holds it or the disk is full
+            with sqlite3.connect(path) as db:
+                db.execute("DROP TABLE text_embeddings")
+
+            # The errors are not raised, and the memory tier is still used
+            cache.put("a", np.arange(4))
+            np.testing.assert_array_equal(np.arange(4, dtype=np.float32), cache.get("a"))
+            self.assertIsNone(cache.get("b"))
+            self.assertEqual(1, cache.stats()["misses"])
+
+
+class TestImageEmbeddingCache(unittest.TestCase):
+
+    def test_memory_tier_only(self):
+        cache = ImageEmbeddingCache("model", max_entries=1)
+        self.assertIsInstance(cache, EmbeddingCache)
+        self.assertNotIsInstance(cache, TextEmbeddingCache)
+        key = ImageEmbeddingCache.get_key(b"image")
+        cache.put(key, np.ones(4))
+        np.testing.assert_array_equal(np.ones(4, dtype=np.float32), cache.get(key))
+        cache.put(ImageEmbeddingCache.get_key(b"other image"), np.zeros(4))
+        self.assertIsNone(cache.get(key))
+        self.assertFalse(cache.stats()["disk_tier"])
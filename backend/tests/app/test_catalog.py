@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from backend.src.app.catalog import Catalog
+
+
+def write_datasets(path: str, names: list, mtime: int):
+    with open(path, "w") as f:
+        json.dump({"datasets": [{"name": name, "website_name": name, "zoom_levels": 3} for name in names]}, f)
+    # Set the modification time explicitly, as writes within the same tick can keep the same modification time
+    os.utime(path, ns=(mtime, mtime))
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "datasets.json")
+        self.collections = ["a"]
+        self.calls = 0
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def list_collections(self):
+        self.calls += 1
+        return list(self.collections)
+
+    def test_datasets_reloaded_on_change(self):
+        write_datasets(self.path, ["a"], 1)
+        catalog = Catalog(self.path, refresh_interval=3600, stat_interval=0, list_collections=self.list_collections)
+        datasets = catalog.datasets
+        self.assertEqual(["a"], [dataset["name"] for dataset in datasets])
+        # The file is not parsed again while its modification time does not change
+        self.assertIs(datasets, catalog.datasets)
+
+        write_datasets(self.path, ["a", "b"], 2)
+        self.assertEqual(["a", "b"], [dataset["name"] for dataset in catalog.datasets])
+        self.assertEqual(3, catalog.get_dataset("b")["zoom_levels"])
+        self.assertIsNone(catalog.get_dataset("c"))
+
+    def test_invalid_file_keeps_datasets(self):
+        write_datasets(self.path, ["a"], 1)
+        catalog = Catalog(self.path, refresh_interval=3600, stat_interval=0, list_collections=self.list_collections)
+        with open(self.path, "w") as f:
+            f.write('{"datasets": [')
+        os.utime(self.path, ns=(2, 2))
+        self.assertEqual(["a"], [dataset["name"] for dataset in catalog.datasets])
+
+    def test_collections_and_listeners(self):
+        write_datasets(self.path, ["a", "b"], 1)
+        catalog = Catalog(self.path, refresh_interval=3600, stat_interval=0, list_collections=self.list_collections)
+        # The collections are only listed when the catalog is refreshed
+        self.assertEqual(0, self.calls)
+        catalog.refresh_collections()
+        updates = []
+        catalog.add_listener(lambda c: updates.append(set(c.collections)))
+        self.assertEqual([{"a"}], updates)
+
+        # Reading the catalog does not list the collections
+        for _ in range(10):
+            self.assertTrue(catalog.has_collection("a"))
+            self.assertFalse(catalog.has_collection("b"))
+        self.assertEqual(1, self.calls)
+
+        self.collections.append("b")
+        catalog.refresh_collections()
+        self.assertTrue(catalog.has_collection("b"))
+        self.assertEqual([{"a"}, {"a", "b"}], updates)
+        # Listeners are not called when nothing changes
+        catalog.refresh_collections()
+        self.assertEqual(2, len(updates))
+
+    def test_listeners_are_called_in_background(self):
+        write_datasets(self.path, ["a"], 1)
+        catalog = Catalog(self.path, refresh_interval=3600, stat_interval=0, list_collections=self.list_collections)
+        catalog.refresh_collections()
+        notified = threading.Event()
+        updates = []
+        catalog.add_listener(lambda c: (updates.append([dataset["name"] for dataset in c.datasets]), notified.set()))
+        notified.clear()
+
+        # Requests reading the new datasets do not call the listeners, which query Milvus
+        write_datasets(self.path, ["a", "b"], 2)
+        self.assertEqual(["a", "b"], [dataset["name"] for dataset in catalog.datasets])
+        self.assertEqual([["a"]], updates)
+        # The background thread calls them
+        catalog.start()
+        try:
+            self.assertTrue(notified.wait(5))
+        finally:
+            catalog.stop()
+        self.assertEqual([["a"], ["a", "b"]], updates)
@@ -0,0 +1,190 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from backend.src.app.cache import TextEmbeddingCache
+from backend.src.app.dependencies import DatasetCollectionNameGetter, DatasetCollectionInfoGetter, Embedder
+from backend.src.app.residency import ResidencyManager, Residency
+from backend.src.embeddings_model.MicroBatchingEmbeddings import MicroBatchingEmbeddings
+
+
+class FakeCollection:
+    """
+    Collection whose load waits until the test allows it to finish.
+    """
+
+    def __init__(self, name: str, blocking: bool = False):
+        self.name = name
+        self.loaded = False
+        self.load_started = threading.Event()
+        self.load_allowed = threading.Event()
+        if not blocking:
+            self.load_allowed.set()
+        # Operations completed by the test, in order
+        self.completions = []
+
+    def load(self):
+        self.load_started.set()
+        self.load_allowed.wait()
+        self.loaded = True
+        self.completions.append("load")
+
+    def release(self):
+        self.loaded = False
+
+
+class FakeCatalog:
+    def __init__(self, names: list):
+        self.datasets = [{"name": name} for name in names]
+
+    def has_collection(self, name: str) -> bool:
+        return name in [dataset["name"] for dataset in self.datasets]
+
+    def add_listener(self, listener):
+        listener(self)
+        self.listeners = [*getattr(self, "listeners", []), listener]
+
+    def request_notification(self):
+        self.notification_requested = True
+
+    def notify(self):
+        # Call the listeners, as the background thread of the catalog does when a notification is requested
+        self.notification_requested = False
+        for listener in self.listeners:
+            listener(self)
+
+
+class FakeHelperCollection:
+    def __init__(self, name: str):
+        self.name = name
+        # The load of the "slow" collection lasts until the test ends it
+        self.collection = FakeCollection(name, blocking=name == "slow")
+
+
+class SerializedCollectionNameGetter(DatasetCollectionNameGetter):
+    """
+    Getter holding one lock for every request, as the getters did before the lock was removed.
+    """
+
+    def __call__(self, collection: str):
+        with self.lock:
+            return super().__call__(collection)
+
+
+def get_completion_order(getter_class) -> list:
+    """
+    Request a loaded collection while another collection is being loaded, and end the load as soon as the request is
+    served, or after a short wait if the request is still blocked.
+    @return: names of the operations, "request" and "load", in the order in which they completed.
+    """
+    manager = ResidencyManager(10 ** 9, eviction_grace=60, load_timeout=5, estimate=lambda c: 1,
+                               measure=lambda c: None, loaded=lambda c: c.loaded)
+    catalog = FakeCatalog(["loaded", "slow"])
+    getter = getter_class(manager)
+    with patch("backend.src.app.dependencies.HelperCollection", FakeHelperCollection):
+        catalog.add_listener(getter.update)
+    getter("loaded")
+    slow = getter.collections["slow"].collection
+    order = slow.completions
+
+    # Start loading the slow collection
+    loader = threading.Thread(target=getter, args=("slow",))
+    loader.start()
+    slow.load_started.wait(5)
+
+    served = threading.Event()
+    requester = threading.Thread(target=lambda: (getter("loaded"), order.append("request"), served.set()))
+    requester.start()
+    served.wait(0.5)
+    slow.load_allowed.set()
+    requester.join()
+    loader.join()
+    return order
+
+
+class TestCollectionNameGetterConcurrency(unittest.TestCase):
+
+    def test_loaded_collection_does_not_wait_for_other_loads(self):
+        # With a single lock, the request waits for the end of the load
+        self.assertEqual(["load", "request"], get_completion_order(SerializedCollectionNameGetter))
+        # Without it, the request is served while the other collection is still loading
+        self.assertEqual(["request", "load"], get_completion_order(DatasetCollectionNameGetter))
+
+
+class TestDatasetCollectionInfoGetter(unittest.TestCase):
+
+    def test_number_of_entities_is_refreshed(self):
+        counts = {"dataset": 10}
+        catalog = FakeCatalog(["dataset"])
+        catalog.datasets[0].update({"zoom_levels": 5, "versions": {"clusters": "a"}})
+        catalog.get_dataset = lambda name: catalog.datasets[0] if name == "dataset" else None
+        manager = ResidencyManager(10 ** 9)
+        manager.residencies = {"dataset": Residency(FakeCollection("dataset"), 1)}
+        getter = DatasetCollectionInfoGetter(catalog, manager, lambda name: counts[name])
+        catalog.add_listener(getter.update)
+        self.assertEqual({"number_of_entities": 10, "zoom_levels": 5, "versions": {"clusters": "a"}},
+                         getter("dataset"))
+        self.assertIsNone(getter("other"))
+
+        # The count is not read again while the collection is unchanged
+        counts["dataset"] = 20
+        self.assertEqual(10, getter("dataset")["number_of_entities"])
+        # The collection is repopulated, which records a new version. The request does not wait for the count, which is
+        # read again by the background thread of the catalog.
+        catalog.datasets[0]["versions"] = {"clusters": "b"}
+        self.assertEqual(10, getter("dataset")["number_of_entities"])
+        self.assertTrue(catalog.notification_requested)
+        catalog.notify()
+        self.assertEqual(20, getter("dataset")["number_of_entities"])
+        # The collection is loaded again
+        counts["dataset"] = 30
+        manager.residencies["dataset"].loads += 1
+        getter("dataset")
+        catalog.notify()
+        self.assertEqual(30, getter("dataset")["number_of_entities"])
+
+
+class FakeTextModel:
+    """
+    Model whose embedding of a text is its length repeated, which records the size of each forward pass.
+    """
+
+    def __init__(self):
+        self.text_batch_sizes = []
+
+    def getTextEmbeddings(self, text):
+        texts = text if isinstance(text, list) else [text]
+        self.text_batch_sizes.append(len(texts))
+        return np.array([[float(len(t))] * 4 for t in texts], dtype=np.float32)
+
+
+class TestEmbedder(unittest.TestCase):
+
+    def test_concurrent_single_texts_are_batched(self):
+        model = FakeTextModel()
+        embedder = Embedder(MicroBatchingEmbeddings(model, window=0.5, max_batch_size=8), TextEmbeddingCache("fake"))
+        texts = ["a" * i for i in range(1, 9)]
+        results = {}
+        barrier = threading.Barrier(len(texts))
+
+        def embed(text):
+            barrier.wait()
+            results[text] = embedder(text)
+
+        threads = [threading.Thread(target=embed, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for text in texts:
+            np.testing.assert_array_equal(np.full((1, 4), float(len(text))), results[text])
+        # The texts of the requests are embedded with fewer forward passes than requests
+        self.assertEqual(len(texts), sum(model.text_batch_sizes))
+        self.assertLess(len(model.text_batch_sizes), len(texts))
+
+        # Cached texts are not embedded again
+        embedder(texts[0])
+        self.assertEqual(len(texts), sum(model.text_batch_sizes))
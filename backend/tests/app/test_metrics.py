@@ -0,0 +1,100 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from prometheus_client import REGISTRY
+from pymilvus import MilvusException
+
+from backend.src.app import milvus_io
+from backend.src.metrics import observe_response
+
+
+class FakeCollection:
+
+    def __init__(self, name: str, fail: bool = False):
+        self.name = name
+        self.fail = fail
+
+    def query(self, timeout=None, **kwargs):
+        if self.fail:
+            raise MilvusException(message="query failed")
+        return [{"index": 0}]
+
+
+def get_sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestMilvusMetrics(unittest.TestCase):
+
+    def test_query_is_timed(self):
+        labels = {"operation": "query", "collection": "metrics_test"}
+        before = get_sample("aeye_milvus_call_duration_seconds_count", labels)
+        result = asyncio.run(milvus_io.query(FakeCollection("metrics_test"), expr="index in [0]"))
+        self.assertEqual([{"index": 0}], result)
+        self.assertEqual(before + 1, get_sample("aeye_milvus_call_duration_seconds_count", labels))
+
+    def test_errors_are_counted(self):
+        labels = {"operation": "query", "collection": "metrics_test_errors"}
+        before = get_sample("aeye_milvus_call_errors_total", labels)
+        with self.assertRaises(MilvusException):
+            asyncio.run(milvus_io.query(FakeCollection("metrics_test_errors", fail=True), expr="index in [0]"))
+        self.assertEqual(before + 1, get_sample("aeye_milvus_call_errors_total", labels))
+        # Failed calls are also timed
+        self.assertEqual(1, get_sample("aeye_milvus_call_duration_seconds_count", labels))
+
+
+class TestResponseMetrics(unittest.TestCase):
+
+    def test_streamed_response(self):
+        async def body():
+            yield b'{"index":0}\n'
+            # The next page takes some time to be fetched
+            await asyncio.sleep(0.05)
+            yield b'{"index":1}\n'
+
+        async def send():
+            return [chunk async for chunk in observe_response(body(), "GET", "/metrics_test", 200,
+                                                              time.perf_counter())]
+
+        size_labels = {"route": "/metrics_test"}
+        duration_labels = {"method": "GET", "route": "/metrics_test", "status": "200"}
+        before = get_sample("aeye_http_response_size_bytes_sum", size_labels)
+        self.assertEqual([b'{"index":0}\n', b'{"index":1}\n'], asyncio.run(send()))
+        # The size and the duration are recorded once the whole body has been sent
+        self.assertEqual(before + 24, get_sample("aeye_http_response_size_bytes_sum", size_labels))
+        self.assertEqual(1, get_sample("aeye_http_response_size_bytes_count", size_labels))
+        self.assertEqual(1, get_sample("aeye_http_request_duration_seconds_count", duration_labels))
+        self.assertGreaterEqual(get_sample("aeye_http_request_duration_seconds_sum", duration_labels), 0.05)
+
+
+class TestMultiprocessMetrics(unittest.TestCase):
+
+    def run_process(self, code: str, directory: str) -> str:
+        # The metrics are written to the directory when PROMETHEUS_MULTIPROC_DIR is set before they are defined
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                env={**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory},
+                                cwd=os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+        return result.stdout
+
+    def test_metrics_of_other_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # The embeddings service records the forward passes, and a worker records a request
+            self.run_process("from backend.src.metrics import INFERENCE_BATCH_SIZE\n"
+                             "INFERENCE_BATCH_SIZE.labels('text').observe(4)", directory)
+            self.run_process("from backend.src.metrics import REQUEST_DURATION\n"
+                             "REQUEST_DURATION.labels('GET', '/api/tiles', 200).observe(0.01)", directory)
+            # Another worker serves /metrics
+            metrics = self.run_process("from backend.src.metrics import generate_metrics\n"
+                                       "print(generate_metrics().decode())", directory)
+        self.assertIn('aeye_inference_batch_size_sum{modality="text"} 4.0', metrics)
+        self.assertIn('aeye_http_request_duration_seconds_count{method="GET",route="/api/tiles",status="200"} 1.0',
+                      metrics)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+import threading
+import time
+import unittest
+
+from backend.src.app.residency import ResidencyManager, LOADED, RELEASED
+
+
+class FakeCollection:
+    def __init__(self, name: str, footprint: int, load_time: float = 0.0):
+        self.name = name
+        self.footprint = footprint
+        self.load_time = load_time
+        self.loaded = False
+        self.loads = 0
+        self.releases = 0
+
+    def load(self):
+        time.sleep(self.load_time)
+        self.loaded = True
+        self.loads += 1
+
+    def release(self):
+        self.loaded = False
+        self.releases += 1
+
+
+def make_manager(budget: int, policy: str = "lru", shared: bool = False,
+                 state_check_interval: float = 0) -> ResidencyManager:
+    return ResidencyManager(budget, policy, eviction_grace=0, load_timeout=5, estimate=lambda c: c.footprint,
+                            measure=lambda c: None, loaded=lambda c: c.loaded, shared=shared,
+                            state_check_interval=state_check_interval)
+
+
+class TestResidencyManager(unittest.TestCase):
+
+    def test_load_on_acquire(self):
+        manager = make_manager(100)
+        collection = FakeCollection("a", 10)
+        manager.register(collection)
+        self.assertTrue(manager.acquire("a"))
+        self.assertTrue(collection.loaded)
+        # A loaded collection is not loaded again
+        self.assertTrue(manager.acquire("a"))
+        self.assertEqual(1, collection.loads)
+        self.assertEqual(10, manager.stats()["resident_bytes"])
+
+    def test_lru_eviction(self):
+        manager = make_manager(25)
+        collections = {name: FakeCollection(name, 10) for name in "abc"}
+        for collection in collections.values():
+            manager.register(collection)
+        manager.acquire("a")
+        manager.acquire("b")
+        # Use "a", so that "b" is the least recently used collection
+        manager.acquire("a")
+        manager.acquire("c")
+
+        self.assertTrue(collections["a"].loaded)
+        self.assertFalse(collections["b"].loaded)
+        self.assertTrue(collections["c"].loaded)
+        stats = manager.stats()
+        self.assertEqual(1, stats["evictions"])
+        self.assertEqual(20, stats["resident_bytes"])
+        self.assertEqual(RELEASED, stats["collections"]["b"]["state"])
+
+    def test_lfu_eviction(self):
+        manager = make_manager(25, "lfu")
+        collections = {name: FakeCollection(name, 10) for name in "abc"}
+        for collection in collections.values():
+            manager.register(collection)
+        for _ in range(3):
+            manager.acquire("a")
+        manager.acquire("b")
+        # "a" is the least recently used collection, but the most frequently used
+        manager.acquire("c")
+        self.assertTrue(collections["a"].loaded)
+        self.assertFalse(collections["b"].loaded)
+        self.assertTrue(collections["c"].loaded)
+
+    def test_collections_in_use_are_not_evicted(self):
+        manager = ResidencyManager(15, eviction_grace=60, load_timeout=5, estimate=lambda c: c.footprint,
+                                   measure=lambda c: None, loaded=lambda c: c.loaded)
+        a, b = FakeCollection("a", 10), FakeCollection("b", 10)
+        manager.register(a)
+        manager.register(b)
+        manager.acquire("a")
+        manager.acquire("b")
+        # The budget is exceeded rather than releasing a collection used within the grace period
+        self.assertTrue(a.loaded and b.loaded)
+        self.assertEqual(0, manager.stats()["evictions"])
+
+    def test_background_prefetch(self):
+        manager = make_manager(100)
+        collection = FakeCollection("a", 10, load_time=0.2)
+        manager.register(collection)
+        manager.prefetch("a")
+        self.assertFalse(manager.is_ready("a"))
+        # Concurrent requests wait for the same load
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(manager.acquire("a"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([True] * 4, results)
+        self.assertEqual(1, collection.loads)
+        self.assertEqual(LOADED, manager.stats()["collections"]["a"]["state"])
+
+    def test_prefetch_without_eviction_respects_budget(self):
+        manager = make_manager(15)
+        a, b = FakeCollection("a", 10), FakeCollection("b", 10)
+        manager.register(a)
+        manager.register(b)
+        manager.acquire("a")
+        manager.prefetch("b", evict=False)
+        time.sleep(0.05)
+        self.assertFalse(b.loaded)
+
+    def test_already_loaded_collections_are_resident(self):
+        manager = make_manager(100)
+        collection = FakeCollection("a", 10)
+        collection.loaded = True
+        manager.register(collection)
+        self.assertTrue(manager.is_ready("a"))
+        self.assertEqual(10, manager.stats()["resident_bytes"])
+
+    def test_collections_shared_between_workers(self):
+        for shared in (False, True):
+            a, b = FakeCollection("a", 10), FakeCollection("b", 10)
+            worker, other_worker = make_manager(15, shared=shared), make_manager(15, shared=shared)
+            worker.register(a)
+            worker.register(b)
+            worker.acquire("a")
+            other_worker.register(a)
+            other_worker.register(b)
+            # The other worker releases the collection to make room for its own request
+            other_worker.acquire("b")
+            self.assertFalse(a.loaded)
+
+            if not shared:
+                # The worker trusts its own state, and returns a released collection
+                self.assertTrue(worker.acquire("a"))
+                self.assertFalse(a.loaded)
+                continue
+            # The worker finds that the collection has been released, and loads it again
+            self.assertTrue(worker.acquire("a"))
+            self.assertTrue(a.loaded)
+            self.assertEqual(2, a.loads)
+            # The worker counts the collection loaded by the other worker as resident
+            self.assertTrue(worker.acquire("b"))
+            self.assertEqual(20, worker.stats()["resident_bytes"])
+
+    def test_state_of_shared_collections_is_checked_periodically(self):
+        checks = []
+        manager = ResidencyManager(100, eviction_grace=0, load_timeout=5, estimate=lambda c: c.footprint,
+                                   measure=lambda c: None, loaded=lambda c: checks.append(c.name) or c.loaded,
+                                   shared=True, state_check_interval=0.2)
+        collection = FakeCollection("a", 10)
+        manager.register(collection)
+        manager.acquire("a")
+        checks.clear()
+        # Loaded collections are acquired without querying Milvus until their state is checked again
+        for _ in range(10):
+            self.assertTrue(manager.acquire("a"))
+        self.assertEqual([], checks)
+        # Another worker releases the collection
+        collection.release()
+        time.sleep(0.2)
+        self.assertTrue(manager.acquire("a"))
+        self.assertEqual(["a"], checks)
+        self.assertTrue(collection.loaded)
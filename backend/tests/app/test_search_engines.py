@@ -0,0 +1,110 @@
+import asyncio
+import re
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from backend.src.CONSTANTS import SEARCH_LIMIT
+from backend.src.app.gets import get_neighbors_batch
+from backend.src.app.search_engines import top_k_search, get_entities, LocalSearchEngine, MilvusSearchEngine
+from backend.src.app.stores import DatasetEmbeddings, NeighborGraph
+from backend.src.db_utilities.collections import get_embeddings_index
+
+
+def make_embeddings(n: int, dimension: int, seed: int = 0) -> np.ndarray:
+    matrix = np.random.default_rng(seed).normal(size=(n, dimension)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+class TestTopKSearch(unittest.TestCase):
+
+    def test_blocks_match_full_sort(self):
+        matrix = make_embeddings(1000, 16)
+        queries = make_embeddings(5, 16, seed=1)
+        expected = np.argsort(-(queries @ matrix.T), axis=1)[:, :10]
+        # The result must not depend on the size of the blocks
+        for block_size in (7, 100, 1000, 5000):
+            rows, scores = top_k_search(matrix, queries, 10, block_size)
+            np.testing.assert_array_equal(expected, rows)
+            np.testing.assert_allclose(np.take_along_axis(queries @ matrix.T, expected, axis=1), scores, rtol=1e-5)
+
+    def test_top_k_larger_than_matrix(self):
+        matrix = make_embeddings(3, 4)
+        rows, scores = top_k_search(matrix, matrix, 10, block_size=2)
+        self.assertEqual((3, 3), rows.shape)
+        # The most similar row to each row is itself
+        np.testing.assert_array_equal([0, 1, 2], rows[:, 0])
+
+
+class TestGetEntities(unittest.TestCase):
+
+    def test_queries_are_split_in_pages(self):
+        limits = []
+
+        async def query(collection, expr, output_fields, limit):
+            limits.append(limit)
+            # Index 7 is not in the collection
+            return [{"index": int(index)} for index in re.findall(r"\d+", expr) if int(index) != 7]
+
+        indexes = np.array([[3, 7, 5], [5, 9, 3], [1, 2, 8]])
+        with patch("backend.src.app.milvus_io.query", query):
+            rows = asyncio.run(get_entities(None, indexes, page_size=3))
+        # Each distinct index is fetched once, in queries within the page size
+        self.assertEqual([3, 3, 1], limits)
+        self.assertEqual([[3, 5], [5, 9, 3], [1, 2, 8]], [[entity["index"] for entity in row] for row in rows])
+
+
+    def test_neighbor_graph_batch_above_query_limit(self):
+        limits = []
+
+        async def query(collection, expr, output_fields, limit):
+            limits.append(limit)
+            return [{"index": int(index)} for index in re.findall(r"\d+", expr)]
+
+        n = 2 * SEARCH_LIMIT
+        graph = NeighborGraph(np.random.default_rng(0).integers(0, n, size=(n, 100)), np.zeros((n, 100)), 0)
+        embeddings = DatasetEmbeddings(np.arange(n), np.zeros((n, 2), dtype=np.float32), 0)
+        indexes = list(range(0, n, 2))[:1024]
+        with patch("backend.src.app.milvus_io.query", query):
+            neighbors = asyncio.run(get_neighbors_batch(indexes, None, 100, embeddings, graph=graph))
+        # The neighbors of the batch are more than a single query can return
+        self.assertGreater(sum(limits), SEARCH_LIMIT)
+        self.assertTrue(all(limit <= SEARCH_LIMIT for limit in limits))
+        self.assertEqual([[index] + graph.indexes[index].tolist() for index in indexes],
+                         [[entity["index"] for entity in row] for row in neighbors])
+
+
+class TestLocalSearchEngine(unittest.TestCase):
+
+    def test_search_indexes(self):
+        matrix = make_embeddings(50, 8)
+        ids = np.arange(100, 150)
+        engine = LocalSearchEngine(DatasetEmbeddings(ids, matrix, 0), block_size=16)
+        # Queries do not need to be normalized
+        indexes, scores = engine.search_indexes(3 * matrix[[4, 20]], 5)
+        np.testing.assert_array_equal([104, 120], indexes[:, 0])
+        np.testing.assert_allclose([1.0, 1.0], scores[:, 0], rtol=1e-5)
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+
+class TestMilvusSearchEngine(unittest.TestCase):
+
+    def test_embeddings_index(self):
+        # FLAT is used when the dataset does not choose an index
+        self.assertEqual({"index_type": "FLAT", "params": {}, "search_params": {}},
+                         get_embeddings_index({"name": "dataset"}))
+        # Missing parameters take their default values
+        index = get_embeddings_index({"name": "dataset", "embeddings_index": {"index_type": "HNSW",
+                                                                             "search_params": {"ef": 128}}})
+        self.assertEqual({"M": 16, "efConstruction": 200}, index["params"])
+        self.assertEqual({"ef": 128}, index["search_params"])
+        with self.assertRaises(ValueError):
+            get_embeddings_index({"name": "dataset", "embeddings_index": {"index_type": "ANNOY"}})
+
+    def test_search_params(self):
+        engine = MilvusSearchEngine({"ef": 64})
+        self.assertEqual({"metric_type": "COSINE", "offset": 0, "params": {"ef": 64}}, engine.get_search_params(10))
+        # ef is increased when more results than ef are requested
+        self.assertEqual({"ef": 101}, engine.get_search_params(101)["params"])
+        self.assertEqual({"nprobe": 16}, MilvusSearchEngine({"nprobe": 16}).get_search_params(500)["params"])
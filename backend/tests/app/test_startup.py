@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+
+from fastapi import HTTPException
+
+from backend.src.app.startup import FAILED, PENDING, READY, Requirement, Startup
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_background_initialization(self):
+        startup = Startup()
+        release = threading.Event()
+        startup.add("catalog")
+        startup.add("model", lambda: release.wait(5))
+        requirement = Requirement(startup, "model")
+
+        # Components without initialization are ready immediately, while the others are initialized in the background
+        self.assertTrue(startup.is_ready(["catalog"]))
+        self.assertFalse(startup.is_ready())
+        self.assertEqual(PENDING, startup.status()["model"]["state"])
+        with self.assertRaises(HTTPException) as context:
+            requirement()
+        self.assertEqual(503, context.exception.status_code)
+
+        release.set()
+        self.assertTrue(startup.wait("model", 5))
+        self.assertTrue(startup.is_ready())
+        self.assertEqual(READY, startup.status()["model"]["state"])
+        requirement()
+
+    def test_failed_initialization(self):
+        def fail():
+            raise RuntimeError("model not found")
+
+        startup = Startup()
+        startup.add("model", fail)
+        self.assertFalse(startup.wait("model", 5))
+        self.assertEqual(FAILED, startup.status()["model"]["state"])
+        self.assertEqual("model not found", startup.status()["model"]["error"])
+        # Unknown components are never ready
+        self.assertFalse(startup.is_ready(["umap"]))
+
+    def test_retried_initialization(self):
+        failures = [RuntimeError("Milvus is not up"), RuntimeError("Milvus is not up")]
+        release = threading.Event()
+
+        def connect():
+            if len(failures) > 0:
+                raise failures.pop()
+            release.wait(5)
+
+        startup = Startup(retries=2, backoff=0.01)
+        startup.add("umap", connect)
+        # The component stays pending while its initialization is retried
+        self.assertEqual(PENDING, startup.status()["umap"]["state"])
+        release.set()
+        self.assertTrue(startup.wait("umap", 5))
+        self.assertEqual({"state": READY, "error": None, "attempts": 3},
+                         {key: value for key, value in startup.status()["umap"].items() if key != "seconds"})
+
+        # The component fails once the retries are exhausted
+        failures.extend([RuntimeError("Milvus is not up")] * 3)
+        startup.add("collections", connect)
+        self.assertFalse(startup.wait("collections", 5))
+        self.assertEqual(FAILED, startup.status()["collections"]["state"])
+        self.assertEqual(3, startup.status()["collections"]["attempts"])
+
+    def test_required_components(self):
+        connected = threading.Event()
+        startup = Startup(retries=0)
+        startup.add("milvus", lambda: connected.wait(5))
+        startup.add("catalog", lambda: None, requires=["milvus"])
+        # The component is initialized once the components it requires are ready
+        self.assertEqual(PENDING, startup.status()["catalog"]["state"])
+        connected.set()
+        self.assertTrue(startup.wait("catalog", 5))
+
+        # The component fails while a component it requires has failed
+        startup.add("model", lambda: 1 / 0)
+        startup.add("embedder", lambda: None, requires=["model"])
+        self.assertFalse(startup.wait("embedder", 5))
+        self.assertEqual("model is not ready", startup.status()["embedder"]["error"])
+
+    def test_failed_components_are_retried(self):
+        failures = [RuntimeError("Milvus is not up")] * 3
+        ready = threading.Event()
+
+        def connect():
+            if len(failures) > 0:
+                raise failures.pop()
+            ready.set()
+
+        startup = Startup(retries=1, backoff=0.01, max_backoff=0.05, retry_failed=True)
+        startup.add("milvus", connect)
+        # The component is reported as failed, but it is still retried
+        self.assertFalse(startup.wait("milvus", 5))
+        self.assertEqual(FAILED, startup.status()["milvus"]["state"])
+        self.assertTrue(ready.wait(5))
+        deadline = time.monotonic() + 5
+        while not startup.is_ready(["milvus"]) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual({"state": READY, "error": None, "attempts": 4},
+                         {key: value for key, value in startup.status()["milvus"].items() if key != "seconds"})
+
+
+if __name__ == "__main__":
+    unittest.main()
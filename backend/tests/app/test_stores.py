@@ -0,0 +1,153 @@
+import asyncio
+import json
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from backend.src.app.stores import (FirstTilesStore, EmbeddingsStore, MetadataStore, NeighborGraphStore, UMAPStore,
+                                    get_umap_index)
+from backend.src.db_utilities.artifacts import save_first_tiles, save_embeddings, save_metadata, save_neighbor_graph
+from backend.src.db_utilities.create_neighbor_graph import compute_neighbor_graph
+
+
+class TestFirstTilesStore(unittest.TestCase):
+
+    def test_first_tiles(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            store = FirstTilesStore(data_dir)
+            self.assertIsNone(store("dataset"))
+
+            tiles = [{"index": 1, "data": []},
+                     {"index": 0, "data": [], "range": {"x_min": 0.0, "x_max": 1.0, "y_min": 0.0, "y_max": 1.0}}]
+            save_first_tiles(data_dir, "dataset", tiles)
+            payload = store("dataset")
+            # Tiles are sorted by index
+            self.assertEqual(sorted(tiles, key=lambda tile: tile["index"]), json.loads(payload.decompressed))
+            # The NDJSON encoding has one tile per line
+            self.assertEqual(json.loads(payload.decompressed),
+                             [json.loads(line) for line in payload.ndjson.decode("utf-8").splitlines()])
+            self.assertNotEqual(payload.etag, payload.ndjson_etag)
+            # The file is read only once
+            self.assertIs(payload, store("dataset"))
+
+
+class TestEmbeddingsStore(unittest.TestCase):
+
+    def test_embeddings(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            store = EmbeddingsStore(data_dir)
+            self.assertIsNone(store("dataset"))
+
+            save_embeddings(data_dir, "dataset", [2, 0, 1], np.array([[3.0, 0.0], [0.0, 2.0], [1.0, 1.0]]))
+            embeddings = store("dataset")
+            self.assertTrue(embeddings.contiguous)
+            # Rows are sorted by index and normalized
+            np.testing.assert_allclose([[0.0, 1.0], [1.0, 0.0]], embeddings.get_vectors([0, 2]))
+            np.testing.assert_allclose(np.ones(3), np.linalg.norm(embeddings.matrix, axis=1), rtol=1e-6)
+            self.assertIsNone(embeddings.get_vectors([0, 3]))
+
+    def test_non_contiguous_indexes(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            save_embeddings(data_dir, "dataset", [10, 5], np.array([[1.0, 0.0], [0.0, 1.0]]))
+            embeddings = EmbeddingsStore(data_dir)("dataset")
+            self.assertFalse(embeddings.contiguous)
+            np.testing.assert_array_equal([0, 1, -1, -1, -1], embeddings.get_rows([5, 10, 7, 100, -1]))
+
+
+class TestMetadataStore(unittest.TestCase):
+
+    def test_metadata(self):
+        entities = [
+            {"index": 7, "path": "7-Frida_Kahlo.jpg", "width": 640, "height": 480, "x": 0.5, "embedding": [0.1, 0.2],
+             "caption": "a portrait"},
+            {"index": 3, "path": "3-Hokusai.jpg", "width": np.int64(800), "height": 600, "x": -1.25,
+             "embedding": [0.3, 0.4]},
+            {"index": 5, "path": "5-Ren\u00e9_Magritte.jpg", "width": 1024, "height": 768, "x": 2, "embedding": [0.5, 0.6],
+             "caption": "a pipe"}
+        ]
+        with tempfile.TemporaryDirectory() as data_dir:
+            store = MetadataStore(data_dir)
+            self.assertIsNone(store("dataset"))
+
+            save_metadata(data_dir, "dataset", entities)
+            metadata = store("dataset")
+            # Fields that are not set for every image, and the embeddings, are not stored
+            self.assertEqual(["height", "index", "path", "width", "x"], sorted(metadata.fields))
+            # Images are returned in the order of the indexes, with the requested fields only
+            self.assertEqual([{"index": 5, "path": "5-Ren\u00e9_Magritte.jpg", "width": 1024},
+                              {"index": 3, "path": "3-Hokusai.jpg", "width": 800}],
+                             metadata.get([5, 4, 3], ["path", "width"]))
+            self.assertEqual([{"index": 7, "x": 0.5}, {"index": 5, "x": 2.0}], metadata.get([7, 5], ["x"]))
+            self.assertIs(metadata, store("dataset"))
+
+
+class TestNeighborGraphStore(unittest.TestCase):
+
+    def test_neighbor_graph(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            rng = np.random.default_rng(0)
+            embeddings = rng.normal(size=(50, 8))
+            indexes = np.arange(100, 150)
+            save_embeddings(data_dir, "dataset", indexes, embeddings)
+            store = NeighborGraphStore(EmbeddingsStore(data_dir))
+            self.assertIsNone(store("dataset"))
+
+            neighbor_indexes, neighbor_scores = compute_neighbor_graph(data_dir, "dataset", 5, processes=2)
+            save_neighbor_graph(data_dir, "dataset", neighbor_indexes, neighbor_scores)
+            graph = store("dataset")
+            self.assertEqual(5, graph.k)
+            self.assertEqual(np.int32, graph.indexes.dtype)
+            self.assertEqual(np.float16, graph.scores.dtype)
+
+            # The neighbors are the most similar images, excluding the image itself
+            normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+            similarities = normalized @ normalized.T
+            np.fill_diagonal(similarities, -np.inf)
+            expected = indexes[np.argsort(-similarities, axis=1)[:, :3]]
+            np.testing.assert_array_equal(expected[[0, 7]], graph.get_neighbors(np.array([0, 7]), 3))
+
+
+class FakeUMAPCollection:
+    def __init__(self):
+        self.collection_id = 1
+        self.num_entities = 48
+
+    def describe(self):
+        return {"collection_id": self.collection_id}
+
+
+class TestUMAPStore(unittest.TestCase):
+
+    def test_umap_store(self):
+        collection = FakeUMAPCollection()
+        loads = []
+
+        async def load(c):
+            loads.append(c)
+            return {index: [0.5, -1.25, float(index), 3.0] for index in range(48)}
+
+        async def run():
+            store = UMAPStore(lambda: collection, load, validation_interval=0)
+            projection = await store.get(200, 0.99)
+            self.assertEqual({"x": [0.5, 47.0], "y": [-1.25, 3.0]}, json.loads(projection.encode("json")))
+            # The projections are decoded again only when the collection is rebuilt
+            await store.get(3, 0.0)
+            self.assertEqual(1, len(loads))
+            collection.collection_id = 2
+            await store.get(3, 0.0)
+            self.assertEqual(2, len(loads))
+            with self.assertRaises(ValueError):
+                await store.get(4, 0.0)
+            return projection
+
+        projection = asyncio.run(run())
+        data = projection.encode("float16")
+        self.assertEqual((b"AEYU", 2, 2), struct.unpack_from("<4sBxxxI", data))
+        np.testing.assert_array_equal([0.5, 47.0, -1.25, 3.0], np.frombuffer(data[12:], dtype="<f2"))
+        self.assertNotEqual(projection.etag("json"), projection.etag("float32"))
+
+    def test_umap_index(self):
+        self.assertEqual(0, get_umap_index(3, 0.0))
+        self.assertEqual(47, get_umap_index(200, 0.99))
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import re
+import unittest
+
+import numpy as np
+
+from backend.src.app import gets
+from backend.src.app.tile_codec import (encode_tiles, encode_image_to_tile, decode, accepts_binary, TILES_MEDIA_TYPE,
+                                        encode_ndjson, accepts_ndjson, NDJSON_MEDIA_TYPE)
+from backend.src.db_utilities.collections import ZOOM_LEVEL_VECTOR_FIELD_NAME
+from backend.src.db_utilities.create_and_populate_clusters_collection import create_tile_entity, get_index_from_tile
+
+
+def make_representative(index: int, path: str) -> dict:
+    return {"index": index, "path": path, "x": index * 0.1 - 3.7, "y": 1.0 / (index + 3), "width": 640 + index,
+            "height": 480, "zoom": index % 8}
+
+
+class FakeClustersCollection:
+    """
+    Clusters collection storing the entities as Milvus does: the "data" field and the dynamic "range" field are stored
+    as JSON, and only the requested fields that an entity has are returned.
+    """
+
+    def __init__(self, entities: list):
+        self.name = "dataset_zoom_levels_clusters"
+        self.entities = {entity["index"]: json.loads(json.dumps(entity)) for entity in entities}
+        self.num_entities = len(entities)
+
+    def query(self, expr: str, output_fields: list, limit: int | None = None, timeout: float | None = None):
+        indexes = [int(index) for index in re.findall(r"\d+", expr)]
+        return [{field: self.entities[index][field] for field in output_fields if field in self.entities[index]}
+                for index in indexes if index in self.entities]
+
+
+def make_clusters_entities() -> list:
+    """
+    Build the entities of a clusters collection with the function of the script populating it, from zoom levels holding
+    numpy values, as computed by the clustering.
+    """
+    def make_cell(indexes: list, bounds: tuple | None = None) -> dict:
+        cell = {"representatives": [{"representative": {
+            "index": np.int64(index), "path": np.str_(f"{index}-image.jpg"), "x": np.float32(index / 7 - 1),
+            "y": np.float64(1 / (index + 3)), "width": np.int64(640 + index), "height": np.int32(480)
+        }} for index in indexes]}
+        if bounds is not None:
+            cell["range"] = dict(zip(["x_min", "x_max", "y_min", "y_max"], map(np.float32, bounds)))
+        return cell
+
+    zoom_levels = {
+        0: {0: {0: make_cell([3, 12], (-1.5, 0.75, 0.1, 2.0))}},
+        # One of the tiles has no representative
+        1: {0: {0: make_cell([3]), 1: make_cell([])}, 1: {0: make_cell([12, 20]), 1: make_cell([41])}}
+    }
+    images_to_tile = {np.int64(index): [np.int64(index % 2)] for index in (3, 12, 20, 41)}
+    return [create_tile_entity(zoom_levels, images_to_tile, zoom, tile_x, tile_y)
+            for zoom in zoom_levels.keys() for tile_x in zoom_levels[zoom].keys()
+            for tile_y in zoom_levels[zoom][tile_x].keys()]
+
+
+class TestTileCodec(unittest.TestCase):
+
+    def test_collection_tiles_round_trip(self):
+        collection = FakeClustersCollection(make_clusters_entities())
+        tiles = asyncio.run(gets.get_tiles([get_index_from_tile(1, x, y) for x in (0, 1) for y in (0, 1)], collection))
+        first_tiles = asyncio.run(gets.get_first_tiles(collection))
+        self.assertEqual([[]], [tile["data"] for tile in tiles if len(tile["data"]) == 0])
+        self.assertIn("range", first_tiles[0])
+        # The tiles returned by the endpoints decode to their JSON response
+        for response in (tiles, first_tiles):
+            self.assertEqual(json.loads(json.dumps(response)), decode(encode_tiles(response)))
+
+    def test_tiles_round_trip(self):
+        tiles = [
+            {"index": 0, "data": [make_representative(1, "1-Alfred_Sisley.jpg"), make_representative(7, "7-ä.jpg")],
+             "range": {"x_min": -3.5, "x_max": 12.25, "y_min": 0.1, "y_max": 9.0}},
+            {"index": 1, "data": []},
+            {"index": 4, "data": [make_representative(7, "7-ä.jpg"), make_representative(1234567, "x.png")]}
+        ]
+        # The decoded tiles must be equal to the tiles returned as JSON
+        self.assertEqual(json.loads(json.dumps(tiles)), decode(encode_tiles(tiles)))
+        # Paths are stored only once
+        self.assertEqual(1, encode_tiles(tiles).count("7-ä.jpg".encode("utf-8")))
+
+    def test_empty_tiles(self):
+        self.assertEqual([], decode(encode_tiles([])))
+
+    def test_binary_is_smaller_than_json(self):
+        tiles = [{"index": i, "data": [make_representative(30 * i + j, f"{30 * i + j}-image.jpg") for j in range(30)]}
+                 for i in range(50)]
+        self.assertLess(len(encode_tiles(tiles)), len(json.dumps(tiles)))
+
+    def test_image_to_tile_round_trip(self):
+        tile_data = {"index": 2881, ZOOM_LEVEL_VECTOR_FIELD_NAME: [7, 112, 22]}
+        self.assertEqual(tile_data, decode(encode_image_to_tile(tile_data)))
+
+    def test_accepts_binary(self):
+        self.assertTrue(accepts_binary(f"{TILES_MEDIA_TYPE}, application/json;q=0.5"))
+        self.assertFalse(accepts_binary("application/json"))
+        self.assertFalse(accepts_binary(None))
+
+    def test_ndjson(self):
+        tiles = [
+            {"index": 0, "data": [make_representative(1, "1-Alfred_Sisley.jpg")],
+             "range": {"x_min": -3.5, "x_max": 12.25, "y_min": 0.1, "y_max": 9.0}},
+            {"index": 4, "data": [make_representative(7, "7-ä.jpg")]}
+        ]
+        lines = encode_ndjson(tiles).decode("utf-8").split("\n")
+        # One tile per line, and the payload ends with a newline
+        self.assertEqual([""], lines[2:])
+        self.assertEqual(tiles, [json.loads(line) for line in lines[:2]])
+        self.assertEqual(b"", encode_ndjson([]))
+
+    def test_accepts_ndjson(self):
+        self.assertTrue(accepts_ndjson(f"{NDJSON_MEDIA_TYPE}, application/json;q=0.5"))
+        self.assertFalse(accepts_ndjson(TILES_MEDIA_TYPE))
+        self.assertFalse(accepts_ndjson(None))
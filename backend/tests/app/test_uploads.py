@@ -0,0 +1,73 @@
+import asyncio
+import unittest
+from io import BytesIO
+
+import numpy as np
+import torch
+from PIL import Image
+
+from backend.src.app.cache import ImageEmbeddingCache
+from backend.src.app.uploads import ImageTooLargeError, UploadEmbedder, decode_image
+
+
+def make_image(width: int, height: int, format: str) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (200, 100, 50)).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class FakeEmbeddings:
+
+    def __init__(self):
+        self.calls = 0
+        self.sizes = []
+
+    def getImageEmbeddings(self, image):
+        self.calls += 1
+        self.sizes.append(image.size)
+        return torch.ones((1, 4))
+
+
+class TestDecodeImage(unittest.TestCase):
+
+    def test_jpeg_is_downscaled_by_decoder(self):
+        image = decode_image(make_image(2000, 1500, "JPEG"), max_pixels=10 ** 7, size=224)
+        self.assertEqual("RGB", image.mode)
+        # The decoder scales by 1/4, the largest factor keeping both sides at least 224 pixels
+        self.assertEqual((500, 375), image.size)
+
+    def test_png_is_reduced(self):
+        image = decode_image(make_image(1000, 900, "PNG"), max_pixels=10 ** 7, size=224)
+        self.assertEqual((250, 225), image.size)
+
+    def test_small_image_is_not_resized(self):
+        image = decode_image(make_image(300, 200, "PNG"), max_pixels=10 ** 7, size=224)
+        self.assertEqual((300, 200), image.size)
+
+    def test_pixel_limit(self):
+        with self.assertRaises(ImageTooLargeError):
+            decode_image(make_image(1000, 1000, "JPEG"), max_pixels=999999)
+
+
+class TestUploadEmbedder(unittest.TestCase):
+
+    def test_embeddings_are_cached_by_content(self):
+        model = FakeEmbeddings()
+        embedder = UploadEmbedder(model, ImageEmbeddingCache("test", 2), max_pixels=10 ** 7, workers=1)
+        data = make_image(800, 600, "JPEG")
+
+        first = asyncio.run(embedder(data))
+        second = asyncio.run(embedder(data))
+        self.assertEqual(1, model.calls)
+        self.assertEqual((1, 4), second.shape)
+        np.testing.assert_array_equal(first, second)
+        # The model receives the downscaled image
+        self.assertEqual([(400, 300)], model.sizes)
+
+        # A different image is embedded again
+        asyncio.run(embedder(make_image(800, 601, "JPEG")))
+        self.assertEqual(2, model.calls)
+
+
+if __name__ == "__main__":
+    unittest.main()
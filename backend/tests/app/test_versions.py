@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import unittest
+
+from fastapi import Depends, FastAPI, Query, Response
+from fastapi.testclient import TestClient
+
+from backend.src.app.catalog import Catalog
+from backend.src.app.versions import ConditionalGetter, matches_etag
+from backend.src.db_utilities.versions import compute_version, save_dataset_version, ContentVersion
+
+
+class TestConditionalGetter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "datasets.json")
+        with open(self.path, "w") as f:
+            json.dump({"datasets": [{"name": "a", "website_name": "a", "zoom_levels": 3}]}, f)
+        self.catalog = Catalog(self.path, refresh_interval=3600, stat_interval=0, list_collections=lambda: ["a"])
+        self.calls = 0
+        self.saves = 0
+
+        getter = ConditionalGetter(self.catalog, "clusters", "_zoom_levels_clusters")
+        app = FastAPI()
+
+        @app.get("/api/tiles")
+        async def get_tiles(response: Response, indexes: str, collection: str = Query(...),
+                            caching_headers: dict = Depends(getter)):
+            # Count the requests that reach the data
+            self.calls += 1
+            response.headers.update(caching_headers)
+            return {"indexes": indexes}
+
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def save_version(self, content: str = "tiles") -> str:
+        version = compute_version(content)
+        save_dataset_version(self.path, "a", "clusters", version)
+        # Make sure the modification time changes
+        self.saves += 1
+        os.utime(self.path, ns=(self.saves + 10 ** 9, self.saves + 10 ** 9))
+        return version
+
+    def test_no_version(self):
+        response = self.client.get("/api/tiles", params={"indexes": "1,2", "collection": "a_zoom_levels_clusters"})
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn("etag", response.headers)
+
+    def test_not_modified(self):
+        version = self.save_version()
+        params = {"indexes": "1,2", "collection": "a_zoom_levels_clusters"}
+        response = self.client.get("/api/tiles", params=params)
+        etag = response.headers["etag"]
+        self.assertEqual(1, self.calls)
+        self.assertIn("max-age", response.headers["cache-control"])
+
+        # A matching ETag is answered without reaching the data
+        response = self.client.get("/api/tiles", params=params, headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response.headers["etag"])
+        self.assertEqual(1, self.calls)
+
+        # Other parameters and other representations have other ETags
+        other = self.client.get("/api/tiles", params={**params, "indexes": "3"}, headers={"If-None-Match": etag})
+        self.assertEqual(200, other.status_code)
+        binary = self.client.get("/api/tiles", params=params,
+                                 headers={"If-None-Match": etag, "Accept": "application/vnd.aeye.tiles"})
+        self.assertEqual(200, binary.status_code)
+        ndjson = self.client.get("/api/tiles", params=params,
+                                 headers={"If-None-Match": etag, "Accept": "application/x-ndjson"})
+        self.assertEqual(200, ndjson.status_code)
+        self.assertNotIn(ndjson.headers["etag"], [etag, binary.headers["etag"]])
+
+        # Requests for the current version can be cached for a long time, with the same ETag
+        versioned = self.client.get("/api/tiles", params={**params, "v": version})
+        self.assertEqual(etag, versioned.headers["etag"])
+        self.assertIn("immutable", versioned.headers["cache-control"])
+
+        # A build with the same content keeps the ETag
+        self.save_version()
+        response = self.client.get("/api/tiles", params=params, headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+
+        # A build with another content changes the ETag
+        self.save_version("other tiles")
+        response = self.client.get("/api/tiles", params=params, headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers["etag"])
+
+    def test_shared_version(self):
+        with open(self.path, "w") as f:
+            json.dump({"datasets": [{"name": "a"}, {"name": "b"}]}, f)
+        save_dataset_version(self.path, "a", "umap", "1")
+        save_dataset_version(self.path, "b", "clusters", "2")
+        # The UMAP collection is rebuilt from another dataset
+        save_dataset_version(self.path, "b", "umap", "3")
+        with open(self.path, "r") as f:
+            datasets = json.load(f)["datasets"]
+        self.assertEqual({}, datasets[0]["versions"])
+        self.assertEqual({"clusters": "2", "umap": "3"}, datasets[1]["versions"])
+        with self.assertRaises(ValueError):
+            save_dataset_version(self.path, "c", "umap", "4")
+
+    def test_content_version(self):
+        entities = [{"index": i, "data": [i, 2 * i]} for i in range(10)]
+        version, reversed_version, other_version = ContentVersion(), ContentVersion(), ContentVersion()
+        for entity in entities:
+            version.add(entity)
+            other_version.add({**entity, "data": []})
+        for entity in reversed(entities):
+            reversed_version.add(entity)
+        # The version only depends on the inserted entities
+        self.assertEqual(version.hexdigest(), reversed_version.hexdigest())
+        self.assertNotEqual(version.hexdigest(), other_version.hexdigest())
+
+    def test_matches_etag(self):
+        self.assertTrue(matches_etag('"b", "a"', '"a"'))
+        self.assertTrue(matches_etag('W/"a"', '"a"'))
+        self.assertTrue(matches_etag("*", '"a"'))
+        self.assertFalse(matches_etag('"b"', '"a"'))
+        self.assertFalse(matches_etag(None, '"a"'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from backend.src.app.viewport import convert_index_to_tile, convert_tile_to_index, get_missing_indexes, get_tiles
+
+
+class TestViewport(unittest.TestCase):
+
+    def test_index_conversion(self):
+        self.assertEqual(0, convert_tile_to_index(0, 0, 0))
+        self.assertEqual(1, convert_tile_to_index(0, 0, 1))
+        self.assertEqual(5 + 4 * 3 + 2, convert_tile_to_index(3, 2, 2))
+        for index in range(2000):
+            self.assertEqual(index, convert_tile_to_index(*convert_index_to_tile(index)))
+
+    def test_full_prefetch_set(self):
+        tiles = get_tiles(17, 18, 5, 7)
+        # Same number of tiles as getTilesToFetch in the frontend, without duplicates
+        self.assertEqual(25 * 3 + (25 * 4 + 44) * 5, len(tiles))
+        self.assertEqual(len(tiles), len(set(tiles)))
+        self.assertEqual((17, 18, 5), tiles[0])
+        self.assertEqual({3, 4, 5, 6, 7}, {zoom for _, _, zoom in tiles})
+
+        # The next zoom levels stop at the maximum zoom level, and tiles stay inside the grid of their zoom level
+        tiles = get_tiles(0, 0, 2, 3)
+        self.assertEqual({0, 1, 2, 3}, {zoom for _, _, zoom in tiles})
+        self.assertTrue(all(0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom for x, y, zoom in tiles))
+
+    def test_modes(self):
+        self.assertEqual(25, len(get_tiles(5, 7, 5, 7, "translation")))
+        self.assertEqual(4, len(get_tiles(1, 1, 1, 7, "translation")))
+        self.assertEqual({4, 5, 6}, {zoom for _, _, zoom in get_tiles(5, 7, 5, 7, "zoom")})
+        with self.assertRaises(ValueError):
+            get_tiles(5, 7, 5, 7, "pan")
+
+    def test_missing_indexes(self):
+        indexes = get_missing_indexes(17, 18, 5, 7, set())
+        cached = set(indexes[:100])
+        missing = get_missing_indexes(17, 18, 5, 7, cached)
+        self.assertEqual(indexes[100:], missing)
+        self.assertEqual([], get_missing_indexes(17, 18, 5, 7, set(indexes)))
+
+
+if __name__ == "__main__":
+    unittest.main()